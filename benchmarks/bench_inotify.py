@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018 Clément Warneys <clement.warneys@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures how many inotify events per second are read and parsed by the original
+:py:class:`watchdog.observers.inotify_c.Inotify` class, and by the revised
+:py:class:`lazydog.revised_watchdog.observers.inotify_c.Inotify` class.
+
+Files are created by rounds (fewer than the kernel event queue can keep), 
+then only the reading of the queued events is timed, until the queue is empty.
+
+Usage (default is 200 000 events, by rounds of 10 000)::
+
+    $ python3 benchmarks/bench_inotify.py [number_of_events] [round_size] [tree_dir]
+
+"""
+
+import os
+import sys
+import time
+import select
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from watchdog.observers.inotify_c import Inotify as WatchdogInotify
+from lazydog.revised_watchdog.observers.inotify_c import Inotify as LazydogInotify
+
+
+def read_all(inotify) -> tuple:
+    # returns the number of events read, and the duration of the reads
+    qty = 0
+    duration = time.perf_counter()
+    while select.select([inotify._inotify_fd], [], [], 0)[0]:
+        qty += len(inotify.read_events())
+    return qty, time.perf_counter() - duration
+
+
+def bench(inotify_class, root:str, events:int, round_size:int) -> tuple:
+    watched = os.path.join(root, inotify_class.__module__.replace('.', '_'))
+    os.mkdir(watched)
+    inotify = inotify_class(watched.encode(), recursive=True)
+    qty = 0
+    duration = 0.0
+    try:
+        for r in range(0, events, round_size):
+            for i in range(r, min(r + round_size, events)):
+                os.mknod(os.path.join(watched, 'file-with-a-usual-name-%08d.txt' % i))
+            round_qty, round_duration = read_all(inotify)
+            qty += round_qty
+            duration += round_duration
+    finally:
+        inotify.close()
+        shutil.rmtree(watched)
+    return qty, duration
+
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    round_size = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    root = sys.argv[3] if len(sys.argv) > 3 else tempfile.mkdtemp(prefix='lazydog-bench-')
+    for name, inotify_class in [('watchdog', WatchdogInotify), ('lazydog', LazydogInotify)]:
+        qty, duration = bench(inotify_class, root, events, round_size)
+        print('%-10s %9d events in %.3f s: %10.0f events/s' % (name, qty, duration, qty / duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018 Clément Warneys <clement.warneys@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the effect of hashing a cold tree on a co-located read workload,
+with the default and with the ``io_friendly`` mode of
+:py:func:`lazydog.dropbox_content_hasher.default_hash_function`.
+
+A reader process keeps reading a "hot" file set (as a co-located application
+server would), while the cold tree is hashed. For each mode (default,
+``io_friendly``, and ``io_friendly`` with :py:func:`lazydog.indexers.lower_io_priority`),
+the script prints the read latencies of the hot set, and the share of the cold
+tree left in the page cache after hashing (measured with ``mincore(2)``).
+
+To be meaningful, the cold tree must be larger than the free memory of the
+host, so that hashing it in the default mode evicts the hot set::
+
+    $ python3 benchmarks/bench_page_cache.py [cold_size_mb] [hot_size_mb] [tree_dir]
+
+"""
+
+import os
+import sys
+import mmap
+import time
+import ctypes
+import tempfile
+import threading
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lazydog.dropbox_content_hasher import default_hash_function
+from lazydog.indexers import lower_io_priority
+
+FILE_SIZE = 64 * 1024 * 1024
+READ_SIZE = 64 * 1024
+
+
+def build_files(root:str, prefix:str, size_mb:int) -> list:
+    paths = []
+    for i in range(max(size_mb * 1024 * 1024 // FILE_SIZE, 1)):
+        path = os.path.join(root, '%s%04d' % (prefix, i))
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                for _ in range(FILE_SIZE // (1024 * 1024)):
+                    f.write(os.urandom(1024 * 1024))
+        paths.append(path)
+    return paths
+
+
+def drop_from_cache(paths:list):
+    for path in paths:
+        with open(path, 'rb') as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def cached_ratio(paths:list) -> float:
+    libc = ctypes.CDLL(None, use_errno=True)
+    page_size = mmap.PAGESIZE
+    cached = total = 0
+    for path in paths:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_COPY)
+            buffer = ctypes.c_char.from_buffer(mm)
+            pages = (size + page_size - 1) // page_size
+            vector = (ctypes.c_ubyte * pages)()
+            libc.mincore(ctypes.c_void_p(ctypes.addressof(buffer)), ctypes.c_size_t(size), vector)
+            cached += sum(x & 1 for x in vector)
+            total += pages
+            del buffer
+            mm.close()
+    return cached / total if total else 0.0
+
+
+def read_hot_set(paths:list, stop, results):
+    latencies = []
+    offset = 0
+    while not stop.is_set():
+        for path in paths:
+            with open(path, 'rb') as f:
+                f.seek(offset % FILE_SIZE)
+                duration = time.perf_counter()
+                f.read(READ_SIZE)
+                latencies.append(time.perf_counter() - duration)
+        offset += 7 * READ_SIZE
+        # leave some CPU to the hashing
+        time.sleep(0.001)
+    results.put(latencies)
+
+
+def hash_cold_tree(paths:list, io_friendly:bool, low_priority:bool):
+    if low_priority:
+        lower_io_priority()
+    for path in paths:
+        default_hash_function(path, io_friendly=io_friendly)
+
+
+def percentile(values:list, p:float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)] if values else 0.0
+
+
+def main():
+    cold_size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+    hot_size_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    root = sys.argv[3] if len(sys.argv) > 3 else tempfile.mkdtemp(prefix='lazydog-bench-')
+    print('Building %d MB of cold files and %d MB of hot files in %s...' % (cold_size_mb, hot_size_mb, root))
+    cold = build_files(root, 'cold', cold_size_mb)
+    hot = build_files(root, 'hot', hot_size_mb)
+
+    for name, io_friendly, low_priority in [('default', False, False), 
+                                            ('io_friendly', True, False), 
+                                            ('io_friendly+idle', True, True)]:
+        drop_from_cache(cold)
+        # warm the hot set up
+        for path in hot:
+            with open(path, 'rb') as f:
+                while f.read(1024 * 1024):
+                    pass
+        stop = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        reader = multiprocessing.Process(target=read_hot_set, args=(hot, stop, results))
+        reader.start()
+        hasher = threading.Thread(target=hash_cold_tree, args=(cold, io_friendly, low_priority))
+        duration = time.perf_counter()
+        hasher.start()
+        hasher.join()
+        duration = time.perf_counter() - duration
+        stop.set()
+        latencies = results.get()
+        reader.join()
+        print('%-17s hashed in %6.2f s | hot reads p50 %7.3f ms, p99 %7.3f ms | hot set cached %5.1f %% | cold tree cached %5.1f %%'
+              % (name, duration,
+                 percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+                 cached_ratio(hot) * 100, cached_ratio(cold) * 100))
+
+
+if __name__ == "__main__":
+    main()
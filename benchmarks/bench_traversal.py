@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018 Clément Warneys <clement.warneys@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the former ``os.walk`` based traversal (with one ``os.path.*`` call
+per entry) with :py:func:`lazydog.traversal.scan_tree`, on a generated tree.
+
+Usage (default is a 1M-entry tree, 1000 directories of 999 files)::
+
+    $ python3 benchmarks/bench_traversal.py [number_of_entries] [tree_dir]
+
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lazydog.traversal import scan_tree, is_dir_entry
+
+
+def build_tree(root:str, entries:int, files_per_dir:int=999):
+    created = 0
+    d = 0
+    while created < entries:
+        dir_path = os.path.join(root, 'dir%06d' % d)
+        os.makedirs(dir_path, exist_ok=True)
+        created += 1
+        for f in range(min(files_per_dir, entries - created)):
+            with open(os.path.join(dir_path, 'file%06d' % f), 'wb') as fd:
+                fd.write(b'x' * (f % 3))
+            created += 1
+        d += 1
+
+
+def walk_and_stat(root:str):
+    qty = 0
+    for parent, dirs, files in os.walk(root):
+        for i in dirs + files:
+            path = os.path.join(parent, i)
+            if not os.path.isdir(path):
+                os.path.getsize(path)
+                os.path.getmtime(path)
+            qty += 1
+    return qty
+
+
+def scan_and_stat(root:str):
+    qty = 0
+    for entry in scan_tree(root):
+        if not is_dir_entry(entry):
+            entry.stat()
+        qty += 1
+    return qty
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    root = sys.argv[2] if len(sys.argv) > 2 else tempfile.mkdtemp(prefix='lazydog-bench-')
+    if not os.listdir(root):
+        print('Building a %d-entry tree in %s...' % (entries, root))
+        build_tree(root, entries)
+    for name, function in [('os.walk + os.path', walk_and_stat), ('scan_tree', scan_and_stat)]:
+        duration = time.perf_counter()
+        qty = function(root)
+        print('%-20s %9d entries in %.3f s' % (name, qty, time.perf_counter() - duration))
+
+
+if __name__ == "__main__":
+    main()
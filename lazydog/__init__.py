@@ -49,6 +49,9 @@ The **lazydog** package contains the following modules:
 by logging the high-level events in the console. The main function of this module is  \
 called when calling ``$ lazidog`` in the console.
 * :py:mod:`~lazydog.handlers` is the main module of the library with the aggregation algorithms. 
+* :py:mod:`~lazydog.watchers` is an :py:mod:`asyncio` front end of the handlers, \
+yielding the high-level events to an ``async for`` loop, and a front end watching \
+many directories from a single thread.
 * :py:mod:`~lazydog.events` defines the high-level lazydog events, based on the \
 low-level watchdog ones, which are now aggregable and also convertible \
 to copy or move events.
@@ -60,6 +63,16 @@ or getting size and time of each watched files (depending on the requested \
 method), thus facilitating identification of copy events.
 * :py:mod:`~lazydog.dropbox_content_hasher` is the default hash function to get a hash of a file. \
 Based on the hash function of the Dropbox API.
+* :py:mod:`~lazydog.indexers` provides the background workers indexing the local state \
+while the observer is already running.
+* :py:mod:`~lazydog.storages` provides alternative storages (SQLite, dbm) for the indexes \
+of the local state, trading memory for I/O.
+* :py:mod:`~lazydog.manifests` reads the initial values of the local state from \
+JSON lines or CSV files, streaming them.
+* :py:mod:`~lazydog.traversal` provides the directory-tree traversal helpers, based on \
+:py:func:`os.scandir`, used everywhere lazydog needs to browse a directory.
+* :py:mod:`~lazydog.filters` compiles gitignore-style exclusion rules, so that \
+excluded paths are neither watched, nor indexed, nor reported.
 
 
 lazydog.lazydog
@@ -74,6 +87,12 @@ lazydog.handlers
 .. automodule:: lazydog.handlers
    :members:
 
+lazydog.watchers
+================
+
+.. automodule:: lazydog.watchers
+   :members:
+
 lazydog.events
 ==============
 
@@ -98,6 +117,36 @@ lazydog.dropbox_content_hasher
 .. automodule:: lazydog.dropbox_content_hasher
    :members:
 
+lazydog.indexers
+================
+
+.. automodule:: lazydog.indexers
+   :members:
+
+lazydog.storages
+================
+
+.. automodule:: lazydog.storages
+   :members:
+
+lazydog.manifests
+=================
+
+.. automodule:: lazydog.manifests
+   :members:
+
+lazydog.traversal
+=================
+
+.. automodule:: lazydog.traversal
+   :members:
+
+lazydog.filters
+===============
+
+.. automodule:: lazydog.filters
+   :members:
+
 """
 
 __version__ = '0.1.1'
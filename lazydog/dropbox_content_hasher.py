@@ -33,7 +33,38 @@ import os
 import logging
 
 
-def default_hash_function(absolute_path:str, default_directory_hash:str='DIR'):
+def _read_chunks(f, io_friendly:bool=False, offset:int=0):
+    """
+    Yields the content of the file object ``f`` from ``offset``, chunk after chunk. In ``io_friendly``
+    mode (if :py:func:`os.posix_fadvise` is available), the kernel is told that the file 
+    is read sequentially, the next block is prefetched while hashing the current one, 
+    and every block is dropped from the page cache once read, so that hashing large 
+    files does not evict the pages used by other applications.
+    """
+    f.seek(offset)
+    if not io_friendly or not hasattr(os, 'posix_fadvise'):
+        while True:
+            chunk = f.read(1024)  # or whatever chunk size you want
+            if len(chunk) == 0:
+                break
+            yield chunk
+        return
+    fd = f.fileno()
+    block_size = DropboxContentHasher.BLOCK_SIZE
+    os.posix_fadvise(fd, offset, 0, os.POSIX_FADV_SEQUENTIAL)
+    os.posix_fadvise(fd, offset, block_size, os.POSIX_FADV_WILLNEED)
+    while True:
+        os.posix_fadvise(fd, offset + block_size, block_size, os.POSIX_FADV_WILLNEED)
+        chunk = f.read(block_size)
+        if len(chunk) == 0:
+            break
+        yield chunk
+        os.posix_fadvise(fd, offset, len(chunk), os.POSIX_FADV_DONTNEED)
+        offset += len(chunk)
+
+
+def default_hash_function(absolute_path:str, default_directory_hash:str='DIR', io_friendly:bool=False, 
+                          block_digests:list=None):
     """
     Main function in this module that returns the 
     dropbox-like hash of any local file. If the local path does not exist, 
@@ -49,6 +80,18 @@ def default_hash_function(absolute_path:str, default_directory_hash:str='DIR'):
         *Optional*. The returned value in case the absolute path is a directory.
     :type absolute_path:
         str
+    :param io_friendly:
+        *Optional*. ``False`` by default. If ``True``, the file is read by blocks 
+        of 4 MiB with :py:func:`os.posix_fadvise` hints, and dropped from the page 
+        cache once hashed (including the pages that were cached before). Use it when 
+        hashing large trees on hosts shared with other I/O-bound services.
+    :type io_friendly:
+        boolean
+    :param block_digests:
+        *Optional*. If a list is provided, it is filled with the SHA-256 digests 
+        (:py:class:`bytes`) of each 4 MiB block of the file.
+    :type block_digests:
+        list
     :returns: 
         The hash of the file or directory located in ``absolute_path``. 
         The hash is computed based on the default Dropbox API hasher. 
@@ -67,22 +110,203 @@ def default_hash_function(absolute_path:str, default_directory_hash:str='DIR'):
         # File
         elif os.path.exists(absolute_path):
             # Open the file and hash it using Dropbox python helpers
-            hasher = DropboxContentHasher()
+            hasher = DropboxContentHasher(keep_block_digests=block_digests is not None)
             with open(absolute_path, 'rb') as f:
-                while True:
-                    chunk = f.read(1024)  # or whatever chunk size you want
-                    if len(chunk) == 0:
-                        break
+                for chunk in _read_chunks(f, io_friendly):
                     hasher.update(chunk)
             _hash = hasher.hexdigest()
+            if block_digests is not None:
+                block_digests.extend(hasher.block_digests)
         logging.getLogger(__name__).debug("Successfully computed hash of file (%.3f): %s" % (time.perf_counter() - duration, absolute_path))
     except:
         logging.getLogger(__name__).exception("Error while hashing file %s" % absolute_path)
     return _hash
-    
-    
-    
-    
+
+
+def stat_signature(absolute_path:str) -> tuple:
+    """
+    Returns the ``(st_size, st_mtime_ns, st_ino, st_ctime_ns)`` signature of the 
+    file or directory, or ``None`` if it does not exist. Unlike the modification 
+    time, the change time can not be set back by other applications.
+    """
+    try:
+        file_stat = os.stat(absolute_path)
+    except OSError:
+        return None
+    return (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino, file_stat.st_ctime_ns)
+
+
+def sample_digest(absolute_path:str) -> bytes:
+    """
+    Returns the sampled digest of the file (see :py:class:`HashCheckpoint`), or 
+    ``None`` if the file does not exist or is not bigger than the samples (in this 
+    case, computing its hash is as cheap).
+    """
+    try:
+        with open(absolute_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= HashCheckpoint.SAMPLES * HashCheckpoint.SAMPLE_SIZE:
+                return None
+            return HashCheckpoint.compute_sample_digest(f, size)
+    except OSError:
+        return None
+
+
+class HashResult(object):
+    """
+    Hash value of a file, with the :py:func:`stat_signature` of the file taken
+    just before and just after reading it. If both are equal (:py:attr:`is_stable`),
+    the hash value corresponds to the bytes on disk as long as the signature of
+    the file does not change, so that it can later be verified with a single
+    ``stat`` instead of being computed again.
+
+    As for the index of git, a signature whose modification time is too close to
+    the time of hashing (:py:attr:`is_racy`) does not prove anything, since the
+    file could still be modified within the same timestamp granularity.
+    """
+
+    RACY_WINDOW_NS = 2 * 10**9
+    """Modification times less than 2 seconds before hashing are considered racy."""
+
+    def __init__(self, hash:str, signature_before:tuple, signature_after:tuple, hashed_at_ns:int=None):
+        self.hash = hash
+        self.signature_before = signature_before
+        self.signature_after = signature_after
+        self.hashed_at_ns = hashed_at_ns if hashed_at_ns is not None else time.time_ns()
+
+    @property
+    def is_stable(self) -> bool:
+        """``True`` if the file has not been modified while being hashed."""
+        return self.signature_before is not None and self.signature_before == self.signature_after
+
+    @property
+    def is_racy(self) -> bool:
+        """``True`` if the file was modified just before being hashed."""
+        return (self.signature_after is not None and 
+                self.signature_after[1] > self.hashed_at_ns - HashResult.RACY_WINDOW_NS)
+
+    @property
+    def signature(self) -> tuple:
+        """Signature of the hashed content if :py:attr:`is_stable`, else ``None``."""
+        return self.signature_after if self.is_stable else None
+
+
+def hash_with_stat(hash_function, absolute_path:str, retries:int=2) -> HashResult:
+    """
+    Hashes the file with ``hash_function`` (any function with the same parameter
+    and return as :py:func:`default_hash_function`), between two ``stat`` calls.
+    If the file is modified while being hashed, the hash is computed again, at
+    most ``retries`` times.
+
+    :returns: 
+        The latest :py:class:`HashResult`, unstable if the file was still
+        being modified.
+    :rtype: 
+        :py:class:`HashResult`
+    """
+    for attempt in range(retries + 1):
+        signature_before = stat_signature(absolute_path)
+        file_hash = hash_function(absolute_path)
+        result = HashResult(file_hash, signature_before, stat_signature(absolute_path))
+        if result.is_stable or signature_before is None or result.signature_after is None:
+            break
+        logging.getLogger(__name__).debug("File modified while hashing (attempt %d): %s" % (attempt + 1, absolute_path))
+    return result
+
+
+class HashCheckpoint(object):
+    """
+    Snapshot of the hashing state of a file, after its first ``offset`` bytes
+    (see :py:func:`resumable_hash_function`). A sampled digest of these bytes
+    allows to check later that they have not been modified, without reading
+    them again: only a few small blocks (:py:attr:`SAMPLES` blocks of
+    :py:attr:`SAMPLE_SIZE` bytes, evenly spread, including the first and last
+    ones) are read.
+    """
+
+    SAMPLES = 16
+    SAMPLE_SIZE = 4096
+
+    def __init__(self, hasher, offset:int, file_id:tuple, sample_digest:bytes, resumed_from:int=0):
+        self.hasher = hasher
+        self.offset = offset
+        self.file_id = file_id
+        self.sample_digest = sample_digest
+        # offset from which the file has been read (0 if hashed from the beginning)
+        self.resumed_from = resumed_from
+
+    @staticmethod
+    def compute_sample_digest(f, length:int) -> bytes:
+        """Returns the sampled digest of the first ``length`` bytes of the file object ``f``."""
+        sampler = hashlib.sha256()
+        size = HashCheckpoint.SAMPLE_SIZE
+        if length <= HashCheckpoint.SAMPLES * size:
+            positions = [0]
+            size = length
+        else:
+            step = (length - size) / (HashCheckpoint.SAMPLES - 1)
+            positions = [int(i * step) for i in range(HashCheckpoint.SAMPLES)]
+        for position in positions:
+            f.seek(position)
+            sampler.update(f.read(size))
+        return sampler.digest()
+
+    def matches(self, f, file_stat:os.stat_result) -> bool:
+        """
+        Returns ``True`` if the hashing of the file object ``f`` can be resumed from
+        this checkpoint: same file, not shorter than :py:attr:`offset`, and same samples.
+        """
+        return ((file_stat.st_dev, file_stat.st_ino) == self.file_id and 
+                file_stat.st_size >= self.offset and 
+                HashCheckpoint.compute_sample_digest(f, self.offset) == self.sample_digest)
+
+
+def resumable_hash_function(absolute_path:str, checkpoint:HashCheckpoint=None, 
+                            default_directory_hash:str='DIR', io_friendly:bool=False, 
+                            block_digests:list=None) -> tuple:
+    """
+    Same as :py:func:`default_hash_function`, but also returns a :py:class:`HashCheckpoint`
+    of the hashing state at the end of the file. If a previous ``checkpoint`` of the same
+    file is provided, and if the file has only been appended since then, only the 
+    appended bytes are read and hashed.
+
+    :returns: 
+        The couple ``(hash, checkpoint)``. The checkpoint is ``None`` for
+        directories and non existing paths.
+    :rtype: 
+        tuple
+    """
+    try:
+        if os.path.isdir(absolute_path):
+            return default_directory_hash, None
+        with open(absolute_path, 'rb') as f:
+            file_stat = os.fstat(f.fileno())
+            keep_block_digests = block_digests is not None
+            if (checkpoint is not None and 
+                    (not keep_block_digests or checkpoint.hasher.block_digests is not None) and 
+                    checkpoint.matches(f, file_stat)):
+                hasher = checkpoint.hasher.copy()
+                offset = checkpoint.offset
+            else:
+                hasher = DropboxContentHasher(keep_block_digests)
+                offset = 0
+            resumed_from = offset
+            for chunk in _read_chunks(f, io_friendly, offset):
+                hasher.update(chunk)
+                offset += len(chunk)
+            new_checkpoint = HashCheckpoint(hasher.copy(), offset, (file_stat.st_dev, file_stat.st_ino), 
+                                            HashCheckpoint.compute_sample_digest(f, offset), resumed_from)
+            file_hash = hasher.hexdigest()
+            if keep_block_digests:
+                block_digests.extend(hasher.block_digests)
+            return file_hash, new_checkpoint
+    except FileNotFoundError:
+        return None, None
+    except:
+        logging.getLogger(__name__).exception("Error while hashing file %s" % absolute_path)
+        return None, None
+
+
 class DropboxContentHasher(object):
     """
     Computes a hash using the same algorithm that the Dropbox API uses for the
@@ -105,14 +329,20 @@ class DropboxContentHasher(object):
                 hasher.update(chunk)
         print(hasher.hexdigest())
 
+    If ``keep_block_digests`` is ``True``, the digest of each 4 MiB block is
+    also kept in the :py:attr:`block_digests` list (complete once ``digest()`` 
+    or ``hexdigest()`` has been called), so that two versions of a file can be 
+    compared block by block.
+
     """
 
     BLOCK_SIZE = 4 * 1024 * 1024
 
-    def __init__(self):
+    def __init__(self, keep_block_digests:bool=False):
         self._overall_hasher = hashlib.sha256()
         self._block_hasher = hashlib.sha256()
         self._block_pos = 0
+        self.block_digests = [] if keep_block_digests else None
 
         self.digest_size = self._overall_hasher.digest_size
         # hashlib classes also define 'block_size', but I don't know how people use that value
@@ -128,7 +358,7 @@ class DropboxContentHasher(object):
         new_data_pos = 0
         while new_data_pos < len(new_data):
             if self._block_pos == self.BLOCK_SIZE:
-                self._overall_hasher.update(self._block_hasher.digest())
+                self._end_block()
                 self._block_hasher = hashlib.sha256()
                 self._block_pos = 0
 
@@ -139,13 +369,19 @@ class DropboxContentHasher(object):
             self._block_pos += len(part)
             new_data_pos += len(part)
 
+    def _end_block(self):
+        block_digest = self._block_hasher.digest()
+        self._overall_hasher.update(block_digest)
+        if self.block_digests is not None:
+            self.block_digests.append(block_digest)
+
     def _finish(self):
         if self._overall_hasher is None:
             raise AssertionError(
                 "can't use this object anymore; you already called digest() or hexdigest()")
 
         if self._block_pos > 0:
-            self._overall_hasher.update(self._block_hasher.digest())
+            self._end_block()
             self._block_hasher = None
         h = self._overall_hasher
         self._overall_hasher = None  # Make sure we can't use this object anymore.
@@ -162,6 +398,7 @@ class DropboxContentHasher(object):
         c._overall_hasher = self._overall_hasher.copy()
         c._block_hasher = self._block_hasher.copy()
         c._block_pos = self._block_pos
+        c.block_digests = list(self.block_digests) if self.block_digests is not None else None
         return c
     
     
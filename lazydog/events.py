@@ -62,6 +62,7 @@ import datetime
 import os
 
 from lazydog.states import LocalState
+from lazydog.traversal import scan_tree, is_dir_entry
 
 from lazydog.revised_watchdog.events import (
     FileSystemEvent,
@@ -158,6 +159,15 @@ class LazydogEvent():
         self.latest_reworked_date = datetime.datetime.now()
         self.is_related = False
         self.is_irrelevant = False
+        
+        # Indexes of the 4 MiB blocks changed by a content modification, 
+        # set when the event is released (see LocalState.get_changed_blocks)
+        self.changed_blocks = None
+        
+        # identifiers of the watched directories of the event, and of its source if 
+        # it comes from another one (see lazydog.watchers.MultiRootWatcher)
+        self.root_id = None
+        self.src_root_id = None
 
         
     def __str__(self):
@@ -445,6 +455,12 @@ class LazydogEvent():
                     self._file_hash = None
         return self._file_hash
     
+    @property
+    def is_hashed(self) -> bool:
+        """
+        Returns ``True`` if the :py:attr:`file_hash` of the event has already been computed.
+        """
+        return self._file_hash is not None
               
     @staticmethod
     def count_files_in(absolute_dir_path:str) -> int:
@@ -460,10 +476,9 @@ class LazydogEvent():
         try:
             if os.path.isdir(absolute_dir_path):
                 qty = 0  
-                for root, dirs, files in os.walk(absolute_dir_path):
-                    for f in files:
-                        if os.path.getsize(os.path.join(root, f)) > 0:
-                            qty = qty + 1
+                for entry in scan_tree(absolute_dir_path):
+                    if not is_dir_entry(entry) and entry.stat().st_size > 0:
+                        qty = qty + 1
         except:
             pass
         return qty  
@@ -528,20 +543,31 @@ class LazydogEvent():
         Inode of the file related to the event if any, else ``None``.
         Inode value is saved in a private variable, in order to avoid useless
         sollicitation of file-system.
-
-        .. note:: This property seems now useless, and could be deprecated.
         """
         if self._file_inode is None:
             try:
-                self._file_inode = os.stat(self.absolute_ref_path).st_ino
+                file_stat = os.stat(self.absolute_ref_path)
+                self._file_inode = file_stat.st_ino
+                self._file_device = file_stat.st_dev
             except:
                 self._file_inode = None
         return self._file_inode
+    
+    @property
+    def file_id(self) -> tuple:
+        """
+        Couple ``(st_dev, st_ino)`` identifying the file related to the event if any, 
+        else ``None``. Same format as the values of :py:meth:`~lazydog.states.LocalState.get_inode`.
+        """
+        if self.file_inode is None:
+            return None
+        return (self._file_device, self._file_inode)
         
     
     def _reset_file_infos(self):
         # reset
         self._file_inode = None
+        self._file_device = None
         self._file_size = None
         self._file_mtime = None
         self._file_hash = None
@@ -576,6 +602,7 @@ class LazydogEvent():
         if self.is_modified_event() and not self.is_directory() and not main_event.is_directory():
             if main_event._file_mtime != self._file_mtime or main_event._file_size != self._file_size:
                 main_event._file_inode = self._file_inode
+                main_event._file_device = self._file_device
                 main_event._file_mtime = self._file_mtime
                 main_event._file_size = self._file_size
                 main_event._file_hash = self._file_hash
@@ -641,4 +668,20 @@ class LazydogEvent():
             # save all potential parent source path, for future use
             if os.path.basename(sp) == os.path.basename(self.to_path):
                 self.possible_src_paths[sp] = os.path.dirname(sp) if sp != '/' else None
-            
\ No newline at end of file
+            
+    
+    def transforms_into_moved_event(self, src_path:str, dest_path:str):
+        """
+        High level helper method to facilitate the work of the 
+        :py:class:`~lazydog.handlers.HighlevelEventHandler`. 
+        When a `Deleted` event and a `Created` event are identified as the 
+        two halves of the same move (because their low-level ``IN_MOVED_FROM``
+        and ``IN_MOVED_TO`` events could not be paired), this method is 
+        transforming the current event into a moved event from ``src_path`` 
+        to ``dest_path``. File information are then reset according to the
+        destination path.
+        """
+        self.type = LazydogEvent.EVENT_TYPE_MOVED
+        self.path = src_path
+        self.to_path = dest_path
+        self._reset_file_infos()
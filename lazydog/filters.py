@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018 Clément Warneys <clement.warneys@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+:module: lazydog.filters
+:synopsis: Gitignore-style exclusion rules of the watched paths.
+:author: Clément Warneys <clement.warneys@gmail.com>
+
+A :py:class:`PathFilter` excludes some paths of the watched directory (build
+directories, ``.git``, ``node_modules``...) from the whole pipeline:
+
+* excluded directories are never put under observation by the \
+:py:class:`~lazydog.revised_watchdog.observers.inotify_c.Inotify` instance, nor \
+browsed when simulating the events of a created or moved directory,
+* excluded paths are not indexed by the :py:class:`~lazydog.states.LocalState`,
+* the low-level events of excluded paths are dropped by the \
+:py:class:`~lazydog.queues.DatedlocaleventQueue`.
+
+Patterns follow the ``.gitignore`` syntax, relative to the watched directory::
+
+    # comments and blank lines are ignored
+    node_modules/
+    /build/
+    *.pyc
+    !keep.pyc
+    docs/**/*.tmp
+
+"""
+
+import re
+import functools
+import threading
+import collections
+
+
+def _translate(pattern:str) -> str:
+    # regular expression of a pattern (without its '!'), matching the
+    # relative path of a file, or of a directory followed by a '/'
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    # a pattern containing a separator is relative to the watched directory
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    regex = '' if anchored else '(?:.*/)?'
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**', i) and (i == 0 or pattern[i - 1] == '/') and (i + 2 == n or pattern[i + 2] == '/'):
+            if i + 2 == n:
+                # everything inside
+                regex += '.+'
+                i += 2
+            else:
+                # zero or more directories
+                regex += '(?:.*/)?'
+                i += 3
+        elif c == '*':
+            regex += '[^/]*'
+            i += 1
+        elif c == '?':
+            regex += '[^/]'
+            i += 1
+        elif c == '[':
+            j = i + 1
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            j = pattern.find(']', j)
+            if j == -1:
+                regex += '\\['
+                i += 1
+            else:
+                content = pattern[i + 1:j].replace('\\', '\\\\').replace('[', '\\[')
+                if content[0] in '!^':
+                    content = '^' + content[1:]
+                regex += '[' + content + ']'
+                i = j + 1
+        elif c == '\\' and i + 1 < n:
+            regex += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            regex += re.escape(c)
+            i += 1
+    return regex + ('/' if dir_only else '/?')
+
+
+class PathFilter():
+    """
+    Compiles a list of ``.gitignore``-style patterns into a single regular
+    expression. As in ``.gitignore`` files, the last matching pattern decides:
+    a pattern starting with ``!`` includes again the paths excluded by the
+    previous ones. A path inside an excluded directory is always excluded.
+
+    The number of paths pruned by each part of the pipeline (``'watches'``,
+    ``'indexing'``, ``'events'``) is counted in :py:attr:`pruned`.
+
+    :param patterns:
+        The list of patterns.
+    :type patterns:
+        list
+    """
+
+    CACHE_SIZE = 4096
+    """Number of directories whose exclusion is cached."""
+
+    def __init__(self, patterns:list):
+        self.patterns = []
+        self._negated = []
+        regexes = []
+        for pattern in patterns:
+            if not pattern.endswith('\\ '):
+                pattern = pattern.rstrip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            self.patterns.append(pattern)
+            self._negated.append(pattern.startswith('!'))
+            regexes.append(_translate(pattern[1:] if pattern.startswith('!') else pattern))
+        # the last matching pattern is the first matching alternative
+        self._regex = re.compile('|'.join('(?P<p%d>%s)' % (i, x) for i, x in reversed(list(enumerate(regexes))))) if regexes else None
+        self._is_dir_excluded = functools.lru_cache(maxsize=PathFilter.CACHE_SIZE)(lambda x: self.matches(x, True))
+        self.pruned = collections.Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, file_path:str):
+        """
+        Returns the :py:class:`PathFilter` of the patterns of the file at ``file_path``,
+        one per line (for example a ``.gitignore`` file).
+        """
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return cls(f.read().splitlines())
+
+    def matches(self, relative_path:str, is_dir:bool=False) -> bool:
+        """
+        Returns ``True`` if the patterns exclude the ``relative_path`` file
+        (or directory, if ``is_dir``), without looking at its parent directories.
+        """
+        if self._regex is None:
+            return False
+        candidate = relative_path.strip('/')
+        if not candidate or candidate == '.':
+            return False
+        match = self._regex.fullmatch(candidate + '/' if is_dir else candidate)
+        return match is not None and not self._negated[int(match.lastgroup[1:])]
+
+    def is_excluded(self, relative_path:str, is_dir:bool=False, site:str=None) -> bool:
+        """
+        Returns ``True`` if the ``relative_path`` file (or directory, if ``is_dir``)
+        is excluded, or is inside an excluded directory. If excluded, the path is
+        counted in :py:attr:`pruned` under the ``site`` key, if any.
+        """
+        if self._regex is None:
+            return False
+        names = relative_path.strip('/').split('/')
+        excluded = (any(self._is_dir_excluded('/'.join(names[:i])) for i in range(1, len(names))) or
+                    self.matches(relative_path, is_dir))
+        if excluded and site is not None:
+            with self._lock:
+                self.pruned[site] += 1
+        return excluded
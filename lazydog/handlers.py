@@ -26,14 +26,23 @@
 import os
 import time
 import datetime
+import selectors
 import threading
+import collections
 
 from lazydog.states import LocalState
 from lazydog.events import LazydogEvent
 from lazydog.queues import DatedlocaleventQueue
+from lazydog.traversal import relative_entry_paths
+from lazydog.indexers import SpeculativeHasher
 
-from lazydog.revised_watchdog.observers.inotify import InotifyEmitter, InotifyObserver
+from lazydog.revised_watchdog.observers.inotify import InotifyEmitter, InotifyObserver, classify_event
+from lazydog.revised_watchdog.observers.inotify_buffer import InotifyBuffer
+from lazydog.revised_watchdog.observers.inotify_c import Inotify
+from lazydog.revised_watchdog.events import TrueFileModifiedEvent
+from watchdog.events import DirCreatedEvent, FileCreatedEvent, DirDeletedEvent, FileDeletedEvent
 from watchdog.observers.polling import PollingObserver
+from watchdog.utils import unicode_paths
 
 
 
@@ -99,7 +108,13 @@ class HighlevelEventHandler(threading.Thread):
     """
     
     @classmethod
-    def get_instance(cls, watched_dir:str, hashing_function=None, custom_intializing_values=None):
+    def get_instance(cls, watched_dir:str, hashing_function=None, custom_intializing_values=None, 
+                     max_resident_hashes:int=None, hash_spill_store=None, storage=None, 
+                     background_indexing:bool=False, indexing_workers=1, 
+                     speculative_hashing:bool=False, hashing_io_budget:int=SpeculativeHasher.DEFAULT_IO_BUDGET, 
+                     io_friendly_hashing:bool=False, resumable_hashing:bool=False, 
+                     keep_block_digests:bool=False, fused_pipeline:bool=False, path_filter=None, 
+                     event_masks:dict=None):
         """
         This method provides you with the  simplest way to instanciate 
         :py:class:`~lazydog.handlers.HighlevelEventHandler`. You only need to specify the 
@@ -117,7 +132,9 @@ class HighlevelEventHandler(threading.Thread):
             Custom hashing function that will be use to compute the hashs of each file, 
             in order the handler is able to correlate copy events. The function shall be defined  
             with the same parameters and retrun format than 
-            :py:func:`~lazydog.dropbox_content_hasher.default_hash_function`.
+            :py:func:`~lazydog.dropbox_content_hasher.default_hash_function`. It may
+            also provide a batch version of itself, as a ``hash_many`` attribute (see
+            :py:meth:`~lazydog.states.LocalState.hash_many`).
         :type hashing_function:
             function
         :param custom_intializing_values:
@@ -127,24 +144,125 @@ class HighlevelEventHandler(threading.Thread):
             files and directory because hash values will not be computed for 
             missing files. If some reference were missing in the provided dictionary, 
             they can be completed later using :py:meth:`save_locals` 
-            method. For more information about the structure of this parameter, 
-            please see the documentation of :py:class:`~lazydog.states.LocalState`.
+            method. The values can also be streamed from an iterable, or from a JSON lines 
+            or CSV file (see :py:mod:`~lazydog.manifests`). For more information about the 
+            structure of this parameter, please see the documentation of 
+            :py:class:`~lazydog.states.LocalState`.
         :type custom_intializing_values:
             :py:class:`~lazydog.states.LocalState`
+        :param max_resident_hashes:
+            *Optional*. Maximum number of hash values kept in memory by the local state, 
+            see :py:class:`~lazydog.states.LocalState`.
+        :type max_resident_hashes:
+            int
+        :param hash_spill_store:
+            *Optional*. Dictionary-like object where the evicted hash values are written, 
+            see :py:class:`~lazydog.states.LocalState`.
+        :type hash_spill_store:
+            dict
+        :param storage:
+            *Optional*. Storage of the indexes of the local state, see 
+            :py:mod:`lazydog.storages`. By default, indexes are kept in memory.
+        :type storage:
+            :py:class:`~lazydog.storages.DictStorage`
+        :param background_indexing:
+            *Optional*. ``False`` by default, which means that the whole watched directory 
+            is indexed before the observer is started. If ``True``, the observer is started 
+            first, and the directory is then indexed in the background, so that no 
+            modification is missed during a long initial indexing. See :py:meth:`is_ready` 
+            and :py:meth:`indexing_progress` to follow the indexing.
+        :type background_indexing:
+            boolean
+        :param indexing_workers:
+            *Optional*. Number of hashing threads per device used to index the watched 
+            directory (either an integer, or a dictionary ``{st_dev: workers}``).
+        :type indexing_workers:
+            int
+        :param speculative_hashing:
+            *Optional*. ``False`` by default. If ``True``, the hash values of the files 
+            sharing their size and modification time with other files are computed in 
+            advance while the handler is idle, see :py:class:`~lazydog.indexers.SpeculativeHasher` 
+            (mainly useful with ``max_resident_hashes``).
+        :type speculative_hashing:
+            boolean
+        :param hashing_io_budget:
+            *Optional*. Maximum number of bytes per second read by the speculative hashing.
+        :type hashing_io_budget:
+            int
+        :param io_friendly_hashing:
+            *Optional*. ``False`` by default. If ``True``, files are hashed without polluting 
+            the page cache (see :py:class:`~lazydog.states.LocalState`), and the background 
+            indexing threads run with the lowest I/O priority.
+        :type io_friendly_hashing:
+            boolean
+        :param resumable_hashing:
+            *Optional*. ``False`` by default. If ``True``, files that are only appended 
+            (typically log files) are not hashed again from the beginning when modified, 
+            see :py:class:`~lazydog.states.LocalState`.
+        :type resumable_hashing:
+            boolean
+        :param keep_block_digests:
+            *Optional*. ``False`` by default. If ``True``, the digests of the 4 MiB blocks 
+            of each file are kept, and released `Modified` events carry the indexes of the 
+            changed blocks in their ``changed_blocks`` attribute (see 
+            :py:meth:`~lazydog.states.LocalState.get_changed_blocks`).
+        :type keep_block_digests:
+            boolean
+        :param fused_pipeline:
+            *Optional*. ``False`` by default, which means that the low-level events are 
+            read by a watchdog observer (with its own threads). If ``True``, a 
+            :py:class:`FusedEventHandler` is returned instead, reading and post-treating 
+            the low-level events in its own single thread.
+        :type fused_pipeline:
+            boolean
+        :param path_filter:
+            *Optional*. Gitignore-style exclusion rules (see :py:mod:`lazydog.filters`): 
+            excluded directories are not watched, and excluded paths are neither 
+            indexed nor reported. The pruned paths are counted in its ``pruned`` attribute.
+        :type path_filter:
+            :py:class:`~lazydog.filters.PathFilter`
+        :param event_masks:
+            *Optional*. Inotify event masks of some sub-trees, by path of their top 
+            directory (for example ``{'/archives': STRUCTURE_EVENTS}``, see 
+            :py:mod:`lazydog.revised_watchdog.observers.inotify_c`), so that the 
+            kernel does not even report the events not needed there.
+        :type event_masks:
+            dict
         :returns: 
             An already running high-level lazydog events handler.
         :rtype: 
             :py:class:`~lazydog.handlers.HighlevelEventHandler`
         """
-        local_files = LocalState(watched_dir, hashing_function, custom_intializing_values)
+        local_files = LocalState(watched_dir, hashing_function, custom_intializing_values, 
+                                 max_resident_hashes, hash_spill_store, storage, 
+                                 defer_indexing=background_indexing, 
+                                 io_friendly_hashing=io_friendly_hashing, 
+                                 hashing_workers=indexing_workers, 
+                                 resumable_hashing=resumable_hashing, 
+                                 keep_block_digests=keep_block_digests, 
+                                 path_filter=path_filter)
         
         dated_event_queue = DatedlocaleventQueue(local_files)
-        observer = InotifyObserver() # generate_full_events=False) # With reviewed Inotify 
-        observer.schedule(dated_event_queue, watched_dir, recursive=True)
-        observer.name = 'Local Inotify observer'
-        observer.start()
+        if fused_pipeline:
+            handler = FusedEventHandler(dated_event_queue, local_files, event_masks=event_masks)
+        else:
+            observer = InotifyObserver(path_filter=path_filter, event_masks=event_masks) # generate_full_events=False) # With reviewed Inotify 
+            observer.schedule(dated_event_queue, watched_dir, recursive=True)
+            observer.name = 'Local Inotify observer'
+            observer.start()
+        
+        # the observer (or the watches of the fused handler) is already running, 
+        # so nothing is missed while indexing
+        if background_indexing and custom_intializing_values is None:
+            local_files.start_indexing(indexing_workers, low_io_priority=io_friendly_hashing)
         
-        return cls(dated_event_queue, local_files)
+        if not fused_pipeline:
+            handler = cls(dated_event_queue, local_files)
+        if speculative_hashing:
+            handler.speculative_hasher = SpeculativeHasher(local_files, handler.is_idle, hashing_io_budget)
+            handler.speculative_hasher.start()
+        
+        return handler
     
     
     def __init__(self, lowlevel_event_queue:DatedlocaleventQueue, local_states:LocalState):
@@ -152,6 +270,7 @@ class HighlevelEventHandler(threading.Thread):
         self.events_list.clear()
         self.lowlevel_event_queue = lowlevel_event_queue
         self.local_states = local_states
+        self.local_states.is_pending_deletion = self._is_pending_deletion
         super(HighlevelEventHandler, self).__init__()
         self._update_posttreatment_cursor()
         self._copied_dir_list = {}
@@ -160,6 +279,15 @@ class HighlevelEventHandler(threading.Thread):
         self._block_releases_while_hashing = False
         self._stop_handler = threading.Event()
         self.name = 'Highlevel local event handler'
+        
+        self.speculative_hasher = None
+        
+        # number of `Modified` events decided by each tier of verification
+        self.verification_counters = {'stat': 0, 'sample': 0, 'hash': 0}
+
+        # rescans after lost low-level events (see rescan), and the number of differences found
+        self._rescan_requested = False
+        self.rescan_counters = {'rescans': 0, 'differences': 0}
 
 
     def stop(self):
@@ -170,7 +298,117 @@ class HighlevelEventHandler(threading.Thread):
         afterwards.
         """
         self._stop_handler.set()
+        if self.speculative_hasher is not None:
+            self.speculative_hasher.stop()
     
+    def is_ready(self) -> bool:
+        """
+        Returns ``True`` once the local state is fully indexed. Until then (see the
+        ``background_indexing`` parameter of :py:meth:`get_instance`), events are 
+        already handled, but a `Copied` event whose source is not indexed yet is 
+        released as a `Created` one.
+        """
+        return self.local_states.is_ready()
+
+    def is_idle(self) -> bool:
+        """
+        Returns ``True`` if there is neither any pending low-level event, 
+        nor any high-level event waiting to be released.
+        """
+        return not self.events_list and self.lowlevel_event_queue.is_empty()
+
+    def indexing_progress(self) -> dict:
+        """
+        Returns the status of the background indexing of the local state, see 
+        :py:meth:`~lazydog.states.LocalState.indexing_progress`.
+        """
+        return self.local_states.indexing_progress()
+
+    def overflows(self) -> int:
+        """
+        Returns the number of times some low-level events have been lost, because 
+        the kernel event queue overflowed. Each time, the watched directory is rescanned
+        (see :py:meth:`rescan`).
+        """
+        return self.lowlevel_event_queue.overflows
+
+    def rescan(self) -> int:
+        """
+        Compares the watched directory with the local state (see 
+        :py:meth:`~lazydog.states.LocalState.get_differences`), and post-treats 
+        the differences as if they were low-level events: `Deleted`, `Created` 
+        or `Modified` events. This is done automatically once the local state is 
+        ready, when some low-level events have been lost.
+
+        The low-level events still queued are post-treated first. Since the local 
+        state is only updated when the high-level events are released (see 
+        :py:meth:`get_available_events`), the differences of the events not 
+        released yet are then skipped, instead of being post-treated twice.
+
+        :returns:
+            The number of differences found.
+        :rtype:
+            int
+        """
+        self._posttreat_lowlevel_queue()
+        pending_paths = set(e.ref_path for e in self.events_list if e.is_created_event() or e.is_modified_event())
+        deleted_paths = set(e.ref_path for e in self.events_list if e.is_deleted_event())
+        differences = [x for x in self.local_states.get_differences() 
+                       if not (self._is_under(x[1], deleted_paths) if x[0] == 'deleted' else x[1] in pending_paths)]
+        for change, key, is_dir in differences:
+            if change == 'deleted':
+                cls = DirDeletedEvent if is_dir else FileDeletedEvent
+            elif change == 'created':
+                cls = DirCreatedEvent if is_dir else FileCreatedEvent
+            else:
+                cls = TrueFileModifiedEvent
+            event = cls(self.local_states.absolute_local_path(key))
+            self.posttreat_lowlevel_event(LazydogEvent(event, self.local_states))
+        self.rescan_counters['rescans'] += 1
+        self.rescan_counters['differences'] += len(differences)
+        return len(differences)
+
+    @staticmethod
+    def _is_under(key:str, parent_keys:set) -> bool:
+        # True if key or one of its parent paths is in parent_keys
+        while key != '/':
+            if key in parent_keys:
+                return True
+            key = os.path.dirname(key)
+        return False
+
+    def _is_pending_deletion(self, key:str) -> bool:
+        # True if key is under the path of a `Deleted` event not processed yet
+        return self._is_under(key, set(e.ref_path for e in list(self.events_list) if e.is_deleted_event()))
+
+    def _is_really_modified(self, event:LazydogEvent) -> bool:
+        """
+        Private method checking whether the file of a `Modified` event really changed 
+        since its saved values, from the cheapest to the most expensive verification, 
+        so that a big file is only read when nothing else could decide:
+
+        1. a ``stat`` call: the file is unchanged if it is the same as when its saved \
+        hash value was computed (see :py:meth:`~lazydog.states.LocalState.is_hash_current`), \
+        and changed if its size or modification time differ from the saved ones,
+        2. the sampled digest of the file, if it differs from the saved one (see \
+        :py:meth:`~lazydog.states.LocalState.has_same_sample_digest`),
+        3. the full hash value of the file.
+
+        The tier that decided is counted in :py:attr:`verification_counters`.
+        """
+        if self.local_states.is_hash_current(event.path):
+            self.verification_counters['stat'] += 1
+            return False
+        if (event.file_size, event.file_mtime) != self.local_states.get_sizetime(event.path, compute_if_none=False):
+            self.verification_counters['stat'] += 1
+            return True
+        if self.local_states.has_same_sample_digest(event.path) is False:
+            self.verification_counters['sample'] += 1
+            return True
+        # File Hash is computed.
+        self.verification_counters['hash'] += 1
+        return event.file_hash != self.local_states.get_hash(event.path, compute_if_none=False)
+
     def _update_posttreatment_cursor(self):
         """
         Private method updating the last time a post-treatment occurs for
@@ -199,25 +437,28 @@ class HighlevelEventHandler(threading.Thread):
         The relative paths (including the file or dir basename) have to be 
         the same.
         """
-        for root, dirs, files in os.walk(abs_src_path):  
-            for i in dirs:
-                abs_dest_path_i = os.path.join(abs_dest_path, i)
-                if not os.path.exists(abs_dest_path_i):
-                    return False
-            for i in files:
-                abs_dest_path_i = os.path.join(abs_dest_path, i)
-                if not os.path.exists(abs_dest_path_i):
-                    return False
-        for root, dirs, files in os.walk(abs_dest_path):  
-            for i in dirs:
-                abs_src_path_i = os.path.join(abs_src_path, i)
-                if not os.path.exists(abs_src_path_i):
-                    return False
-            for i in files:
-                abs_src_path_i = os.path.join(abs_src_path, i)
-                if not os.path.exists(abs_src_path_i):
-                    return False
-        return True
+        return relative_entry_paths(abs_src_path) == relative_entry_paths(abs_dest_path)
+    
+    def _get_copied_folder_sources(self, dir_path:str) -> set:
+        """
+        Private helper method using the Merkle-style fingerprints of the local state 
+        (see :py:class:`~lazydog.states.DirectoryFingerprints`) to find the source folders
+        of the ``dir_path`` folder with a single lookup. Returns an empty ``set()`` if the 
+        content of ``dir_path`` is not entirely referenced in the local state yet. Sources
+        whose content is not entirely referenced either are skipped, since their 
+        fingerprint would only describe the referenced part of their content.
+        """
+        if not self._is_entirely_referenced(dir_path):
+            return set()
+        fingerprint = self.local_states.get_fingerprint(dir_path)
+        return set(x for x in self.local_states.get_dirs_by_fingerprint(fingerprint) 
+                   if x != dir_path and not LazydogEvent.p1_comes_after_p2(x, dir_path) and 
+                   self._is_entirely_referenced(x))
+
+    def _is_entirely_referenced(self, dir_path:str) -> bool:
+        # every child on disk of the folder is a child in the local state fingerprints
+        return (self.local_states.fingerprints.count_children(dir_path) == 
+                HighlevelEventHandler._len_list_dir(self.local_states.absolute_local_path(dir_path)))
                 
     
     def _posttreat_copied_folder(self):
@@ -232,6 +473,10 @@ class HighlevelEventHandler(threading.Thread):
         append to the new copied event, in order to remind all the potential source
         folder (this is sometimes useful if we need to recursively do the same post-treatment with
         the parent folder).
+
+        When the whole content of a created folder is already referenced in the local state,
+        the source folders are directly found by looking up its fingerprint 
+        (see :py:meth:`_get_copied_folder_sources`), without correlating the events of its children.
         """
         if len(self._copied_dir_list) == 0:
             return
@@ -241,6 +486,26 @@ class HighlevelEventHandler(threading.Thread):
             if datetime.datetime.now() - t > datetime.timedelta(minutes=20):
                 self._copied_dir_list.pop(k)
         
+        # Fast path: as soon as the whole content of a created folder is referenced
+        # in the local state, its fingerprint directly gives the source folders
+        recurse = False
+        for dir_created_event in [x for x in self.events_list if x.is_dir_created_event() and x.ref_path in self._copied_dir_list]:
+            tp = dir_created_event.ref_path
+            src_paths = self._get_copied_folder_sources(tp)
+            if src_paths:
+                recurse = True
+                # merging every related event under the copied folder
+                for e in [x for x in self.events_list if x.comes_after(dir_created_event) and 
+                          (x.is_copied_event() or x.is_created_event() or x.is_modified_event())]:
+                    e.update_main_event(dir_created_event)
+                    self._update_local_state(e)
+                    self.events_list.remove(e)
+                dir_created_event.add_source_paths_and_transforms_into_copied_event(src_paths)
+                self._copied_dir_list.pop(tp)
+                self._copied_dir_list[os.path.dirname(tp)] = datetime.datetime.now()
+                self._update_local_state(dir_created_event)
+                self._update_posttreatment_cursor()
+        
         to_paths = {}
         
         # General idea is to identify if all the file from a same source folder have 
@@ -269,7 +534,6 @@ class HighlevelEventHandler(threading.Thread):
                         to_paths[e.parent_rp][parent_sp].append(e)
         
         # Then, we check if any created folder event corresponds to the parent_to_paths
-        recurse = False
         for tp in to_paths:
             dir_created_event = next(iter([x for x in self.events_list if x.is_dir_created_event() and x.ref_path == tp]), None)
             #for sp in to_paths[tp]:
@@ -318,6 +582,68 @@ class HighlevelEventHandler(threading.Thread):
             self._posttreat_copied_folder()
         
         
+    def _is_same_file(self, old_path:str, event:LazydogEvent) -> bool:
+        """
+        Private helper method checking, without any hashing, whether the file or folder
+        related to the ``event`` is the one that was referenced at ``old_path`` in the local 
+        state: same inode, and same size and modification time. For folders, the size and 
+        modification time are replaced by the names of their (non-empty) content.
+        """
+        if event.file_id is None or self.local_states.get_inode(old_path) != event.file_id:
+            return False
+        if event.is_directory():
+            known_names = self.local_states.fingerprints.children.get(old_path)
+            try:
+                return bool(known_names) and known_names == set(os.listdir(event.absolute_ref_path))
+            except OSError:
+                return False
+        return self.local_states.get_sizetime(old_path, compute_if_none=False) == (event.file_size, event.file_mtime)
+    
+    def _is_hard_link(self, event:LazydogEvent) -> bool:
+        """
+        Private helper method returning ``True`` if the file related to the ``event`` 
+        shares its inode with another existing file of the local state. Such a file is a 
+        hard link, not a copy, so there is no need to hash it.
+        """
+        if event.file_id is None:
+            return False
+        return len(self.local_states.get_files_by_inode(event.file_id) - set([event.ref_path])) > 0
+    
+    def _posttreat_split_move(self, local_event:LazydogEvent) -> bool:
+        """
+        Private helper method identifying a move whose low-level ``IN_MOVED_FROM`` and 
+        ``IN_MOVED_TO`` events could not be paired (split across read buffers or watches, 
+        or delayed too much), and that have thus been received as separate `Deleted` and 
+        `Created` events. Both events are merged into one `Moved` event when they are related 
+        to the same inode (see :py:meth:`_is_same_file`), whatever their order of arrival.
+
+        The `Created` events simulated for the content of such a moved folder are also 
+        merged into the `Moved` event, since the local state already references them at 
+        their new location.
+
+        Returns ``True`` if ``local_event`` has been merged into a `Moved` event.
+        """
+        if local_event.is_created_event():
+            # content of an already paired moved folder
+            if local_event.file_id is not None and self.local_states.get_inode(local_event.path) == local_event.file_id:
+                for e in [x for x in self.events_list if x.is_dir_moved_event() and local_event.comes_after(x)]:
+                    local_event.update_main_event(e)
+                    return True
+            for e in [x for x in reversed(self.events_list) if x.is_deleted_event() and x.is_dir == local_event.is_dir]:
+                if self._is_same_file(e.path, local_event):
+                    e.transforms_into_moved_event(e.path, local_event.path)
+                    self._update_local_state(e)
+                    local_event.update_main_event(e)
+                    return True
+        elif local_event.is_deleted_event():
+            for e in [x for x in reversed(self.events_list) if x.is_created_event() and x.is_dir == local_event.is_dir]:
+                if self._is_same_file(local_event.path, e):
+                    e.transforms_into_moved_event(local_event.path, e.path)
+                    self._update_local_state(e)
+                    local_event.update_main_event(e)
+                    return True
+        return False
+    
     # IMPORTANT TODO : to be protected against simultaneous get_available_events modifications...              
     def posttreat_lowlevel_event(self, local_event:LazydogEvent):
         """
@@ -351,18 +677,31 @@ class HighlevelEventHandler(threading.Thread):
             `Modified` events per seconds that you will have to ignore (since you want   \
             to do a high-level lazy observer).
 
+        * `Deleted` and `Created` events that are the two halves of the same split move \
+        are merged into one `Moved` event first, see :py:meth:`_posttreat_split_move`.
         * If the new event is not related to any other already-listed events, thent it is \
         added to the queue as a new high-level event.
         * Transformation of `Created` events into `Copied` ones, if one or more potentiel \
         sources have been found for the `Created` event. The identification of the sources \
         is based on the :py:attr:`~lazydog.events.LazydogEvent.file_size`, the             \
         :py:attr:`~lazydog.events.LazydogEvent.file_mtime` and the                         \
-        :py:attr:`~lazydog.events.LazydogEvent.file_hash` attributes. The first step concerns \
+        :py:attr:`~lazydog.events.LazydogEvent.file_hash` attributes (hard links of an     \
+        existing file are never considered as copies). The first step concerns \
         only the files. Then at the end, if any event has been transformed into a `Copied` \
         one, the :py:meth:`_posttreat_copied_folder` helper method is called.
 
         """
         
+        # paths touched during the background indexing are not indexed
+        # by the indexer, but their directory is indexed first
+        if local_event.is_created_event() or local_event.is_modified_event():
+            self.local_states.notify_live_event(local_event.ref_path)
+        
+        # split moves are first merged into one moved event
+        if self._posttreat_split_move(local_event):
+            self._update_posttreatment_cursor()
+            return
+        
         # posttreat file copy is done at the end of this method
         copy_event_to_posttreat = None
         
@@ -433,11 +772,13 @@ class HighlevelEventHandler(threading.Thread):
         if copy_event_to_posttreat is not None:
             if copy_event_to_posttreat.file_size is not None:
                 if copy_event_to_posttreat.file_size > 0:
-                    if len(self.local_states.get_files_by_sizetime_key((copy_event_to_posttreat.file_size, copy_event_to_posttreat.file_mtime))) > 0:
+                    if (len(self.local_states.get_files_by_sizetime_key((copy_event_to_posttreat.file_size, copy_event_to_posttreat.file_mtime))) > 0 and 
+                        not self._is_hard_link(copy_event_to_posttreat)):
                         self._block_releases_while_hashing = True
                         # the following command also transforms the created event into a copied one (if any src paths found)...
                         # File Hash is computed.
-                        copy_event_to_posttreat.add_source_paths_and_transforms_into_copied_event(self.local_states.get_files_by_hash_key(copy_event_to_posttreat.file_hash))
+                        copy_event_to_posttreat.add_source_paths_and_transforms_into_copied_event(self.local_states.get_files_by_hash_key(
+                            copy_event_to_posttreat.file_hash, (copy_event_to_posttreat.file_size, copy_event_to_posttreat.file_mtime)))
                         if copy_event_to_posttreat.is_copied_event():
                             self._copied_dir_list[os.path.dirname(copy_event_to_posttreat.to_path)] = datetime.datetime.now()
                         self._update_local_state(copy_event_to_posttreat)
@@ -456,6 +797,9 @@ class HighlevelEventHandler(threading.Thread):
             self.local_states.delete(event.ref_path)
         elif event.is_moved_event():
             self.local_states.move(event.path, event.to_path)
+        elif event.is_modified_event() and not event.is_hashed:
+            # no need to read the whole file now: its hash value is computed when needed
+            self.local_states.save_sizetime(event.ref_path, event.file_size, event.file_mtime)
         else:
             # File Hash is computed if needed
             self.save_locals(event.ref_path, [event.file_hash, event.file_size, event.file_mtime])
@@ -520,11 +864,12 @@ class HighlevelEventHandler(threading.Thread):
                 # here allow to compute the hash only once).
                 for e in ready_events.copy():
                     if e.is_modified_event():
-                        # File Hash is computed.
-                        if ( e.file_hash == self.local_states.get_hash(e.path, compute_if_none=False) and
-                            (e.file_size, e.file_mtime) == self.local_states.get_sizetime(e.path, compute_if_none=False)):
+                        if not self._is_really_modified(e):
                             ready_events.remove(e)
                         else:
+                            # the digests of the blocks are computed with the hash value
+                            if self.local_states.block_digests is not None and e.file_hash is not None:
+                                e.changed_blocks = self.local_states.get_changed_blocks(e.path)
                             self._update_local_state(e)
                     elif e.is_created_event() or e.is_deleted_event():
                         self._update_local_state(e)
@@ -547,11 +892,33 @@ class HighlevelEventHandler(threading.Thread):
         while not self._stop_handler.is_set():
             
             time.sleep(0.2) # to give some time for hashing from other threads...
-            
-            while not self.lowlevel_event_queue.is_empty():                
+            self._posttreat_queued_events()
+
+    def _posttreat_queued_events(self):
+        """
+        Private method post-treating the low-level events queued so far, then 
+        rescanning the watched directory if some events have been lost.
+        """
+        self._posttreat_lowlevel_queue()
+        
+        # some low-level events have been lost: the differences are simulated
+        if self.lowlevel_event_queue.pop_rescan_request():
+            self._rescan_requested = True
+        if self._rescan_requested and self.local_states.is_ready():
+            self._rescan_requested = False
+            self.rescan()
+        
+        # batched writes of the local state (if not kept in memory)
+        self.local_states.flush()
 
-                # Post-treatment of the next lowlevel event
-                lowlevel_event = self.lowlevel_event_queue.next()
+    def _posttreat_lowlevel_queue(self):
+        """
+        Private method post-treating the low-level events queued so far.
+        """
+        while not self.lowlevel_event_queue.is_empty():                
+
+            # Post-treatment of the next lowlevel events, oldest first
+            for lowlevel_event in self.lowlevel_event_queue.next_many():
                 # print('+++ INCOMING LOW LEVEL EVENT +++')
                 # for e in self.events_list:
                 #     print('+ ' + str(e))
@@ -560,3 +927,213 @@ class HighlevelEventHandler(threading.Thread):
                 #logging.debug('+++' + str(lowlevel_event))
                 self.posttreat_lowlevel_event(lowlevel_event)
                 
+
+
+class MovePairing():
+    """
+    Pairs the ``IN_MOVED_FROM`` and ``IN_MOVED_TO`` low-level events, as 
+    :py:class:`~lazydog.revised_watchdog.observers.inotify_buffer.InotifyBuffer` 
+    does: every low-level event is held for ``delay`` seconds, in reading order. 
+    Besides the pairing of the moves, this hold lets the file operations settle 
+    before their events are post-treated (for example, a file copied with 
+    :py:func:`shutil.copy2` gets its modification time after its creation event, 
+    which is needed to find the source of the copy).
+
+    :param delay:
+        Number of seconds each low-level event is held. An ``IN_MOVED_FROM`` event 
+        that is still not paired then is considered as a `Deleted` event.
+    :type delay:
+        float
+    """
+
+    def __init__(self, delay:float):
+        self.delay = delay
+        # [event, reading_time] cells waiting for their delay to be over
+        self._pending = collections.deque()
+        # IN_MOVED_FROM cells not paired yet, by cookie
+        self._moved_from = {}
+
+    def is_empty(self) -> bool:
+        """``True`` if no low-level event is waiting."""
+        return not self._pending
+
+    def add(self, inotify_events:list, now:float):
+        """Adds the low-level events read at the ``now`` monotonic time."""
+        for inotify_event in inotify_events:
+            if inotify_event.is_moved_to:
+                from_cell = self._moved_from.pop(inotify_event.cookie, None)
+                if from_cell is not None:
+                    from_event, from_cell[0] = from_cell[0], None
+                    self._pending.append([(from_event, inotify_event), now])
+                    continue
+            cell = [inotify_event, now]
+            if inotify_event.is_moved_from:
+                self._moved_from[inotify_event.cookie] = cell
+            self._pending.append(cell)
+
+    def ready_events(self, now:float) -> list:
+        """
+        Returns the watchdog events of the waiting low-level events whose delay 
+        is over (see :py:func:`~lazydog.revised_watchdog.observers.inotify.classify_event`).
+        """
+        events = []
+        decode_path = unicode_paths.decode
+        while self._pending and now - self._pending[0][1] >= self.delay:
+            inotify_event = self._pending.popleft()[0]
+            if inotify_event is not None and not isinstance(inotify_event, tuple) and inotify_event.is_moved_from:
+                self._moved_from.pop(inotify_event.cookie, None)
+            event = classify_event(inotify_event, decode_path) if inotify_event is not None else None
+            # consecutive repeated events are skipped, as the observer queue does
+            if event is not None and (not events or event != events[-1]):
+                events.append(event)
+        return events
+
+    def next_timeout(self, now:float):
+        """Returns the number of seconds until the delay of an event is over, or ``None``."""
+        if not self._pending:
+            return None
+        return self._pending[0][1] + self.delay - now
+
+
+class FusedEventHandler(HighlevelEventHandler):
+    """
+    Same as :py:class:`HighlevelEventHandler`, but reading the low-level events 
+    itself, instead of relying on a watchdog observer. A single thread waits 
+    on the ``inotify`` file descriptor (with :py:mod:`selectors`), parses the 
+    events, pairs the moves, and post-treats the low-level events inline, so 
+    that events do not cross any thread boundary. The same thread also prepares 
+    the high-level events as soon as their release deadline is reached, so that 
+    :py:meth:`get_available_events` only returns them.
+
+    Use the ``fused_pipeline`` parameter of :py:meth:`~HighlevelEventHandler.get_instance` 
+    to get such a handler. The ``lowlevel_event_queue`` must not be scheduled with 
+    any observer: it is filled by this handler.
+
+    If an ``inotify`` instance is given, the watched directory is added to it 
+    (see :py:meth:`~lazydog.revised_watchdog.observers.inotify_c.Inotify.add_root`), 
+    and the handler is not meant to be started: the events are read and routed by 
+    the owner of the instance (see :py:class:`~lazydog.watchers.MultiRootWatcher`).
+    The optional ``event_masks`` of the sub-trees of the watched directory are 
+    given to the ``inotify`` instance.
+    """
+
+    MOVE_PAIRING_DELAY = InotifyBuffer.delay
+    """
+    Number of seconds each low-level event is held, as in 
+    :py:class:`~lazydog.revised_watchdog.observers.inotify_buffer.InotifyBuffer`: 
+    an ``IN_MOVED_FROM`` event waits for its ``IN_MOVED_TO`` event during this 
+    time, before being considered as a `Deleted` event.
+    """
+
+    POLLING_PERIOD = 0.2
+    """
+    Number of seconds between two checks, while some high-level events are late
+    or while a rescan waits for the local state to be ready.
+    """
+
+    def __init__(self, lowlevel_event_queue:DatedlocaleventQueue, local_states:LocalState, inotify:Inotify=None, 
+                 event_masks:dict=None):
+        super(FusedEventHandler, self).__init__(lowlevel_event_queue, local_states)
+        self.name = 'Fused local event handler'
+        # watches are added now, so that nothing is missed while indexing
+        if inotify is None:
+            inotify = Inotify(unicode_paths.encode(local_states.absolute_root_folder), recursive=True, 
+                              path_filter=local_states.path_filter, event_masks=event_masks)
+        else:
+            inotify.add_root(unicode_paths.encode(local_states.absolute_root_folder), local_states.path_filter, 
+                             event_masks)
+        self._inotify = inotify
+        self._moves = MovePairing(FusedEventHandler.MOVE_PAIRING_DELAY)
+        # high-level events prepared by the handler thread
+        self._released = []
+        self._released_lock = threading.Lock()
+        self._wakeup = None
+
+    def stop(self):
+        """
+        Same as :py:meth:`HighlevelEventHandler.stop`, but the handler thread 
+        is woken up, and stops immediately.
+        """
+        super(FusedEventHandler, self).stop()
+        wakeup = self._wakeup
+        if wakeup is not None:
+            try:
+                os.write(wakeup[1], b'\0')
+            except OSError:
+                pass
+
+    def is_idle(self) -> bool:
+        """
+        Returns ``True`` if there is neither any pending low-level event, 
+        nor any high-level event waiting to be released.
+        """
+        return self._moves.is_empty() and not self._released and super(FusedEventHandler, self).is_idle()
+
+    def get_available_events(self) -> list:
+        """
+        Returns the list of the high-level events that have been released by 
+        the handler thread since the last call. See 
+        :py:meth:`HighlevelEventHandler.get_available_events`.
+        """
+        with self._released_lock:
+            released, self._released = self._released, []
+        return released
+
+    def rescan(self) -> int:
+        """
+        Same as :py:meth:`HighlevelEventHandler.rescan`, but the low-level events 
+        held to pair the moves are post-treated first, without waiting for their delay.
+        """
+        events = self._moves.ready_events(float('inf'))
+        if events:
+            self.lowlevel_event_queue.dispatch_many(events)
+        return super(FusedEventHandler, self).rescan()
+
+    def _next_timeout(self, now:float):
+        # number of seconds until something is due, or None
+        if self._inotify.has_pending_simulations():
+            return 0
+        timeouts = [x for x in [self._moves.next_timeout(now)] if x is not None]
+        if self.events_list:
+            remaining = (HighlevelEventHandler.POSTTREATMENT_TIME_LIMIT - 
+                         LazydogEvent.datetime_difference_from_now(self._latest_highlevel_posttreatment)).total_seconds()
+            # once the deadline is over, some events may still be too recent
+            timeouts.append(remaining if remaining > 0 else FusedEventHandler.POLLING_PERIOD)
+        if self._rescan_requested:
+            timeouts.append(FusedEventHandler.POLLING_PERIOD)
+        return max(min(timeouts), 0) if timeouts else None
+
+    def run(self):
+        """
+        Threading module method, that is executed when calling :py:meth:`start` method.
+        The thread waits for the low-level events, or for the next deadline, until 
+        you call the :py:meth:`stop` method.
+        """
+        self._wakeup = os.pipe()
+        selector = selectors.DefaultSelector()
+        selector.register(self._inotify._inotify_fd, selectors.EVENT_READ)
+        selector.register(self._wakeup[0], selectors.EVENT_READ)
+        try:
+            while not self._stop_handler.is_set():
+                
+                ready = [key.fd for key, _ in selector.select(self._next_timeout(time.monotonic()))]
+                if self._stop_handler.is_set():
+                    break
+                if self._inotify._inotify_fd in ready or self._inotify.has_pending_simulations():
+                    self._moves.add(self._inotify.read_events(), time.monotonic())
+                
+                events = self._moves.ready_events(time.monotonic())
+                if events:
+                    self.lowlevel_event_queue.dispatch_many(events)
+                self._posttreat_queued_events()
+                
+                released = super(FusedEventHandler, self).get_available_events()
+                if released:
+                    with self._released_lock:
+                        self._released.extend(released)
+        finally:
+            selector.close()
+            self._inotify.close()
+            wakeup, self._wakeup = self._wakeup, None
+            for fd in wakeup:
+                os.close(fd)
@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018 Clément Warneys <clement.warneys@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+:module: lazydog.indexers
+:synopsis: Background workers filling the :py:class:`~lazydog.states.LocalState` indexes.
+:author: Clément Warneys <clement.warneys@gmail.com>
+
+When watching a large directory, computing the initial hash value of every file
+can take a long time. Instead of doing it before the observer is started (and
+so missing every modification made in the meantime), the
+:py:class:`~lazydog.states.LocalState` can be indexed in the background by a
+:py:class:`BackgroundIndexer`, while the observer is already running.
+
+In both cases, files are hashed by a :py:class:`HashingScheduler`, with one
+work queue per device, ordered by inode number.
+
+Once indexed, a :py:class:`SpeculativeHasher` can keep warm the hash values
+that copy detection is the most likely to need, while the handler is idle.
+
+"""
+
+import os
+import heapq
+import ctypes
+import logging
+import itertools
+import platform
+import threading
+import collections
+
+from lazydog.traversal import scan_tree
+
+
+# ioprio_set system call numbers, per architecture
+_IOPRIO_SET_SYSCALLS = {'x86_64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 
+                        'armv7l': 314, 'ppc64le': 273}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_IDLE = 3
+_IOPRIO_CLASS_SHIFT = 13
+
+
+def lower_io_priority() -> bool:
+    """
+    Puts the calling thread in the ``idle`` I/O scheduling class (see ``ioprio_set(2)``, 
+    Linux only), so that it only gets disk time when no other process needs it, and 
+    lowers its CPU priority. Returns ``False`` if the I/O priority could not be changed.
+    """
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
+    syscall_number = _IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if syscall_number is None:
+        return False
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        # 'who' is 0, which means the calling thread
+        return libc.syscall(syscall_number, _IOPRIO_WHO_PROCESS, 0, 
+                            _IOPRIO_CLASS_IDLE << _IOPRIO_CLASS_SHIFT) == 0
+    except (AttributeError, OSError):
+        return False
+
+
+class HashingScheduler():
+    """
+    Work queue of the files to hash, split per device (``st_dev``), so that every
+    device is read at the same time, each one with its own number of worker
+    threads. On each device, files are hashed by increasing inode number (which
+    approximates their location on the disk, thus limiting random seeks on
+    spinning disks), prioritized files first.
+
+    Files are hashed by calling ``hash_and_save(key, absolute_path)``, or by batches
+    of at most :py:attr:`BATCH_SIZE` files, calling ``hash_and_save_many(couples)`` 
+    with a list of ``(key, absolute_path)`` couples, if provided.
+
+    The same scheduler (and so the same worker threads) can be shared by several
+    local states: each file is then submitted with an ``owner``, whose own
+    ``hash_and_save`` and ``hash_and_save_many`` attributes are called instead
+    (see :py:class:`BackgroundIndexer`).
+
+    :param hash_and_save:
+        Function computing and saving the hash value of a file.
+    :type hash_and_save:
+        function
+    :param workers_per_device:
+        *Optional*. Number of worker threads per device, 1 by default. Either an 
+        integer, applying to every device, or a dictionary ``{st_dev: workers}`` 
+        (devices not in the dictionary get 1 worker).
+    :type workers_per_device:
+        int
+    :param low_io_priority:
+        *Optional*. ``False`` by default. If ``True``, the worker threads run with 
+        the lowest I/O and CPU priorities (see :py:func:`lower_io_priority`).
+    :type low_io_priority:
+        boolean
+    :param hash_and_save_many:
+        *Optional*. Function computing and saving the hash values of a batch of files.
+    :type hash_and_save_many:
+        function
+    """
+
+    BATCH_SIZE = 64
+    """Maximum number of files given to a single ``hash_and_save_many`` call."""
+
+    def __init__(self, hash_and_save, workers_per_device=1, low_io_priority:bool=False, hash_and_save_many=None):
+        self.hash_and_save = hash_and_save
+        self.hash_and_save_many = hash_and_save_many
+        self.workers_per_device = workers_per_device
+        self.low_io_priority = low_io_priority
+
+        # one heap of (priority, st_ino, order, key, absolute_path, owner) per device
+        self._queues = {}
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._pending_by_owner = collections.Counter()
+        self._started = False
+        self._closed = False
+        self._threads = []
+
+    def _workers_for(self, device:int) -> int:
+        if isinstance(self.workers_per_device, dict):
+            return self.workers_per_device.get(device, 1)
+        return self.workers_per_device
+
+    def _start_device(self, device:int):
+        for i in range(self._workers_for(device)):
+            thread = threading.Thread(target=self._run, args=(device,), name='Hashing worker %d (device %d)' % (i, device))
+            thread.daemon = True
+            self._threads.append(thread)
+            thread.start()
+
+    def submit(self, key:str, absolute_path:str, device:int, inode:int, priority:int=1, owner=None):
+        """
+        Queues a file to hash, from its device and inode numbers. Files with
+        a lower ``priority`` value are hashed first. The file is hashed by the 
+        ``owner`` functions, if any.
+        """
+        owner = owner if owner is not None else self
+        with self._condition:
+            queue = self._queues.get(device)
+            if queue is None:
+                queue = self._queues[device] = []
+                if self._started:
+                    self._start_device(device)
+            heapq.heappush(queue, (priority, inode, next(self._order), key, absolute_path, owner))
+            self._pending += 1
+            self._pending_by_owner[owner] += 1
+            self._condition.notify_all()
+
+    def start(self):
+        """
+        Starts the worker threads of the devices already known. Workers of new 
+        devices are then started as soon as a file of these devices is submitted.
+        """
+        with self._condition:
+            self._started = True
+            for device in self._queues:
+                self._start_device(device)
+
+    def close(self):
+        """Tells the workers that no more file will be submitted."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def stop(self, owner=None):
+        """
+        Forgets every queued file, and stops the workers. If an ``owner`` is 
+        given, only its own files are forgotten, and the workers keep running.
+        """
+        with self._condition:
+            for queue in self._queues.values():
+                forgotten = [x for x in queue if owner is None or x[5] is owner]
+                for x in forgotten:
+                    self._pending_by_owner[x[5]] -= 1
+                self._pending -= len(forgotten)
+                queue[:] = [x for x in queue if owner is not None and x[5] is not owner]
+                heapq.heapify(queue)
+            self._condition.notify_all()
+        if owner is None:
+            self.close()
+
+    def join(self, owner=None):
+        """
+        Blocks until every submitted file (or every file of the ``owner``) 
+        has been hashed.
+        """
+        with self._condition:
+            while self.pending(owner) > 0:
+                self._condition.wait()
+
+    def pending(self, owner=None) -> int:
+        """Returns the number of files (of the ``owner``) queued or being hashed."""
+        with self._condition:
+            return self._pending if owner is None else self._pending_by_owner[owner]
+
+    def _run(self, device:int):
+        if self.low_io_priority:
+            lower_io_priority()
+        queue = self._queues[device]
+        while True:
+            with self._condition:
+                while not queue and not self._closed:
+                    self._condition.wait()
+                if not queue:
+                    return
+                # a batch only contains files of the same owner
+                owner = queue[0][5]
+                batch_size = HashingScheduler.BATCH_SIZE if owner.hash_and_save_many is not None else 1
+                batch = []
+                while queue and queue[0][5] is owner and len(batch) < batch_size:
+                    batch.append(heapq.heappop(queue)[3:5])
+            try:
+                if owner.hash_and_save_many is not None:
+                    owner.hash_and_save_many(batch)
+                else:
+                    owner.hash_and_save(*batch[0])
+            except Exception:
+                logging.getLogger(__name__).exception('Error while hashing files %s' % [x[1] for x in batch])
+            finally:
+                with self._condition:
+                    self._pending -= len(batch)
+                    self._pending_by_owner[owner] -= len(batch)
+                    self._condition.notify_all()
+
+
+class BackgroundIndexer():
+    """
+    Browses the watched directory with :py:func:`~lazydog.traversal.scan_tree` and
+    indexes every file and folder in the :py:class:`~lazydog.states.LocalState`.
+    Sizes, modification times and inodes are saved while browsing, by a single thread, 
+    and files are then hashed by a :py:class:`HashingScheduler`.
+
+    Live events are taken into account while indexing (see :py:meth:`prioritize`):
+
+    * the directory containing a path touched by a live event is indexed first, \
+    since its other files are the most probable sources of a copy,
+    * the touched path itself is never indexed by the workers, because its current \
+    content is not the reference one anymore: it is saved in the local state when \
+    the related high-level event is released, as usual.
+
+    Paths that are already known by the local state are not indexed again, so the
+    directory can be browsed while the local state is updated by live events.
+
+    :param local_states:
+        The local state to fill.
+    :type local_states:
+        :py:class:`~lazydog.states.LocalState`
+    :param workers:
+        *Optional*. Number of hashing threads per device, 1 by default (see the 
+        ``workers_per_device`` parameter of :py:class:`HashingScheduler`).
+    :type workers:
+        int
+    :param low_io_priority:
+        *Optional*. ``False`` by default. If ``True``, the indexing threads run with 
+        the lowest I/O and CPU priorities (see :py:func:`lower_io_priority`).
+    :type low_io_priority:
+        boolean
+    :param scheduler:
+        *Optional*. An already started :py:class:`HashingScheduler`, shared with other
+        indexers. By default, the indexer has its own scheduler, with ``workers`` 
+        threads per device.
+    :type scheduler:
+        :py:class:`HashingScheduler`
+    """
+
+    def __init__(self, local_states, workers=1, low_io_priority:bool=False, scheduler:HashingScheduler=None):
+        self.local_states = local_states
+        self.workers = workers
+        self.low_io_priority = low_io_priority
+
+        self._prefix_len = len(os.path.join(local_states.absolute_root_folder, ''))
+        self._exclude = local_states.exclude_function()
+        self._entries = scan_tree(local_states.absolute_root_folder, exclude=self._exclude)
+        self._priority_dirs = collections.deque()
+        self._priority_entries = collections.deque()
+        self._touched = set()
+        self._touched.clear()
+        # directory whose entries are being registered, by priority (see _list)
+        self._listings = {0: None, 1: None}
+
+        # the owner functions of the files submitted to a shared scheduler
+        self.hash_and_save = self._hash_file
+        self.hash_and_save_many = self._hash_files if local_states.has_batch_hashing() else None
+        self._shared_scheduler = scheduler is not None
+        if scheduler is None:
+            scheduler = HashingScheduler(self.hash_and_save, workers, low_io_priority, self.hash_and_save_many)
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop_indexing = threading.Event()
+        self._thread = None
+
+        # counters
+        self.discovered = 0
+        self.indexed = 0
+
+    def start(self):
+        """Starts browsing the directory, and the hashing workers."""
+        if not self._shared_scheduler:
+            self.scheduler.start()
+        self._thread = threading.Thread(target=self.run, name='Local state indexer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Asks the indexing threads to stop, once their current path is indexed."""
+        self._stop_indexing.set()
+        self.scheduler.stop(self if self._shared_scheduler else None)
+
+    def submit(self, key:str, absolute_path:str, device:int, inode:int, priority:int=1):
+        """Queues a file to hash, see :py:meth:`HashingScheduler.submit`."""
+        self.scheduler.submit(key, absolute_path, device, inode, priority, self if self._shared_scheduler else None)
+
+    def is_ready(self) -> bool:
+        """Returns ``True`` once the whole directory has been indexed."""
+        return self._ready.is_set()
+
+    def wait_until_ready(self, timeout:float=None) -> bool:
+        """
+        Blocks until the whole directory has been indexed, or until ``timeout``
+        seconds have elapsed. Returns :py:meth:`is_ready`.
+        """
+        return self._ready.wait(timeout)
+
+    def progress(self) -> dict:
+        """
+        Returns the current indexing status, as a dictionary with the
+        following keys:
+
+        * ``ready``: ``True`` once the whole directory has been indexed,
+        * ``discovered``: number of files and folders found so far,
+        * ``indexed``: number of files and folders indexed so far (paths \
+        already known by the local state are not counted).
+        """
+        with self._lock:
+            return {'ready': self.is_ready(),
+                    'discovered': self.discovered,
+                    'indexed': self.indexed}
+
+    def prioritize(self, key:str):
+        """
+        Tells the indexer that the ``key`` relative path has been touched by a
+        live event: its directory is indexed before any other one, but the path
+        itself is not indexed anymore.
+        """
+        if self.is_ready():
+            return
+        with self._lock:
+            self._touched.add(key)
+            self._priority_dirs.append(os.path.dirname(self.local_states.absolute_local_path(key)))
+
+    def _next_entry(self):
+        # returns the next (entry, priority) couple to index, or None
+        with self._lock:
+            while not self._priority_entries and self._priority_dirs:
+                try:
+                    with os.scandir(self._priority_dirs.popleft()) as entries:
+                        self._priority_entries.extend(x for x in entries if self._exclude is None or not self._exclude(x))
+                except OSError:
+                    pass
+            if self._priority_entries:
+                return self._priority_entries.popleft(), 0
+            try:
+                entry = next(self._entries)
+            except StopIteration:
+                return None
+            self.discovered += 1
+            return entry, 1
+
+    def _hash_file(self, key:str, absolute_path:str):
+        if key in self._touched:
+            return
+        self.local_states._index_hash(key, absolute_path, False)
+        with self._lock:
+            self.indexed += 1
+
+    def _hash_files(self, couples:list):
+        couples = [x for x in couples if x[0] not in self._touched]
+        self.local_states._index_hashes(couples)
+        with self._lock:
+            self.indexed += len(couples)
+
+    def _list(self, relative_path:str, priority:int):
+        # the entries of a directory come one after the other: once the next 
+        # directory starts, the previous one is entirely registered
+        parent = os.path.dirname(relative_path)
+        if priority == 1:
+            self._end_listing(0)
+        if parent != self._listings[priority]:
+            self._end_listing(priority)
+            self._listings[priority] = parent
+
+    def _end_listing(self, priority:int):
+        if self._listings[priority] is not None:
+            self.local_states._set_listed(self._listings[priority])
+            self._listings[priority] = None
+
+    def run(self):
+        """
+        Browses and indexes the whole directory in the calling thread, until 
+        its files are hashed. Called by :py:meth:`start`, or directly, for 
+        example to index several directories one after another.
+        """
+        if self.low_io_priority and not self._shared_scheduler:
+            lower_io_priority()
+        while not self._stop_indexing.is_set():
+            next_entry = self._next_entry()
+            if next_entry is None:
+                break
+            entry, priority = next_entry
+            relative_path = '/' + entry.path[self._prefix_len:]
+            self._list(relative_path, priority)
+            if relative_path in self._touched:
+                continue
+            # files submitted to the scheduler are counted once hashed
+            if self.local_states._index_entry(relative_path, entry, self, priority):
+                with self._lock:
+                    self.indexed += 1
+        if self._shared_scheduler:
+            self.scheduler.join(self)
+        else:
+            self.scheduler.close()
+            self.scheduler.join()
+        if not self._stop_indexing.is_set():
+            self.local_states._set_listed()
+        with self._lock:
+            if not self._stop_indexing.is_set():
+                self._touched.clear()
+                self._ready.set()
+                logging.info('Background indexing of %s done (%d paths indexed)'
+                             % (self.local_states.absolute_root_folder, self.indexed))
+
+
+class SpeculativeHasher():
+    """
+    Low-priority background task computing in advance the hash values that copy
+    detection is the most likely to need: the hash values of the files sharing
+    their couple ``(file_size, file_modification_time)`` with another file (see
+    :py:meth:`~lazydog.states.LocalState.get_colliding_sizetimes`). When a copy
+    arrives, :py:meth:`~lazydog.states.LocalState.get_files_by_hash_key` then
+    finds warm values, instead of hashing the candidates synchronously. Apart
+    from the first scan, only the couples that start colliding are warmed up (see
+    :py:meth:`~lazydog.states.LocalState.pop_colliding_sizetimes`), so that the
+    whole local state is not browsed again at each interval.
+
+    This is useful when the hash values are not all kept in memory (see the
+    ``max_resident_hashes`` parameter of :py:class:`~lazydog.states.LocalState`).
+
+    Hashing only happens while ``is_idle()`` returns ``True`` and once the local
+    state is fully indexed, and is throttled so that at most ``io_budget`` bytes
+    per second are read.
+
+    :param local_states:
+        The local state to warm up.
+    :type local_states:
+        :py:class:`~lazydog.states.LocalState`
+    :param is_idle:
+        *Optional*. Function returning ``True`` when the handler has nothing
+        to do. By default, the hasher is always considered idle.
+    :type is_idle:
+        function
+    :param io_budget:
+        *Optional*. Maximum number of bytes read per second.
+    :type io_budget:
+        int
+    :param interval:
+        *Optional*. Number of seconds between two warm-ups of the local state.
+    :type interval:
+        float
+    :param low_io_priority:
+        *Optional*. ``True`` by default, which means that the background thread runs 
+        with the lowest I/O and CPU priorities (see :py:func:`lower_io_priority`).
+    :type low_io_priority:
+        boolean
+    """
+
+    DEFAULT_IO_BUDGET = 16 * 1024 * 1024
+    """Default maximum number of bytes hashed per second (16 MiB/s)."""
+
+    def __init__(self, local_states, is_idle=None, io_budget:int=DEFAULT_IO_BUDGET, interval:float=5.0, 
+                 low_io_priority:bool=True):
+        self.local_states = local_states
+        self.low_io_priority = low_io_priority
+        self.is_idle = is_idle if is_idle is not None else (lambda: True)
+        self.io_budget = io_budget
+        self.interval = interval
+
+        self._stop_hashing = threading.Event()
+        self._thread = None
+
+        # colliding sizetime values not fully warmed up yet (ordered set)
+        self._pending_sizetimes = {}
+
+        # counters
+        self.hashed = 0
+        self.hashed_bytes = 0
+
+    def start(self):
+        """Starts the background thread."""
+        self._thread = threading.Thread(target=self._run, name='Speculative hasher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Asks the background thread to stop."""
+        self._stop_hashing.set()
+
+    def _can_hash(self) -> bool:
+        return not self._stop_hashing.is_set() and self.local_states.is_ready() and self.is_idle()
+
+    def warm_up(self) -> int:
+        """
+        Computes the missing hash values of the files whose size and modification
+        time started colliding with another file, as long as the handler is idle. 
+        With a bounded memory, at most half of the resident hash values are renewed, 
+        so that the warmed values are not evicted by the next ones: the remaining 
+        files are warmed up by the next calls. Returns the number of hash values 
+        computed.
+        """
+        if not self._can_hash():
+            return 0
+        for sizetime in self.local_states.pop_colliding_sizetimes():
+            self._pending_sizetimes[sizetime] = None
+        max_size = getattr(self.local_states.hashes, 'max_size', None)
+        limit = max(max_size // 2, 1) if max_size is not None else None
+        hashed = 0
+        for sizetime in list(self._pending_sizetimes):
+            for key in self.local_states.get_files_by_sizetime_key(sizetime):
+                if not self._can_hash() or (limit is not None and hashed >= limit):
+                    return hashed
+                if self.local_states.has_resident_hash(key):
+                    continue
+                self.local_states.get_hash(key)
+                hashed += 1
+                self.hashed += 1
+                file_size = sizetime[0] if isinstance(sizetime[0], int) else 0
+                self.hashed_bytes += file_size
+                # I/O budget
+                self._stop_hashing.wait(file_size / self.io_budget)
+            del self._pending_sizetimes[sizetime]
+        return hashed
+
+    def _run(self):
+        if self.low_io_priority:
+            lower_io_priority()
+        while not self._stop_hashing.wait(self.interval):
+            if self._can_hash():
+                self.warm_up()
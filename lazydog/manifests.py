@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018 Clément Warneys <clement.warneys@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+:module: lazydog.manifests
+:synopsis: Streaming readers of initial values files (manifests).
+:author: Clément Warneys <clement.warneys@gmail.com>
+
+The ``custom_intializing_values`` of a :py:class:`~lazydog.states.LocalState`
+(or of :py:meth:`~lazydog.handlers.HighlevelEventHandler.get_instance`) can be
+given as a file, instead of a dictionary, in one of the following formats:
+
+* JSON lines (``.jsonl`` or ``.ndjson`` extension), one object per line::
+
+    {"path": "/dir/file.txt", "hash": "e3b0c442...", "size": 0, "mtime": 1546300800.0}
+
+* CSV (``.csv`` extension), one ``path,hash,size,mtime`` row per line, without header::
+
+    /dir/file.txt,e3b0c442...,0,1546300800.0
+
+The readers defined here yield the entries one by one, so that the whole file
+never needs to be loaded in memory. Directories may be listed with the
+``DIR`` hash, size and time values, as saved by the local state.
+
+"""
+
+import os
+import csv
+import json
+
+
+def _parse_number(value:str, number_type):
+    # sizes and times of directories are not numbers
+    try:
+        return number_type(value)
+    except ValueError:
+        return value
+
+
+def read_json_lines(file_path:str):
+    """
+    Yields one ``(key, (file_hash, file_size, file_mtime))`` couple per line
+    of the JSON lines file at ``file_path``. Blank lines are skipped.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                value = json.loads(line)
+                yield value['path'], (value['hash'], value['size'], value['mtime'])
+
+
+def read_csv(file_path:str):
+    """
+    Yields one ``(key, (file_hash, file_size, file_mtime))`` couple per row
+    of the CSV file at ``file_path``. Blank rows are skipped.
+    """
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            if row:
+                yield row[0], (row[1], _parse_number(row[2], int), _parse_number(row[3], float))
+
+
+def read_manifest(file_path:str):
+    """
+    Yields the entries of the manifest at ``file_path``, with :py:func:`read_csv`
+    or :py:func:`read_json_lines` depending on its extension. Raises ``ValueError``
+    if the extension is unknown.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.csv':
+        return read_csv(file_path)
+    if extension in ['.jsonl', '.ndjson']:
+        return read_json_lines(file_path)
+    raise ValueError('Unknown manifest format: %s' % file_path)
@@ -25,7 +25,8 @@ aggregation with other simultaneous events.
 
 from lazydog.states import LocalState
 from lazydog.events import LazydogEvent
-from lazydog.revised_watchdog.events import FileSystemEventHandler
+from lazydog.revised_watchdog.events import FileSystemEventHandler, EVENT_TYPE_OVERFLOW
+from watchdog.events import EVENT_TYPE_MOVED, DirCreatedEvent, FileCreatedEvent, DirDeletedEvent, FileDeletedEvent
 
 
 class DatedlocaleventQueue(FileSystemEventHandler):
@@ -39,12 +40,21 @@ class DatedlocaleventQueue(FileSystemEventHandler):
 
     The :py:class:`~lazydog.queues.DatedlocaleventQueue` has to be initialized 
     with a :py:class:`~lazydog.states.LocalState` object.
+
+    Overflow events (some low-level events have been lost) are not queued, but
+    counted in :py:attr:`overflows`, and reported by :py:meth:`pop_rescan_request`.
+
+    The events of the paths excluded by the ``path_filter`` of the local state 
+    (see :py:class:`~lazydog.filters.PathFilter`) are not queued either. A move out 
+    of (or into) the excluded paths is queued as a `Deleted` (or `Created`) event.
     """
 
     def __init__(self, local_states:LocalState):
         self.events_list = []
         self.events_list.clear()
         self.local_states = local_states
+        self.overflows = 0
+        self._rescan_requested = False
         super(DatedlocaleventQueue, self).__init__()
 
     def on_any_event(self, event):
@@ -57,7 +67,75 @@ class DatedlocaleventQueue(FileSystemEventHandler):
             :py:class:`watchdog.events.FileSystemEvent`
         """
         super(DatedlocaleventQueue, self).on_any_event(event)
-        self.events_list.append(LazydogEvent(event, self.local_states))
+        if event.event_type != EVENT_TYPE_OVERFLOW:
+            event = self._filter(event)
+            if event is not None:
+                self.events_list.append(LazydogEvent(event, self.local_states))
+
+    def _is_excluded(self, absolute_path:str, is_dir:bool) -> bool:
+        return self.local_states.path_filter.is_excluded(
+            self.local_states.relative_local_path(absolute_path), is_dir, 'events')
+
+    def _filter(self, event):
+        """
+        Private method returning the event to queue instead of ``event``, 
+        according to the exclusion rules of the local state, or ``None``.
+        """
+        if self.local_states.path_filter is None:
+            return event
+        src_excluded = self._is_excluded(event.src_path, event.is_directory)
+        if event.event_type == EVENT_TYPE_MOVED:
+            dest_excluded = self._is_excluded(event.dest_path, event.is_directory)
+            if src_excluded and not dest_excluded:
+                return (DirCreatedEvent if event.is_directory else FileCreatedEvent)(event.dest_path)
+            if dest_excluded and not src_excluded:
+                return (DirDeletedEvent if event.is_directory else FileDeletedEvent)(event.src_path)
+        return None if src_excluded else event
+
+    def dispatch_many(self, events:list):
+        """
+        Adds a batch of low-level events to the queue at once, see 
+        :py:meth:`on_any_event`.
+
+        :param events:
+            The list of event objects representing the file system events.
+        :type events:
+            list
+        """
+        lazydog_events = []
+        for event in events:
+            if event.event_type == EVENT_TYPE_OVERFLOW:
+                # the events read before the overflow are queued before it
+                self.events_list.extend(lazydog_events)
+                lazydog_events = []
+                self.dispatch(event)
+                continue
+            event = self._filter(event)
+            if event is not None:
+                lazydog_events.append(LazydogEvent(event, self.local_states))
+        self.events_list.extend(lazydog_events)
+
+    def on_overflow(self, event):
+        """
+        Called when some low-level events have been lost, so that the 
+        watched directory has to be rescanned.
+
+        :param event:
+            The event object representing the overflow.
+        :type event:
+            :py:class:`~revised_watchdog.events.OverflowEvent`
+        """
+        self.overflows += 1
+        self._rescan_requested = True
+
+    def pop_rescan_request(self) -> bool:
+        """
+        Returns ``True`` if some low-level events have been lost since the 
+        last call, and so the watched directory has to be rescanned.
+        """
+        rescan_requested = self._rescan_requested
+        self._rescan_requested = False
+        return rescan_requested
 
     def next(self):
         """
@@ -66,6 +144,17 @@ class DatedlocaleventQueue(FileSystemEventHandler):
         """
         return self.events_list.pop(0) if not self.is_empty() else None
             
+    def next_many(self) -> list:
+        """
+        Provides with every event that has been queued, oldest first, 
+        removing them from the queue in the same time.
+        """
+        # events may be added meanwhile, at the end of the list
+        size = len(self.events_list)
+        events = self.events_list[:size]
+        del self.events_list[:size]
+        return events
+            
     def size(self):
         """Returns an integer corresponding to the current size of the queue."""
         return len(self.events_list)
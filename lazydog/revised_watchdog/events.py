@@ -47,8 +47,14 @@ from only metadata (access date, owner, etc.) modification:
 * :py:data:`EVENT_TYPE_C_MODIFIED`
 * :py:data:`EVENT_TYPE_M_MODIFIED`
 
+It also adds an event telling that some events have been lost, because
+the kernel event queue overflowed:
+
+* :py:class:`OverflowEvent`
+* :py:data:`EVENT_TYPE_OVERFLOW`
+
 Finally, it overloads the FileSystemEventHandler class, in order 
-to manage the new granularity of modified events:
+to manage the new granularity of modified events, and the overflow events:
 
 * :py:class:`FileSystemEventHandler`
 
@@ -66,6 +72,7 @@ from watchdog.events import (
 
 EVENT_TYPE_C_MODIFIED = 'modified' # content-only modification
 EVENT_TYPE_M_MODIFIED = 'metadata' # metadata-only modification
+EVENT_TYPE_OVERFLOW = 'overflow' # some events have been lost
 
 class MetaFileModifiedEvent(FileModifiedEvent):
     """File system event representing metadata file modification on the file system."""
@@ -99,14 +106,37 @@ class TrueDirModifiedEvent(DirModifiedEvent):
     def __init__(self, src_path):
         super(TrueDirModifiedEvent, self).__init__(src_path)
 
+class OverflowEvent(FileSystemEvent):
+    """
+    File system event telling that some events have been lost under the watched 
+    directory ``src_path``, so that the file system has to be checked again.
+    """
+
+    event_type = EVENT_TYPE_OVERFLOW
+
+    is_directory = True
+
+    def __init__(self, src_path):
+        super(OverflowEvent, self).__init__(src_path)
+
 class FileSystemEventHandler(FileSystemEventHandler):
     """
     Base file system event handler that you can override methods from.
-    With modified dispatch method, added :py:meth:`on_data_modified` 
-    and :py:meth:`on_meta_modified` methods, thus covering specific 
-    needs of lazydog.
+    With modified dispatch method, added :py:meth:`on_data_modified`, 
+    :py:meth:`on_meta_modified` and :py:meth:`on_overflow` methods, thus 
+    covering specific needs of lazydog.
     """
 
+    # names of the methods called for each type of event (see dispatch)
+    _method_names = {
+        EVENT_TYPE_M_MODIFIED: 'on_meta_modified',
+        EVENT_TYPE_C_MODIFIED: 'on_data_modified',
+        EVENT_TYPE_MOVED: 'on_moved',
+        EVENT_TYPE_CREATED: 'on_created',
+        EVENT_TYPE_DELETED: 'on_deleted',
+        EVENT_TYPE_OVERFLOW: 'on_overflow',
+    }
+
     def dispatch(self, event):
         """
         Dispatches events to the appropriate methods.
@@ -117,15 +147,20 @@ class FileSystemEventHandler(FileSystemEventHandler):
             :py:class:`~watchdog.events.FileSystemEvent`
         """
         self.on_any_event(event)
-        _method_map = {
-            EVENT_TYPE_M_MODIFIED: self.on_meta_modified,
-            EVENT_TYPE_C_MODIFIED: self.on_data_modified,
-            EVENT_TYPE_MOVED: self.on_moved,
-            EVENT_TYPE_CREATED: self.on_created,
-            EVENT_TYPE_DELETED: self.on_deleted,
-        }
-        event_type = event.event_type
-        _method_map[event_type](event)
+        getattr(self, self._method_names[event.event_type])(event)
+
+    def dispatch_many(self, events:list):
+        """
+        Dispatches a batch of events, as :py:meth:`dispatch` does for each of 
+        them. Override this method to handle the whole batch at once.
+
+        :param events:
+            The list of event objects representing the file system events.
+        :type events:
+            list
+        """
+        for event in events:
+            self.dispatch(event)
 
 
     def on_data_modified(self, event):
@@ -148,3 +183,11 @@ class FileSystemEventHandler(FileSystemEventHandler):
         """
         self.on_modified(event)
 
+    def on_overflow(self, event):
+        """Called when some events have been lost.
+
+        :param event:
+            Event representing the overflow.
+        :type event:
+            :py:class:`OverflowEvent`
+        """
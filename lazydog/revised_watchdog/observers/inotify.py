@@ -36,7 +36,11 @@ The main changes concern some methods in the :py:class:`InotifyEmitter` class:
 :py:class:`~lazydog.revised_watchdog.observers.inotify_buffer.InotifyBuffer`.
 * :py:meth:`~InotifyEmitter.queue_events` This method has been simplified in order to reduce \
 the number of emitted low-level events, in comparison with \
-original watchdog module. 
+original watchdog module. Events are queued by batches.
+
+The :py:class:`InotifyObserver` dispatches these batches at once, to the 
+:py:meth:`~lazydog.revised_watchdog.events.FileSystemEventHandler.dispatch_many` method 
+of the event handlers.
 
 
 """
@@ -46,9 +50,12 @@ from watchdog.observers.inotify import (
     InotifyObserver
     )
 
+import functools
+
 from watchdog.observers.api import (
     BaseObserver,
-    DEFAULT_OBSERVER_TIMEOUT
+    DEFAULT_OBSERVER_TIMEOUT,
+    DEFAULT_EMITTER_TIMEOUT
 )
 
 from watchdog.utils import unicode_paths
@@ -69,9 +76,95 @@ from lazydog.revised_watchdog.events import (
     TrueFileModifiedEvent,
     MetaFileModifiedEvent,
     TrueDirModifiedEvent,
-    MetaDirModifiedEvent
+    MetaDirModifiedEvent,
+    OverflowEvent
     )
 
+def classify_event(event, decode_path, full_events:bool=False):
+    """
+    Returns the watchdog event corresponding to an event (or tuple of from/to 
+    events) read from :py:class:`~lazydog.revised_watchdog.observers.inotify_buffer.InotifyBuffer`, 
+    or ``None`` if the event is not relevant. See :py:meth:`InotifyEmitter.queue_events`.
+
+    :param event:
+        The event, or tuple of paired from/to events.
+    :type event:
+        :py:class:`~watchdog.observers.inotify_c.InotifyEvent`
+    :param decode_path:
+        Function turning the ``bytes`` paths of the event into the paths of the 
+        watchdog event.
+    :type decode_path:
+        function
+    :param full_events:
+        See :py:meth:`InotifyEmitter.queue_events`.
+    :type full_events:
+        boolean
+    """
+    if isinstance(event, tuple):
+        move_from, move_to = event
+        src_path = decode_path(move_from.src_path)
+        dest_path = decode_path(move_to.src_path)
+        cls = DirMovedEvent if move_from.is_directory else FileMovedEvent
+        return cls(src_path, dest_path)
+        #===============================================================
+        # self.queue_event(MetaDirModifiedEvent(os.path.dirname(src_path)))
+        # self.queue_event(MetaDirModifiedEvent(os.path.dirname(dest_path)))
+        #===============================================================
+        #===============================================================
+        # if move_from.is_directory and self.watch.is_recursive:
+        #     for sub_event in generate_sub_moved_events(src_path, dest_path):
+        #         self.queue_event(sub_event)
+        #===============================================================
+
+    src_path = decode_path(event.src_path)
+    if event.wd == -1:
+        # the kernel event queue overflowed
+        return OverflowEvent(src_path)
+    elif event.is_moved_to:
+        if (full_events):
+            cls = DirMovedEvent if event.is_directory else FileMovedEvent
+            return cls(None, src_path)
+        else:
+            cls = DirCreatedEvent if event.is_directory else FileCreatedEvent
+            return cls(src_path)
+        #===============================================================
+        # self.queue_event(DirModifiedEvent(os.path.dirname(src_path)))
+        #===============================================================
+        #===============================================================
+        # if event.is_directory and self.watch.is_recursive:
+        #     for sub_event in generate_sub_created_events(src_path):
+        #         self.queue_event(sub_event)
+        #===============================================================
+    elif event.is_attrib:
+        cls = MetaDirModifiedEvent if event.is_directory else MetaFileModifiedEvent
+        return cls(src_path)
+    elif event.is_modify:
+        cls = TrueDirModifiedEvent if event.is_directory else TrueFileModifiedEvent
+        return cls(src_path)
+    elif event.is_close_write and not event.is_directory:
+        # sub-trees watched with the CLOSE_WRITE_EVENTS mask
+        return TrueFileModifiedEvent(src_path)
+    elif event.is_delete or (event.is_moved_from and not full_events):
+        cls = DirDeletedEvent if event.is_directory else FileDeletedEvent
+        return cls(src_path)
+        #===============================================================
+        # self.queue_event(DirModifiedEvent(os.path.dirname(src_path)))
+        #===============================================================
+    elif event.is_moved_from and full_events:
+        cls = DirMovedEvent if event.is_directory else FileMovedEvent
+        return cls(src_path, None)
+        #===============================================================
+        # self.queue_event(DirModifiedEvent(os.path.dirname(src_path)))
+        #===============================================================
+    elif event.is_create:
+        cls = DirCreatedEvent if event.is_directory else FileCreatedEvent
+        return cls(src_path)
+        #===============================================================
+        # self.queue_event(DirModifiedEvent(os.path.dirname(src_path)))
+        #===============================================================
+    return None
+
+
 class InotifyEmitter(InotifyEmitter):
     """
     inotify(7)-based event emitter. Revised package mainly 
@@ -90,17 +183,35 @@ class InotifyEmitter(InotifyEmitter):
         Read events blocking timeout (in seconds).
     :type timeout:
         float
+    :param path_filter:
+        *Optional*. Exclusion rules of the watched directory, see 
+        :py:class:`~lazydog.revised_watchdog.observers.inotify_c.Inotify`.
+    :type path_filter:
+        :py:class:`~lazydog.filters.PathFilter`
+    :param event_masks:
+        *Optional*. Event masks of some sub-trees of the watched directory, see 
+        :py:class:`~lazydog.revised_watchdog.observers.inotify_c.Inotify`.
+    :type event_masks:
+        dict
     """
 
+    def __init__(self, event_queue, watch, timeout=DEFAULT_EMITTER_TIMEOUT, path_filter=None, 
+                 event_masks=None):
+        super(InotifyEmitter, self).__init__(event_queue, watch, timeout)
+        self.path_filter = path_filter
+        self.event_masks = event_masks
+
     def on_thread_start(self):
         path = unicode_paths.encode(self.watch.path)
-        self._inotify = InotifyBuffer(path, self.watch.is_recursive)
+        self._inotify = InotifyBuffer(path, self.watch.is_recursive, self.path_filter, self.event_masks)
 
 
     def queue_events(self, timeout, full_events=False):
         """
         This method is classifying the events received from Inotify into
         watchdog events type (defined in :py:mod:`watchdog.events` module).
+        Every event read at once is queued at once, as a list (see 
+        :py:meth:`InotifyObserver.dispatch_events`).
 
         :param timeout:
             Unused param (from watchdog original package).
@@ -118,66 +229,14 @@ class InotifyEmitter(InotifyEmitter):
         """
         with self._lock:
 
-            event = self._inotify.read_event()
-            if event is None:
-                return
-            if isinstance(event, tuple):
-                move_from, move_to = event
-                src_path = self._decode_path(move_from.src_path)
-                dest_path = self._decode_path(move_to.src_path)
-                cls = DirMovedEvent if move_from.is_directory else FileMovedEvent
-                self.queue_event(cls(src_path, dest_path))
-                #===============================================================
-                # self.queue_event(MetaDirModifiedEvent(os.path.dirname(src_path)))
-                # self.queue_event(MetaDirModifiedEvent(os.path.dirname(dest_path)))
-                #===============================================================
-                #===============================================================
-                # if move_from.is_directory and self.watch.is_recursive:
-                #     for sub_event in generate_sub_moved_events(src_path, dest_path):
-                #         self.queue_event(sub_event)
-                #===============================================================
-                return
-
-            src_path = self._decode_path(event.src_path)
-            if event.is_moved_to:
-                if (full_events):
-                    cls = DirMovedEvent if event.is_directory else FileMovedEvent
-                    self.queue_event(cls(None, src_path))
-                else:
-                    cls = DirCreatedEvent if event.is_directory else FileCreatedEvent
-                    self.queue_event(cls(src_path))
-                #===============================================================
-                # self.queue_event(DirModifiedEvent(os.path.dirname(src_path)))
-                #===============================================================
-                #===============================================================
-                # if event.is_directory and self.watch.is_recursive:
-                #     for sub_event in generate_sub_created_events(src_path):
-                #         self.queue_event(sub_event)
-                #===============================================================
-            elif event.is_attrib:
-                cls = MetaDirModifiedEvent if event.is_directory else MetaFileModifiedEvent
-                self.queue_event(cls(src_path))
-            elif event.is_modify:
-                cls = TrueDirModifiedEvent if event.is_directory else TrueFileModifiedEvent
-                self.queue_event(cls(src_path))
-            elif event.is_delete or (event.is_moved_from and not full_events):
-                cls = DirDeletedEvent if event.is_directory else FileDeletedEvent
-                self.queue_event(cls(src_path))
-                #===============================================================
-                # self.queue_event(DirModifiedEvent(os.path.dirname(src_path)))
-                #===============================================================
-            elif event.is_moved_from and full_events:
-                cls = DirMovedEvent if event.is_directory else FileMovedEvent
-                self.queue_event(cls(src_path, None))
-                #===============================================================
-                # self.queue_event(DirModifiedEvent(os.path.dirname(src_path)))
-                #===============================================================
-            elif event.is_create:
-                cls = DirCreatedEvent if event.is_directory else FileCreatedEvent
-                self.queue_event(cls(src_path))
-                #===============================================================
-                # self.queue_event(DirModifiedEvent(os.path.dirname(src_path)))
-                #===============================================================
+            events = []
+            for inotify_event in self._inotify.read_events():
+                event = classify_event(inotify_event, self._decode_path, full_events)
+                # consecutive repeated events are skipped, as the observer queue does
+                if event is not None and (not events or event != events[-1]):
+                    events.append(event)
+            if events:
+                self._event_queue.put((events, self.watch))
 
 
 class InotifyObserver(InotifyObserver):
@@ -185,13 +244,40 @@ class InotifyObserver(InotifyObserver):
     Observer thread that schedules watching directories and dispatches
     calls to event handlers. 
 
-    Please note that his class remains unmodified 
-    in revised_watchdog package. Only the :py:meth:`__init__` method is overided 
-    in order it uses the new definition of :py:class:`InotifyEmitter` class.
+    The :py:meth:`__init__` method is overided in order it uses the new definition 
+    of :py:class:`InotifyEmitter` class, and :py:meth:`dispatch_events` dispatches 
+    the batches of events queued by this emitter. The optional ``path_filter`` 
+    and ``event_masks`` are given to every emitter.
     """
 
-    def __init__(self, timeout=DEFAULT_OBSERVER_TIMEOUT, generate_full_events=False):
+    def __init__(self, timeout=DEFAULT_OBSERVER_TIMEOUT, generate_full_events=False, path_filter=None, 
+                 event_masks=None):
         if (generate_full_events):
             BaseObserver.__init__(self, emitter_class=InotifyFullEmitter, timeout=timeout)
         else:
             BaseObserver.__init__(self, emitter_class=InotifyEmitter, timeout=timeout)
+        if path_filter is not None or event_masks is not None:
+            self._emitter_class = functools.partial(self._emitter_class, path_filter=path_filter, 
+                                                    event_masks=event_masks)
+
+    def dispatch_events(self, event_queue, timeout):
+        """
+        Dispatches the next batch of events (or single event) of the event queue 
+        to the handlers of its watch, with their ``dispatch_many`` method if any.
+        """
+        events, watch = event_queue.get(block=True, timeout=timeout)
+        if not isinstance(events, list):
+            events = [events]
+
+        with self._lock:
+            # To allow unschedule/stop and safe removal of event handlers
+            # within event handlers itself, check if the handler is still
+            # registered after every dispatch.
+            for handler in list(self._handlers.get(watch, [])):
+                if handler in self._handlers.get(watch, []):
+                    if hasattr(handler, 'dispatch_many'):
+                        handler.dispatch_many(events)
+                    else:
+                        for event in events:
+                            handler.dispatch(event)
+        event_queue.task_done()
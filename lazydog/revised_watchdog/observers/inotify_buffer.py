@@ -26,31 +26,169 @@ by revising and completing it. Please read original **watchdog** project
 documentation for more information: https://github.com/gorakhargosh/watchdog
 
 The main change is in the :py:class:`InotifyBuffer` class, whose :py:meth:`InotifyBuffer.__init__`
-method now uses revised watchdog :py:class:`~lazydog.revised_watchdog.observers.inotify_c.Inotify` class.
+method now uses revised watchdog :py:class:`~lazydog.revised_watchdog.observers.inotify_c.Inotify` class,
+and tells it how many events are waiting to be read, so that it pauses the simulation of 
+the events of big directories created or moved into the watched one, while the consumer is late.
+
+Events are moved by batches: each batch read from 
+:py:class:`~lazydog.revised_watchdog.observers.inotify_c.Inotify` is put in a 
+:py:class:`BatchedDelayedQueue` at once, and :py:meth:`InotifyBuffer.read_events`
+returns every event whose delay is over at once.
 
 """
 
+import time
 import logging
+import threading
+from collections import deque
 from watchdog.utils import BaseThread
-from watchdog.utils.delayed_queue import DelayedQueue
 from watchdog.observers.inotify_buffer import InotifyBuffer
 from lazydog.revised_watchdog.observers.inotify_c import Inotify 
 
 logger = logging.getLogger(__name__)
 
+class BatchedDelayedQueue():
+    """
+    Queue holding its elements for ``delay`` seconds, as 
+    :py:class:`watchdog.utils.delayed_queue.DelayedQueue` does, with 
+    :py:meth:`put_many` and :py:meth:`get_many` methods moving several 
+    elements with a single lock acquisition.
+
+    It does not rely on the internals of the watchdog class, which 
+    differ from one watchdog version to another.
+
+    :param delay:
+        Number of seconds each element is held in the queue.
+    :type delay:
+        float
+    """
+
+    def __init__(self, delay:float):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        # couples (element, insert_time), oldest first
+        self._queue = deque()
+        self._closed = False
+
+    def __len__(self):
+        return len(self._queue)
+
+    def close(self):
+        """Closes the queue, waking up the consumer waiting in :py:meth:`get_many`."""
+        with self._not_empty:
+            self._closed = True
+            self._not_empty.notify()
+
+    def remove(self, predicate):
+        """
+        Removes and returns the first element for which ``predicate`` is ``True``, 
+        ignoring its delay, or ``None`` if there is no such element.
+        """
+        with self._lock:
+            for i, (element, _) in enumerate(self._queue):
+                if predicate(element):
+                    del self._queue[i]
+                    return element
+        return None
+
+    def put_many(self, elements:list):
+        """Adds every element of the list to the queue."""
+        if not elements:
+            return
+        insert_time = time.time()
+        with self._lock:
+            self._queue.extend((element, insert_time) for element in elements)
+            self._not_empty.notify()
+
+    def get_many(self) -> list:
+        """
+        Removes and returns the list of every element whose delay is over, 
+        waiting for the oldest one if needed. Returns an empty list if the 
+        queue has been closed.
+        """
+        while True:
+            with self._not_empty:
+                while not self._queue and not self._closed:
+                    self._not_empty.wait()
+                if self._closed:
+                    return []
+                insert_time = self._queue[0][1]
+
+            # wait for delay
+            time_left = insert_time + self.delay - time.time()
+            while time_left > 0:
+                time.sleep(time_left)
+                time_left = insert_time + self.delay - time.time()
+
+            # the oldest element may have been removed in the meantime
+            elements = []
+            with self._lock:
+                deadline = time.time() - self.delay
+                while self._queue and self._queue[0][1] <= deadline:
+                    elements.append(self._queue.popleft()[0])
+            if elements:
+                return elements
+
+
 class InotifyBuffer(InotifyBuffer):
     """
     A wrapper for `Inotify` that holds events for `delay` seconds. During
     this time, ``IN_MOVED_FROM`` and ``IN_MOVED_TO`` events are paired.
 
-    Please note that his class remains unmodified 
-    in revised_watchdog package. Only the :py:meth:`__init__` method is overrided 
-    in order it uses the new definition of :py:class:`~lazydog.revised_watchdog.observers.inotify_c.Inotify` class.
+    The :py:meth:`__init__` method is overrided in order it uses the new definition 
+    of :py:class:`~lazydog.revised_watchdog.observers.inotify_c.Inotify` class, and 
+    events are moved by batches (see :py:meth:`read_events`).
     """
 
 
-    def __init__(self, path, recursive=False):
+    def __init__(self, path, recursive=False, path_filter=None, event_masks=None):
         BaseThread.__init__(self)
-        self._queue = DelayedQueue(self.delay)
-        self._inotify = Inotify(path, recursive)
+        self._queue = BatchedDelayedQueue(self.delay)
+        self._inotify = Inotify(path, recursive, path_filter=path_filter, event_masks=event_masks)
+        self._inotify.backlog = self.backlog
         self.start()
+
+    def backlog(self) -> int:
+        """Returns the number of events waiting to be read."""
+        return len(self._queue)
+
+    def read_events(self) -> list:
+        """
+        Returns the list of every event (or tuple of from/to events in case 
+        of a paired move event) whose delay is over. If this buffer has been 
+        closed, immediately returns an empty list.
+        """
+        return self._queue.get_many()
+
+    def run(self):
+        """
+        Reads events from `inotify` and adds them to the queue, one batch at
+        a time. When reading a ``IN_MOVED_TO`` event, the matching ``IN_MOVED_FROM`` 
+        event is removed (from the same batch, or else from the queue), and both 
+        are added back to the queue as a tuple.
+        """
+        while self.should_keep_running():
+            batch = []
+            # index in the batch of the IN_MOVED_FROM events, by cookie
+            moved_from = {}
+            for inotify_event in self._inotify.read_events():
+                logger.debug("in-event %s", inotify_event)
+                if inotify_event.is_moved_to:
+                    i = moved_from.pop(inotify_event.cookie, None)
+                    if i is not None:
+                        from_event, batch[i] = batch[i], None
+                    else:
+                        from_event = self._queue.remove(
+                            lambda x: (not isinstance(x, tuple) and x.is_moved_from 
+                                       and x.cookie == inotify_event.cookie))
+                    if from_event is not None:
+                        batch.append((from_event, inotify_event))
+                    else:
+                        logger.debug("could not find matching move_from event")
+                        batch.append(inotify_event)
+                else:
+                    if inotify_event.is_moved_from:
+                        moved_from[inotify_event.cookie] = len(batch)
+                    batch.append(inotify_event)
+            self._queue.put_many([x for x in batch if x is not None])
@@ -26,29 +26,315 @@ by revising and completing it. Please read original **watchdog** project
 documentation for more information: https://github.com/gorakhargosh/watchdog
 
 Fundamental changes and corrections have been brought to the original :py:class:`Inotify` 
-class, whose behaviour was not correct when moving or deleting sub-directories.
+class, whose behaviour was not correct when moving or deleting sub-directories. The
+watch descriptors are kept in a :py:class:`WatchTree`, so that moving a directory 
+does not cost a scan of every watched path. Events are read into a reusable buffer,
+which grows when reads come back full, and parsed in place. Directories excluded by
+a :py:class:`~lazydog.filters.PathFilter` are never put under observation, and each
+sub-tree can be watched with its own event mask (see :py:data:`STRUCTURE_EVENTS`).
+
+A watched directory moved out of the watched directories keeps its watches in the
+kernel, which would go on reporting its content at its former path. Every watch
+therefore subscribes to ``IN_MOVE_SELF``: a directory moved from a watched path
+(``IN_MOVED_FROM``) is remembered until moved to another watched path (``IN_MOVED_TO``,
+read before its ``IN_MOVE_SELF``). If its ``IN_MOVE_SELF`` comes while it is still
+remembered, it was moved out, and the watches of its whole sub-tree are removed.
 
 """
 
 import os
 import errno
+import struct
+import select
+import collections
+
+from lazydog.traversal import scan_tree
 
 from watchdog.observers.inotify_c import (
     Inotify, 
     InotifyEvent, 
     InotifyConstants,
-    DEFAULT_EVENT_BUFFER_SIZE
+    DEFAULT_EVENT_BUFFER_SIZE,
+    WATCHDOG_ALL_EVENTS,
+    inotify_add_watch,
+    inotify_rm_watch
     )
 
+STRUCTURE_EVENTS = (InotifyConstants.IN_MOVED_FROM | InotifyConstants.IN_MOVED_TO | 
+                    InotifyConstants.IN_CREATE | InotifyConstants.IN_DELETE | 
+                    InotifyConstants.IN_DELETE_SELF | InotifyConstants.IN_MOVE_SELF)
+"""
+Event mask of the sub-trees whose structure only is watched (created, deleted
+and moved paths, without ``IN_MODIFY`` and ``IN_ATTRIB`` events). Every watch
+gets these events, which keep the watches up to date (``IN_MOVE_SELF`` detects the
+directories moved out of the watched directories, and is not reported).
+"""
+
+WATCH_FLAGS = InotifyConstants.IN_DONT_FOLLOW
+"""
+Flags given to the kernel with the event mask of every watch (they are not events).
+"""
+
+CLOSE_WRITE_EVENTS = STRUCTURE_EVENTS | InotifyConstants.IN_CLOSE_WRITE
+"""
+Event mask of the write-heavy sub-trees: a modified file is reported once, when
+closed, instead of at each write.
+"""
+
+# events changing the listing of a directory, whose names are not simulated afterwards
+_LISTING_EVENTS = (InotifyConstants.IN_CREATE | InotifyConstants.IN_DELETE | 
+                   InotifyConstants.IN_MOVED_FROM | InotifyConstants.IN_MOVED_TO)
+
+# struct inotify_event header: wd, mask, cookie, len (then the name, padded with nulls)
+_EVENT_HEADER = struct.Struct('iIII')
+# the largest possible event: a header and a name of NAME_MAX + 1 bytes
+_MAX_EVENT_SIZE = _EVENT_HEADER.size + 256
+
+
+class _WatchNode():
+    # one directory of the tree: its name in its parent, and its watch descriptor if watched
+    __slots__ = ('name', 'parent', 'children', 'wd', 'mask', 'path', 'generation')
+
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+        self.children = {}
+        self.wd = None
+        self.mask = None
+        self.path = None
+        self.generation = -1
+
+
+class WatchTree():
+    """
+    Bookkeeping of the inotify watch descriptors, replacing the two 
+    ``_wd_for_path`` and ``_path_for_wd`` dictionaries of the original 
+    :py:class:`Inotify` class.
+
+    Watched directories are stored as a tree, each node only knowing its 
+    name and its parent, so that a moved directory (with all its watched 
+    sub-directories) is re-parented in constant time, instead of rewriting 
+    the path of every watched directory starting with the moved path (which 
+    also wrongly matched siblings such as ``/a/bc`` when moving ``/a/b``). 
+    Paths are rebuilt from the parents when needed, and cached until the 
+    next move.
+
+    Paths can be either ``str`` or ``bytes`` (as in inotify), but all of 
+    them must be of the same type.
+    """
+
+    def __init__(self):
+        self._root = _WatchNode(None, None)
+        self._nodes_by_wd = {}
+        # incremented by each move, invalidating every cached path
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._nodes_by_wd)
+
+    def __contains__(self, wd:int):
+        return wd in self._nodes_by_wd
+
+    @staticmethod
+    def _split(path) -> list:
+        separator = b'/' if isinstance(path, bytes) else '/'
+        names = path.split(separator)
+        # no empty name, but the first one (absolute paths)
+        return names[:1] + [x for x in names[1:] if x]
+
+    def _find(self, path, create:bool=False) -> _WatchNode:
+        return self._find_names(WatchTree._split(path), create)
+
+    def _find_names(self, names:list, create:bool=False) -> _WatchNode:
+        node = self._root
+        for name in names:
+            child = node.children.get(name)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[name] = _WatchNode(name, node)
+            node = child
+        return node
+
+    def _prune(self, node:_WatchNode):
+        # removes the nodes that are neither watched nor parent of a watched directory
+        while node.parent is not None and node.wd is None and not node.children:
+            if node.parent.children.get(node.name) is node:
+                del node.parent.children[node.name]
+            node = node.parent
+
+    def add(self, path, wd:int, mask:int=None):
+        """
+        Saves the watch descriptor ``wd`` of the directory at ``path``, and 
+        its event ``mask`` if any. Both are kept when the directory is moved.
+        """
+        node = self._find(path, create=True)
+        if node.wd is not None and node.wd != wd:
+            self._nodes_by_wd.pop(node.wd, None)
+        existing = self._nodes_by_wd.get(wd)
+        if existing is not None and existing is not node:
+            # the same directory, watched from another path
+            existing.wd = None
+            self._prune(existing)
+        node.wd = wd
+        node.mask = mask
+        self._nodes_by_wd[wd] = node
+
+    def get_wd(self, path) -> int:
+        """Returns the watch descriptor of the directory at ``path``, or ``None``."""
+        node = self._find(path)
+        return node.wd if node is not None else None
+
+    def get_mask(self, wd:int) -> int:
+        """Returns the event mask of the directory watched by ``wd``, or ``None``."""
+        node = self._nodes_by_wd.get(wd)
+        return node.mask if node is not None else None
+
+    def get_path(self, wd:int):
+        """
+        Returns the current path of the directory watched by ``wd``. Raises 
+        ``KeyError`` if ``wd`` is unknown.
+        """
+        node = self._nodes_by_wd[wd]
+        if node.generation < self._generation:
+            names = []
+            current = node
+            while current.parent is not None:
+                names.append(current.name)
+                current = current.parent
+            separator = b'/' if isinstance(node.name, bytes) else '/'
+            node.path = separator.join(reversed(names)) or separator
+            node.generation = self._generation
+        return node.path
+
+    def get_wds_under(self, path) -> list:
+        """
+        Returns the watch descriptors of the directory at ``path`` and of 
+        all its watched sub-directories.
+        """
+        node = self._find(path)
+        wds = []
+        nodes = [node] if node is not None else []
+        while nodes:
+            node = nodes.pop()
+            if node.wd is not None:
+                wds.append(node.wd)
+            nodes.extend(node.children.values())
+        return wds
+
+    def remove_wd(self, wd:int):
+        """Forgets the watch descriptor ``wd``. Returns ``False`` if it was unknown."""
+        node = self._nodes_by_wd.pop(wd, None)
+        if node is None:
+            return False
+        node.wd = None
+        self._prune(node)
+        return True
+
+    def remove(self, path) -> int:
+        """
+        Forgets the watch descriptor of the directory at ``path``, and returns it.
+        Raises ``KeyError`` if the directory is not watched.
+        """
+        wd = self.get_wd(path)
+        if wd is None:
+            raise KeyError(path)
+        self.remove_wd(wd)
+        return wd
+
+    def move(self, src_path, dest_path):
+        """
+        Moves the directory at ``src_path`` (and so all its watched sub-directories) 
+        to ``dest_path``.
+        """
+        node = self._find(src_path)
+        if node is None or node.parent is None:
+            return
+        names = WatchTree._split(dest_path)
+        dest_node = self._find(dest_path)
+        if dest_node is node:
+            return
+        if dest_node is not None:
+            # the watches of a replaced directory keep their path, until they are removed
+            self._freeze(dest_node)
+            del dest_node.parent.children[dest_node.name]
+            dest_node.parent = None
+        del node.parent.children[node.name]
+        self._prune(node.parent)
+        parent = self._find_names(names[:-1], create=True)
+        node.parent, node.name = parent, names[-1]
+        parent.children[node.name] = node
+        self._generation += 1
+
+    def _freeze(self, node:_WatchNode):
+        # caches the current path of every watch of the sub-tree, for ever
+        if node.wd is not None:
+            self.get_path(node.wd)
+            node.generation = float('inf')
+        for child in node.children.values():
+            self._freeze(child)
+
+
+class _Simulation():
+    # breadth-first listing of a created or moved directory, whose events are simulated 
+    # by chunks. Directories are identified by their watch descriptor, so that their 
+    # current path is always used, even if they are moved in the meantime. Without
+    # event type, only the watches of the sub-directories are added (see read_events).
+    # The names already reported by kernel events, by wd of the directories not listed 
+    # entirely yet (shared by every simulation), are skipped, since their simulated 
+    # events would come after the real ones.
+
+    def __init__(self, wd:int, event_type:int, cookie:int=0, seen_names:dict=None):
+        self.event_type = event_type
+        self.cookie = cookie
+        self.directories = collections.deque()
+        self.seen_names = seen_names if seen_names is not None else {}
+        self._wd = None
+        self._entries = None
+        self.add_directory(wd)
+
+    def add_directory(self, wd:int):
+        self.directories.append(wd)
+        self.seen_names.setdefault(wd, set())
+
+    def next_entry(self, watches:WatchTree):
+        # returns the next (wd of the parent directory, os.DirEntry) couple, or None
+        while True:
+            if self._entries is not None:
+                try:
+                    entry = next(self._entries)
+                except (StopIteration, OSError):
+                    self.close()
+                else:
+                    if entry.name not in self.seen_names.get(self._wd, ()):
+                        return self._wd, entry
+                    continue
+            if not self.directories:
+                return None
+            self._wd = self.directories.popleft()
+            try:
+                self._entries = os.scandir(watches.get_path(self._wd))
+            except (KeyError, OSError):
+                self._entries = None
+                self.seen_names.pop(self._wd, None)
+
+    def close(self):
+        if self._entries is not None:
+            self._entries.close()
+            self._entries = None
+            self.seen_names.pop(self._wd, None)
+
 
 class Inotify(Inotify):
     """
     Linux inotify(7) API wrapper class. 
 
     With modified :py:meth:`read_events` method, 
-    and added :py:meth:`_remove_watch_bookkeeping` method, 
+    and watch descriptors kept in a :py:class:`WatchTree`, 
     thus covering specifics needs of lazydog.
 
+    Other directories can be watched by the same instance, see :py:meth:`add_root`.
+
     :param path:
         The directory path for which we want an inotify object.
     :type path:
@@ -57,49 +343,299 @@ class Inotify(Inotify):
         ``True`` if subdirectories should be monitored. ``False`` otherwise.
     :type recursive:
         boolean
+    :param path_filter:
+        *Optional*. Exclusion rules of the directory: excluded sub-directories are 
+        neither watched nor simulated, and the content of the directories created 
+        or moved into it is simulated without the excluded paths.
+    :type path_filter:
+        :py:class:`~lazydog.filters.PathFilter`
+    :param event_masks:
+        *Optional*. Event masks of some sub-trees, by path of their top directory 
+        relative to ``path`` (for example ``{'/archives': STRUCTURE_EVENTS}``). 
+        The other directories get the mask of their parent directory, or the 
+        ``event_mask`` at the top. Masks are given to the kernel with each watch, 
+        so that the discarded events are never read, and a moved directory keeps 
+        its mask (and gives it to its future sub-directories).
+    :type event_masks:
+        dict
     """
     
-    def _remove_watch_bookkeeping(self, path):
-        wd = self._wd_for_path.pop(path)
-        del self._path_for_wd[wd]
+    SIMULATION_CHUNK_SIZE = 1024
+    """Maximum number of events simulated by each call to :py:meth:`read_events`."""
+
+    MAX_SIMULATION_BACKLOG = 16384
+    """Events are not simulated while more events than this are waiting to be consumed."""
+
+    SIMULATION_PAUSE = 0.1
+    """Number of seconds waiting for kernel events, while simulations are paused."""
+
+    MAX_EVENT_BUFFER_SIZE = 16 * DEFAULT_EVENT_BUFFER_SIZE
+    """The read buffer doubles when a read comes back full, up to this number of bytes."""
+    
+    def __init__(self, path, recursive=False, event_mask=WATCHDOG_ALL_EVENTS, path_filter=None, 
+                 event_masks=None):
+        self._watches = WatchTree()
+        # watched directories (see add_root), their exclusion rules and event masks
+        self._roots = [path]
+        self._path_filters = {path: path_filter}
+        self._is_filtered = path_filter is not None
+        self._event_masks = {path: Inotify._normalize_masks(event_masks)}
+        self._has_masks = bool(event_masks)
+        super(Inotify, self).__init__(path, recursive, event_mask)
+        # replaced by self._watches (see _add_watch)
+        del self._wd_for_path
+        del self._path_for_wd
+        
+        # directories whose content is being simulated (see _simulate), and the names
+        # reported by the kernel meanwhile, by wd of the directories not listed yet
+        self._simulations = collections.deque()
+        self._seen_names = {}
+        # watched directories moved from their path, until moved to another watched path:
+        # those still there at their IN_MOVE_SELF were moved out (see read_events)
+        self._moved_dirs = set()
+        # function returning the number of events not consumed yet, if any
+        self.backlog = None
+        # number of times the kernel event queue overflowed
+        self.overflows = 0
+        # reused by every read (see _read_event_buffer)
+        self._event_buffer = bytearray(DEFAULT_EVENT_BUFFER_SIZE)
+
+    def close(self):
+        """
+        Closes the inotify instance and removes all associated watches.
+        """
+        with self._lock:
+            for simulation in self._simulations:
+                simulation.close()
+            self._simulations.clear()
+            self._seen_names.clear()
+            for path in self._roots:
+                wd = self._watches.get_wd(path)
+                if wd is not None:
+                    inotify_rm_watch(self._inotify_fd, wd)
+            os.close(self._inotify_fd)
+
+    def add_root(self, path, path_filter=None, event_masks=None):
+        """
+        Watches another directory with the same inotify instance (and so the 
+        same file descriptor), as the ``path`` given at initialization. Moves
+        between the watched directories are then paired as usual.
+
+        :param path:
+            The directory path to watch, neither inside nor containing 
+            another watched directory.
+        :type path:
+            bytes
+        :param path_filter:
+            *Optional*. Exclusion rules of the directory.
+        :type path_filter:
+            :py:class:`~lazydog.filters.PathFilter`
+        :param event_masks:
+            *Optional*. Event masks of some sub-trees of the directory.
+        :type event_masks:
+            dict
+        """
+        with self._lock:
+            self._roots.append(path)
+            self._path_filters[path] = path_filter
+            self._is_filtered = self._is_filtered or path_filter is not None
+            self._event_masks[path] = Inotify._normalize_masks(event_masks)
+            self._has_masks = self._has_masks or bool(event_masks)
+            try:
+                self._add_dir_watch(path, self.is_recursive, self._event_mask)
+            except OSError:
+                self._roots.remove(path)
+                del self._path_filters[path]
+                del self._event_masks[path]
+                raise
+
+    @staticmethod
+    def _normalize_masks(event_masks) -> dict:
+        # relative paths without leading or trailing separator, masks keeping the watches up to date
+        if not event_masks:
+            return None
+        return {key.strip('/'): mask | STRUCTURE_EVENTS for key, mask in event_masks.items()}
+
+    def _root_of(self, path):
+        # the watched directory containing the path, if any
+        for root in self._roots:
+            if path.startswith(root) and path[len(root):len(root) + 1] in (b'', b'/'):
+                return root
+        return None
+
+    def _is_excluded(self, path, is_dir:bool=True) -> bool:
+        # True if the exclusion rules of the watched directory containing the path exclude it
+        if not self._is_filtered:
+            return False
+        root = self._root_of(path)
+        path_filter = self._path_filters[root] if root is not None else None
+        return (path_filter is not None and 
+                path_filter.is_excluded(os.fsdecode(path[len(root):]), is_dir, 
+                                        'watches' if is_dir else 'events'))
+
+    def _mask_for(self, path, parent_wd:int=None, default:int=None) -> int:
+        # the configured mask of the directory at path, or else the mask of its parent directory
+        if not self._has_masks:
+            return self._event_mask
+        root = self._root_of(path)
+        event_masks = self._event_masks[root] if root is not None else None
+        if event_masks:
+            mask = event_masks.get(os.fsdecode(path[len(root):]).strip('/'))
+            if mask is not None:
+                return mask
+        mask = self._watches.get_mask(parent_wd) if parent_wd is not None else None
+        return mask if mask is not None else (default or self._event_mask)
+
+    def _add_dir_watch(self, path, recursive, mask):
+        # same as the original method, without browsing the excluded directories, 
+        # and with the event mask of each sub-tree
+        if not os.path.isdir(path):
+            raise OSError('Path is not a directory')
+        self._add_watch(path, self._mask_for(path, default=mask))
+        if recursive:
+            exclude = lambda entry: entry.is_dir(follow_symlinks=False) and self._is_excluded(entry.path)
+            for entry in scan_tree(path, exclude=exclude):
+                if entry.is_dir(follow_symlinks=False):
+                    if self._has_masks:
+                        parent_wd = self._watches.get_wd(os.path.dirname(entry.path))
+                        self._add_watch(entry.path, self._mask_for(entry.path, parent_wd, mask))
+                    else:
+                        self._add_watch(entry.path, mask)
+
+    def simulate_moved_in(self, path):
+        """
+        Simulates ``IN_MOVED_TO`` events for the content of the watched directory 
+        at ``path``, as for a directory moved from outside the watched directories.
+        """
+        with self._lock:
+            wd = self._watches.get_wd(path)
+            if wd is not None:
+                self._simulations.append(_Simulation(wd, InotifyConstants.IN_MOVED_TO, -1, self._seen_names))
+
+    def has_pending_simulations(self) -> bool:
+        """
+        Returns ``True`` if the content of some created or moved directories
+        has not been simulated yet.
+        """
+        return bool(self._simulations)
+
+    def _can_simulate(self) -> bool:
+        # backpressure: nothing more is simulated while the consumer is late
+        return bool(self._simulations) and (self.backlog is None or 
+                                            self.backlog() < Inotify.MAX_SIMULATION_BACKLOG)
+
+    def _simulate(self) -> list:
+        """
+        Simulates the events of at most :py:attr:`SIMULATION_CHUNK_SIZE` entries 
+        of the pending created or moved directories, breadth-first: every 
+        sub-directory is put under observation as soon as it is found, and its 
+        own content is simulated after the content of its parent.
+        """
+        events = []
+        entries = 0
+        while self._simulations and entries < Inotify.SIMULATION_CHUNK_SIZE:
+            simulation = self._simulations[0]
+            next_entry = simulation.next_entry(self._watches)
+            if next_entry is None:
+                self._simulations.popleft()
+                continue
+            entries += 1
+            wd_parent_dir, entry = next_entry
+            try:
+                full_path = os.path.join(self._watches.get_path(wd_parent_dir), entry.name)
+            except KeyError:
+                # parent directory deleted in the meantime
+                continue
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if self._is_excluded(full_path, is_dir):
+                continue
+            if is_dir:
+                try:
+                    wd_dir = self._add_watch(full_path, self._mask_for(full_path, wd_parent_dir))
+                except OSError:
+                    continue
+                simulation.add_directory(wd_dir)
+                if simulation.event_type is not None:
+                    events.append(InotifyEvent(wd_dir, simulation.event_type | InotifyConstants.IN_ISDIR, 
+                                               simulation.cookie, entry.name, full_path))
+            elif simulation.event_type is not None:
+                events.append(InotifyEvent(wd_parent_dir, simulation.event_type, 
+                                           simulation.cookie, entry.name, full_path))
+        return events
+
+    def _add_watch(self, path, mask):
+        wd = inotify_add_watch(self._inotify_fd, path, mask | STRUCTURE_EVENTS | WATCH_FLAGS)
+        if wd == -1:
+            Inotify._raise_error()
+        self._watches.add(path, wd, mask)
         return wd
 
+    def remove_watch(self, path):
+        """
+        Removes the watch of the directory at ``path`` (the watches of its 
+        sub-directories are kept). Raises ``KeyError`` if it is not watched.
+
+        :param path:
+            Path for which the watch will be removed.
+        :type path:
+            bytes
+        """
+        with self._lock:
+            wd = self._remove_watch_bookkeeping(path)
+            if inotify_rm_watch(self._inotify_fd, wd) == -1:
+                Inotify._raise_error()
+
+    def _remove_watch_bookkeeping(self, path):
+        return self._watches.remove(path)
+
+    def _remove_watch_tree(self, path):
+        # stops watching the directory at path and all its sub-directories
+        for wd in self._watches.get_wds_under(path):
+            self._watches.remove_wd(wd)
+            inotify_rm_watch(self._inotify_fd, wd)
+
 
-    def read_events(self, event_buffer_size=DEFAULT_EVENT_BUFFER_SIZE):
+    def _read_event_buffer(self) -> tuple:
+        # reads in place into the reusable buffer, and returns it with the number of bytes read
+        event_buffer = self._event_buffer
+        length = os.readv(self._inotify_fd, [event_buffer])
+        if (length > len(event_buffer) - _MAX_EVENT_SIZE and 
+                len(event_buffer) < Inotify.MAX_EVENT_BUFFER_SIZE):
+            # more events were probably waiting: the next read gets more at once
+            self._event_buffer = bytearray(2 * len(event_buffer))
+        return event_buffer, length
+
+    def read_events(self, event_buffer_size=None):
         """
         Reads events from inotify and yields them to the Inotify buffer.
         This method has been largely modified from original watchdog module...
         Thus preventing from unwanted behaviour.
+
+        Events are read into a reusable buffer (whose size adapts itself to the 
+        rate of events, see :py:attr:`MAX_EVENT_BUFFER_SIZE`), and parsed in place:
+        only the names are copied.
+
+        :param event_buffer_size:
+            *Optional*. Minimum size of the read buffer, in bytes.
+        :type event_buffer_size:
+            int
         """
+        if event_buffer_size is not None and event_buffer_size > len(self._event_buffer):
+            self._event_buffer = bytearray(event_buffer_size)
         # HACK: We need to traverse the directory path
         # recursively and simulate events for newly
         # created subdirectories/files. This will handle
         # mkdir -p foobar/blah/bar; touch foobar/afile
-
-        def _recursive_simulate(src_path, event_type, cookie=0):
-            events = []
-            for root, dirnames, filenames in os.walk(src_path):
-                for dirname in dirnames:
-                    try:
-                        full_path = os.path.join(root, dirname)
-                        wd_dir = self._add_watch(full_path, self._event_mask)
-                        e = InotifyEvent(
-                            wd_dir, event_type | InotifyConstants.IN_ISDIR, cookie, dirname, full_path)
-                        events.append(e)
-                    except OSError:
-                        pass
-                for filename in filenames:
-                    full_path = os.path.join(root, filename)
-                    wd_parent_dir = self._wd_for_path[os.path.dirname(full_path)]
-                    e = InotifyEvent(
-                        wd_parent_dir, event_type, cookie, filename, full_path)
-                    events.append(e)
-            return events
-
-        event_buffer = None
+        # Simulations are run by chunks (see _simulate), so without 
+        # blocking the reading of kernel events while there are some.
+        event_buffer, length = self._event_buffer, 0
         while True:
             try:
-                event_buffer = os.read(self._inotify_fd, event_buffer_size)
+                if self._simulations:
+                    timeout = 0 if self._can_simulate() else Inotify.SIMULATION_PAUSE
+                    if not select.select([self._inotify_fd], [], [], timeout)[0]:
+                        break
+                event_buffer, length = self._read_event_buffer()
             except OSError as e:
                 if e.errno == errno.EINTR:
                     continue
@@ -108,57 +644,110 @@ class Inotify(Inotify):
         with self._lock:
 
             event_list = []
-            for wd, mask, cookie, name in Inotify._parse_event_buffer(event_buffer):
+            view = memoryview(event_buffer)
+            unpack_header = _EVENT_HEADER.unpack_from
+            i = 0
+            while i + _EVENT_HEADER.size <= length:
+                
+                wd, mask, cookie, name_length = unpack_header(event_buffer, i)
+                i += _EVENT_HEADER.size
+                if name_length:
+                    end = event_buffer.find(b'\0', i, i + name_length)
+                    name = view[i:end if end != -1 else i + name_length].tobytes()
+                    i += name_length
+                else:
+                    name = b''
 
                 if wd == -1:
+                    if mask & InotifyConstants.IN_Q_OVERFLOW:
+                        # Events have been lost: the consumer is told so that it checks 
+                        # the whole directories again, and the directories created in the 
+                        # meantime are put under observation (without simulated events).
+                        self.overflows += 1
+                        root_wds = [x for x in map(self._watches.get_wd, self._roots) if x is not None]
+                        if (self.is_recursive and root_wds and 
+                                not any(x.event_type is None for x in self._simulations)):
+                            simulation = _Simulation(root_wds[0], None, seen_names=self._seen_names)
+                            for root_wd in root_wds[1:]:
+                                simulation.add_directory(root_wd)
+                            self._simulations.append(simulation)
+                        event_list.append(InotifyEvent(wd, mask, cookie, name, self._path))
                     continue
-                wd_path = self._path_for_wd[wd]
-                src_path = os.path.join(wd_path, name) if name else wd_path #avoid trailing slash
+                if wd not in self._watches:
+                    # watch already removed with its whole sub-tree (see _remove_watch_tree): 
+                    # its remaining events, and finally IN_IGNORED, are dropped
+                    continue
+                wd_path = self._watches.get_path(wd)
+                if not name:
+                    src_path = wd_path #avoid trailing slash
+                elif wd_path.endswith(b'/'):
+                    src_path = wd_path + name
+                else:
+                    src_path = wd_path + b'/' + name
                 inotify_event = InotifyEvent(wd, mask, cookie, name, src_path)
                 move_src_path = None
+                if name and wd in self._seen_names and mask & _LISTING_EVENTS:
+                    # already reported: not simulated when the listing reaches it
+                    self._seen_names[wd].add(name)
                 #print(inotify_event)
                 
-                if inotify_event.is_moved_from:
+                # masks are tested directly, rather than with the properties of the event
+                if mask & InotifyConstants.IN_MOVED_FROM:
                     self.remember_move_from_event(inotify_event)
-                elif inotify_event.is_moved_to:
+                    if mask & InotifyConstants.IN_ISDIR and self._watches.get_wd(src_path) is not None:
+                        self._moved_dirs.add(src_path)
+                elif mask & InotifyConstants.IN_MOVED_TO:
                     move_src_path = self.source_for_move(inotify_event)
                     if move_src_path is not None:
-                        # Adjusting existing watcher paths
-                        for moved_path in [x for x in self._wd_for_path if x.startswith(move_src_path)]:
-                            new_path = moved_path.replace(move_src_path, inotify_event.src_path, 1)
-                            moved_wd = self._wd_for_path[moved_path]
-                            self._wd_for_path.pop(moved_path)
-                            self._wd_for_path[new_path] = moved_wd
-                            self._path_for_wd[moved_wd] = new_path
+                        # Adjusting existing watcher paths (the whole moved sub-tree at once)
+                        self._moved_dirs.discard(move_src_path)
+                        self._watches.move(move_src_path, inotify_event.src_path)
                         
                     #===========================================================
                     # src_path = os.path.join(wd_path, name)
                     # inotify_event = InotifyEvent(wd, mask, cookie, name, src_path)
                     #===========================================================
 
-                if inotify_event.is_ignored:
-                    # Clean up book-keeping for deleted watches.
-                    self._remove_watch_bookkeeping(src_path)
+                if mask & InotifyConstants.IN_IGNORED:
+                    # Clean up book-keeping for deleted watches (by descriptor, since 
+                    # another directory may have been moved to the same path since).
+                    self._watches.remove_wd(wd)
+                    continue
+
+                if mask & InotifyConstants.IN_MOVE_SELF:
+                    # still at its former path: moved out of the watched directories, 
+                    # so its sub-tree is no longer watched (nor reported at this path)
+                    if src_path in self._moved_dirs:
+                        self._moved_dirs.discard(src_path)
+                        self._remove_watch_tree(src_path)
                     continue
 
                 event_list.append(inotify_event)
 
-                if (self.is_recursive and inotify_event.is_directory): 
+                if (self.is_recursive and mask & InotifyConstants.IN_ISDIR): 
                     
-                    if inotify_event.is_create:
+                    if mask & (InotifyConstants.IN_CREATE | InotifyConstants.IN_MOVED_TO) and self._is_excluded(src_path):
+                        # excluded directories are never watched
+                        if move_src_path is not None:
+                            self._remove_watch_tree(src_path)
+                        continue
+
+                    if mask & InotifyConstants.IN_CREATE:
                         
                         # Putting newly created dir under observation
                         try:
-                            self._add_watch(src_path, self._event_mask)
+                            wd_dir = self._add_watch(src_path, self._mask_for(src_path, wd))
                         except OSError:
                             continue
                         
                         # The following generate elements that would have been created before 
                         # watcher had time to register...
-                        event_list.extend(_recursive_simulate(src_path, InotifyConstants.IN_CREATE))
+                        self._simulations.append(_Simulation(wd_dir, InotifyConstants.IN_CREATE, 
+                                                             seen_names=self._seen_names))
                     
                     
-                    elif inotify_event.is_moved_to and move_src_path is None:
+                    elif mask & InotifyConstants.IN_MOVED_TO and (move_src_path is None or 
+                                                                  self._watches.get_wd(src_path) is None):
                     
                         # When a directory from another part of the
                         # filesystem is moved into a watched directory, this
@@ -170,15 +759,17 @@ class Inotify(Inotify):
                         
                         # Putting newly created dir under observation
                         try:
-                            self._add_watch(src_path, self._event_mask)
+                            wd_dir = self._add_watch(src_path, self._mask_for(src_path, wd))
                         except OSError:
                             continue
                         
                         # The following generate elements that would have been created before 
                         # watcher had time to register...
-                        event_list.extend(_recursive_simulate(src_path, InotifyConstants.IN_MOVED_TO, -1))
-                        
-                        
+                        self._simulations.append(_Simulation(wd_dir, InotifyConstants.IN_MOVED_TO, -1, 
+                                                             self._seen_names))
+
+            if self._can_simulate():
+                event_list.extend(self._simulate())
 
         return event_list
 
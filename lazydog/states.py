@@ -26,9 +26,18 @@ method), thus accelerating identification of copy events.
 """
 
 import os
+import stat
+import bisect
+import hashlib
 import logging
+import threading
 
-from lazydog.dropbox_content_hasher import default_hash_function
+from lazydog.dropbox_content_hasher import (default_hash_function, resumable_hash_function, 
+                                            hash_with_stat, stat_signature, sample_digest, HashResult, 
+                                            HashCheckpoint)
+from lazydog.traversal import scan_tree, is_dir_entry, DirectoryListings
+from lazydog.manifests import read_manifest
+from lazydog.indexers import BackgroundIndexer, HashingScheduler
 
 class DualAccessMemory():
     """
@@ -79,6 +88,12 @@ class DualAccessMemory():
         """
         return self.dual_memories.get(value, set())
 
+    def get_shared_values(self) -> list:
+        """
+        Returns the list of the values that are referenced by more than one key.
+        """
+        return [v for v, keys in list(self.dual_memories.items()) if len(keys) > 1]
+
     def __getitem__(self, key):
         return self.get(key)
     
@@ -87,6 +102,26 @@ class DualAccessMemory():
 
     def __contains__(self, key):
         return key in self.memories
+
+    def keys(self) -> list:
+        """
+        Returns the list of every registered key.
+        """
+        return list(self.memories)
+
+    def is_evicted(self, key) -> bool:
+        """
+        Always ``False``, since every value is kept in memory. 
+        See :py:class:`BoundedDualAccessMemory`.
+        """
+        return False
+
+    def flush(self):
+        """
+        Nothing to do, since every value is kept in memory. 
+        See :py:mod:`lazydog.storages` for other storages.
+        """
+        pass
         
     def _get_children(self, key:str):
         """
@@ -146,7 +181,640 @@ class DualAccessMemory():
             self.memories[new_key] = self.memories.pop(old_key)
             
             
+
+class BoundedDualAccessMemory(DualAccessMemory):
+    """
+    Same as :py:class:`DualAccessMemory`, but keeping at most ``max_size``
+    values in memory. When this budget is exceeded, the least recently used keys
+    are evicted from memory:
+
+    * either spilled to the ``spill_store`` (if any), from which they are \
+    transparently reloaded on access,
+    * or simply forgotten. In this case :py:meth:`get` returns ``None``, but \
+    :py:meth:`is_evicted` still returns ``True``, so that the owner (usually \
+    :py:class:`LocalState`) knows that the value has to be recomputed on demand.
+
+    Note that :py:meth:`get_by_value` only returns the keys whose value is
+    currently in memory. The counters :py:attr:`evictions`, :py:attr:`spill_hits`
+    and :py:attr:`recomputations` allow to monitor the tier.
+
+    The resident keys and the evicted ones are indexed by path, so that recursive
+    deletions and moves only browse the deleted or moved paths. Without
+    ``spill_store``, at most ``max_size`` evicted keys are remembered as well (in
+    :py:attr:`evicted`): the oldest ones are then forgotten, as if they had never
+    been saved. With a ``spill_store``, the store itself is the record of the
+    evicted keys:
+
+    * a memory of a storage (see :py:mod:`lazydog.storages`) deletes and moves \
+    them recursively itself, so that no evicted key is kept in memory,
+    * any other dictionary-like object (for example a :py:mod:`dbm` database) has \
+    no range query, so that the evicted keys (not their values) are also indexed \
+    in memory.
+
+    :param max_size:
+        Maximum number of values kept in memory.
+    :type max_size:
+        int
+    :param spill_store:
+        *Optional*. Any dictionary-like object with string keys, where evicted values
+        are written, for example a :py:mod:`dbm` database opened with ``dbm.open(path, 'c')``,
+        or a memory opened with the ``open_memory`` method of a storage.
+    :type spill_store:
+        dict
+    """
+
+    def __init__(self, max_size:int, spill_store=None):
+        super(BoundedDualAccessMemory, self).__init__()
+        self.max_size = max_size
+        self.spill_store = spill_store
+
+        # resident keys, least recently used first, indexed by path
+        self.memories = PathMemory()
+
+        # without spill store, the keys whose value has been forgotten, oldest first
+        # (used as an ordered set)
+        self.evicted = PathMemory() if spill_store is None else None
+        # keys of a spill store without recursive deletions and moves
+        self._spilled_keys = None
+        if spill_store is not None and not hasattr(spill_store, 'move'):
+            self._spilled_keys = SortedKeyIndex()
+
+        # counters
+        self.evictions = 0
+        self.spill_hits = 0
+        self.recomputations = 0
+
+    def get(self, key):
+        if key in self.memories:
+            # most recently used keys are kept at the end of the dictionary (still indexed)
+            value = dict.pop(self.memories, key)
+            dict.__setitem__(self.memories, key, value)
+            return value
+        value = self._get_spilled(key)
+        if value is not None:
+            self.spill_hits += 1
+            self.save(key, value)
+        return value
+
+    def __contains__(self, key):
+        return key in self.memories or self._get_spilled(key) is not None
+
+    def keys(self) -> list:
+        """Returns the list of every registered key, including the evicted ones that can be reloaded."""
+        if self.spill_store is None:
+            return list(self.memories)
+        spilled_keys = self._spilled_keys if self._spilled_keys is not None else self.spill_store.keys()
+        return list(self.memories) + [x for x in spilled_keys if x not in self.memories]
+
+    def is_evicted(self, key) -> bool:
+        """Returns ``True`` if the value of the key has been evicted from memory."""
+        if self.spill_store is None:
+            return key in self.evicted
+        return key not in self.memories and self._get_spilled(key) is not None
+
+    def _get_children(self, key:str) -> list:
+        return self.memories._get_children(key)
+
+    def _get_spilled(self, key:str):
+        # the value of the key in the spill store, or None
+        if self.spill_store is None or (self._spilled_keys is not None and key not in self._spilled_keys):
+            return None
+        try:
+            value = self.spill_store[key]
+        except KeyError:
+            return None
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def _remember_evicted(self, key:str, value):
+        if self.spill_store is None:
+            self.evicted[key] = True
+            if len(self.evicted) > self.max_size:
+                self.evicted.pop(next(iter(self.evicted)))
+            return
+        self.spill_store[key] = value
+        if self._spilled_keys is not None:
+            self._spilled_keys.add(key)
+
+    def _forget_evicted(self, key:str):
+        if self.spill_store is None:
+            self.evicted.pop(key, None)
+        elif self._spilled_keys is not None:
+            if key in self._spilled_keys:
+                self._spilled_keys.discard(key)
+                del self.spill_store[key]
+        elif self.spill_store.get(key) is not None:
+            # the memories of the storages only delete recursively: the value is cleared
+            self.spill_store[key] = None
+
+    def _delete_evicted(self, delete_key:str):
+        if self.spill_store is None:
+            self.evicted.delete(delete_key)
+        elif self._spilled_keys is not None:
+            for key in self._spilled_keys.get_children(delete_key) + [delete_key]:
+                self._forget_evicted(key)
+        else:
+            self.spill_store.delete(delete_key)
+
+    def _move_evicted(self, src_key:str, dst_key:str):
+        if self.spill_store is None:
+            self.evicted.move(src_key, dst_key)
+        elif self._spilled_keys is not None:
+            for old_key in self._spilled_keys.get_children(src_key) + [src_key]:
+                value = self._get_spilled(old_key)
+                if value is not None:
+                    self._forget_evicted(old_key)
+                    self._remember_evicted(old_key.replace(src_key, dst_key, 1), value)
+        else:
+            self.spill_store.move(src_key, dst_key)
+
+    def _evict(self):
+        while len(self.memories) > self.max_size:
+            key = next(iter(self.memories))
+            value = self.memories.pop(key)
+            keys = self.dual_memories.get(value)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    self.dual_memories.pop(value)
+            if value is not None:
+                self._remember_evicted(key, value)
+            self.evictions += 1
+
+    def save(self, key:str, value):
+        if key in self.memories:
+            self.dual_memories[self.memories.pop(key)].discard(key)
+        else:
+            # a resident key is never evicted as well
+            self._forget_evicted(key)
+        self.memories[key] = value
+        self.dual_memories.setdefault(value, set()).add(key)
+        self._evict()
+
+    def delete(self, delete_key:str):
+        super(BoundedDualAccessMemory, self).delete(delete_key)
+        self._delete_evicted(delete_key)
+
+    def move(self, src_key:str, dst_key:str):
+        moved_keys = set(x.replace(src_key, dst_key, 1) for x in self._get_children(src_key))
+        # the resident keys replace the evicted ones
+        for key in moved_keys:
+            if key not in self.memories:
+                self._forget_evicted(key)
+        super(BoundedDualAccessMemory, self).move(src_key, dst_key)
+        self._move_evicted(src_key, dst_key)
+        # and the evicted keys replace the resident ones
+        for key in self._get_children(dst_key):
+            if key not in moved_keys and (key in self.evicted if self.spill_store is None else 
+                                          self._get_spilled(key) is not None):
+                self.dual_memories[self.memories.pop(key)].discard(key)
+
+
+
+class SortedKeyIndex():
+    """
+    Helper class, used by :py:class:`PathMemory` and by the storages without range
+    queries (see :py:mod:`lazydog.storages`). Keeps keys in memory, in a set and in 
+    a sorted list, so that :py:meth:`get_range` only browses the keys of the range.
+    New keys are sorted when needed, and removed keys are skipped until the sorted 
+    list is compacted.
+
+    :param keys:
+        *Optional*. Initial keys.
+    :type keys:
+        iterable
+    :param compaction_margin:
+        *Optional*. Number of removed keys tolerated in the sorted list, in addition 
+        to the number of kept keys, before compacting it.
+    :type compaction_margin:
+        int
+    """
+
+    def __init__(self, keys=(), compaction_margin:int=1000):
+        self._keys = set(keys)
+        self._sorted_keys = sorted(self._keys)
+        self._new_keys = []
+        self._compaction_margin = compaction_margin
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key:str):
+        if key not in self._keys:
+            self._keys.add(key)
+            self._new_keys.append(key)
+
+    def discard(self, key:str):
+        self._keys.discard(key)
+
+    def _get_sorted_keys(self) -> list:
+        if len(self._sorted_keys) + len(self._new_keys) > 2 * len(self._keys) + self._compaction_margin:
+            # too many removed keys
+            self._sorted_keys = sorted(self._keys)
+        elif self._new_keys:
+            # the sorted keys and the new ones are merged as two sorted runs
+            self._new_keys.sort()
+            self._sorted_keys.extend(self._new_keys)
+            self._sorted_keys.sort()
+        self._new_keys = []
+        return self._sorted_keys
+
+    def get_range(self, start_key:str=None, end_key:str=None) -> list:
+        """Returns the sorted keys between ``start_key`` (included) and ``end_key`` (excluded)."""
+        sorted_keys = self._get_sorted_keys()
+        start = bisect.bisect_left(sorted_keys, start_key) if start_key is not None else 0
+        end = bisect.bisect_left(sorted_keys, end_key, start) if end_key is not None else len(sorted_keys)
+        # a key removed and then added again may be listed twice
+        return sorted(set(k for k in sorted_keys[start:end] if k in self._keys))
+
+    def get_children(self, key:str) -> list:
+        """Returns the sorted keys of the children paths under the ``key`` path."""
+        # every path starting with 'key/' is between 'key/' and 'key0'
+        complete_key = key if key.endswith('/') else key + '/'
+        return self.get_range(complete_key, complete_key[:-1] + '0')
+
+
+class PathMemory(dict):
+    """
+    Helper class, used by :py:class:`LocalState` for the values kept alongside 
+    the hash values. Same as a dictionary, whose keys are also kept in a 
+    :py:class:`SortedKeyIndex`, so that :py:meth:`delete` and :py:meth:`move` only 
+    browse the keys under the deleted or moved path.
+    """
+
+    def __init__(self):
+        super(PathMemory, self).__init__()
+        self._index = SortedKeyIndex()
+
+    def __setitem__(self, key, value):
+        super(PathMemory, self).__setitem__(key, value)
+        self._index.add(key)
+
+    def __delitem__(self, key):
+        super(PathMemory, self).__delitem__(key)
+        self._index.discard(key)
+
+    def pop(self, key, *default):
+        self._index.discard(key)
+        return super(PathMemory, self).pop(key, *default)
+
+    def _get_children(self, key:str) -> list:
+        children = self._index.get_children(key)
+        if key in self:
+            children.append(key)
+        return children
+
+    def delete(self, delete_key:str):
+        """Deletes the ``delete_key`` path and every path under it."""
+        for key in self._get_children(delete_key):
+            self.pop(key)
+
+    def move(self, src_key:str, dst_key:str):
+        """Moves the ``src_key`` path and every path under it to ``dst_key``."""
+        for old_key in self._get_children(src_key):
+            self[old_key.replace(src_key, dst_key, 1)] = self.pop(old_key)
+
+
+class BoundedMemory(PathMemory):
+    """
+    Helper class, used by :py:class:`LocalState` for the values kept alongside 
+    the hash values when ``max_resident_hashes`` is used. Same as a 
+    :py:class:`PathMemory`, but keeping at most ``max_size`` values: when this 
+    budget is exceeded, the least recently used keys are forgotten, since all 
+    these values can be computed again.
+
+    :param max_size:
+        Maximum number of values kept in memory.
+    :type max_size:
+        int
+    """
+
+    def __init__(self, max_size:int):
+        super(BoundedMemory, self).__init__()
+        self.max_size = max_size
+        self.evictions = 0
+
+    def __getitem__(self, key):
+        # most recently used keys are kept at the end of the dictionary (still indexed)
+        value = dict.pop(self, key)
+        dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __setitem__(self, key, value):
+        dict.pop(self, key, None)
+        super(BoundedMemory, self).__setitem__(key, value)
+        while len(self) > self.max_size:
+            super(BoundedMemory, self).pop(next(iter(self)))
+            self.evictions += 1
+
+
+class StoredMemory():
+    """
+    Helper class, used by :py:class:`LocalState` for the values kept alongside 
+    the hash values when the indexes are kept in a storage (see 
+    :py:mod:`lazydog.storages`), so that they are persisted with the hash values. 
+    Same as a dictionary, backed by a memory of the storage, whose prefix queries 
+    are used to :py:meth:`delete` and :py:meth:`move` keys recursively.
+
+    :param memory:
+        Memory opened with the ``open_memory`` method of a storage.
+    :type memory:
+        :py:class:`DualAccessMemory`
+    :param encode:
+        *Optional*. Function converting the values into values the storage can keep.
+    :type encode:
+        function
+    :param decode:
+        *Optional*. Reverse function of ``encode``.
+    :type decode:
+        function
+    """
+
+    def __init__(self, memory, encode=None, decode=None):
+        self.memory = memory
+        self._encode = encode
+        self._decode = decode
+
+    def get(self, key, default=None):
+        value = self.memory.get(key)
+        if value is None:
+            return default
+        return self._decode(value) if self._decode is not None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.memory.save(key, self._encode(value) if self._encode is not None else value)
+
+    def __contains__(self, key):
+        return key in self.memory
+
+    def __iter__(self):
+        return iter(self.memory.keys())
+
+    def pop(self, key, default=None):
+        value = self.get(key)
+        if value is None:
+            return default
+        # only files have values, so that the recursive deletion only removes the key
+        self.memory.delete(key)
+        return value
+
+    def delete(self, delete_key:str):
+        self.memory.delete(delete_key)
+
+    def move(self, src_key:str, dst_key:str):
+        self.memory.move(src_key, dst_key)
+
+    def flush(self):
+        self.memory.flush()
+
+
+def _encode_block_digests(value:tuple) -> tuple:
+    return value[0], ''.join(digest.hex() for digest in value[1])
+
+def _decode_block_digests(value:tuple) -> tuple:
+    # digests of 32 bytes, that is 64 hexadecimal characters
+    return value[0], tuple(bytes.fromhex(value[1][i:i + 64]) for i in range(0, len(value[1]), 64))
+
+    
+class DirectoryFingerprints():
+    """
+    Helper class, used by :py:class:`LocalState`. Maintains a Merkle-style 
+    fingerprint for each known directory: the fingerprint of a directory is the 
+    hash of the sorted list of its children ``(name, child fingerprint)``, where 
+    the fingerprint of a file is its hash value, and the fingerprint of a 
+    sub-directory is computed the same way, recursively.
+
+    Two directories having the same fingerprint thus contain exactly the same 
+    tree of files and folders, with the same contents. When a folder has been 
+    copied, its source can then be found with one dictionary lookup, 
+    using :py:meth:`get_by_fingerprint`.
+
+    Fingerprints are updated incrementally: when a child changes, its parent 
+    directory (and the parent of its parent...) is only marked as *dirty*, and 
+    the dirty fingerprints are recomputed (deepest first) the next time a 
+    fingerprint is needed. If the hash value of any child is unknown (or has been 
+    evicted from memory, see :py:class:`BoundedDualAccessMemory`), the 
+    fingerprint of the directory is ``None``.
+
+    While the tree is ``partial`` (being indexed in the background), every new 
+    directory is considered *unlisted*, and its fingerprint is ``None``, until 
+    :py:meth:`set_listed` tells that all its children are registered.
+
+    With a ``max_size``, at most ``max_size`` fingerprints are kept in memory (see
+    :py:class:`BoundedDualAccessMemory`): an evicted fingerprint is computed again 
+    from the children of its directory when needed, and is not found by
+    :py:meth:`get_by_fingerprint` meanwhile.
+
+    :param hashes:
+        The dual access dictionary containing the hash value of each file 
+        (usually :py:attr:`LocalState.hashes`). It is only read by this class.
+    :type hashes:
+        :py:class:`DualAccessMemory`
+    :param partial:
+        *Optional*. ``False`` by default. See :py:meth:`set_complete`.
+    :type partial:
+        boolean
+    :param max_size:
+        *Optional*. Maximum number of fingerprints kept in memory, all of them by default.
+    :type max_size:
+        int
+    """
+
+    def __init__(self, hashes:DualAccessMemory, partial:bool=False, max_size:int=None):
+        self.hashes = hashes
+        self.partial = partial
+        
+        # self.children is a dictionary with key=dir_path and value=set of child names
+        # (a child is a directory if its own path is a key of self.children)
+        self.children = {}
+        self.children.clear()
+        
+        # self.fingerprints is a dual access dictionary 
+        # self.fingerprints.get(key) with key=dir_path returns the value=fingerprint
+        # self.fingerprints.get_by_value(value) with value=fingerprint returns a set of dir paths
+        self.fingerprints = DualAccessMemory() if max_size is None else BoundedDualAccessMemory(max_size)
+        
+        self._dirty = set()
+        self._dirty.clear()
+
+        # directories whose children may not be all registered yet
+        self.unlisted = set()
+        self.unlisted.clear()
+
+    @staticmethod
+    def _split(key:str):
+        return os.path.dirname(key), os.path.basename(key)
+
+    def _mark_dirty(self, key:str):
+        # if a directory is dirty, all its parents are already dirty too
+        while key not in self._dirty:
+            self._dirty.add(key)
+            if key == '/':
+                break
+            key = os.path.dirname(key)
+
+    def add(self, key:str, is_dir:bool=False):
+        """
+        Registers the file or directory ``key`` (and its parent directories, if
+        they are not known yet), or notifies that its hash value has changed. 
+        Parent fingerprints are marked for recomputation.
+        """
+        if is_dir and key not in self.children:
+            self.children[key] = set()
+            self._mark_dirty(key)
+            if self.partial:
+                self.unlisted.add(key)
+        while key != '/':
+            parent, name = self._split(key)
+            self._mark_dirty(parent)
+            if parent in self.children:
+                self.children[parent].add(name)
+                break
+            self.children[parent] = set([name])
+            if self.partial:
+                self.unlisted.add(parent)
+            key = parent
+
+    def set_listed(self, key:str):
+        """
+        Notifies that every child of the directory ``key`` is registered, so
+        that its fingerprint can be computed.
+        """
+        if key in self.unlisted:
+            self.unlisted.discard(key)
+            self._mark_dirty(key)
+
+    def set_complete(self):
+        """
+        Notifies that the whole tree is registered (the background indexing
+        is over): every directory is considered as listed.
+        """
+        self.partial = False
+        for key in self.unlisted:
+            self._mark_dirty(key)
+        self.unlisted.clear()
+
+    def delete(self, key:str):
+        """
+        Unregisters the file or directory ``key``, and all its children 
+        recursively.
+        """
+        if key != '/':
+            parent, name = self._split(key)
+            if parent in self.children:
+                self.children[parent].discard(name)
+                self._mark_dirty(parent)
+        if key in self.children:
+            for d in self._get_sub_dirs(key):
+                self.children.pop(d)
+                self._dirty.discard(d)
+                self.unlisted.discard(d)
+            self.fingerprints.delete(key)
+
+    def _get_sub_dirs(self, key:str) -> list:
+        # key itself, and every known sub-directory
+        sub_dirs = []
+        stack = [key]
+        while stack:
+            current = stack.pop()
+            if current in self.children:
+                sub_dirs.append(current)
+                stack.extend(os.path.join(current, n) for n in self.children[current])
+        return sub_dirs
+
+    def move(self, src_key:str, dst_key:str):
+        """
+        Moves the file or directory ``src_key`` (and all its children) to
+        ``dst_key``. Note that the hash values of the moved files have to 
+        be moved in the :py:class:`DualAccessMemory` first.
+        """
+        parent, name = self._split(src_key)
+        if src_key not in self.children and name not in self.children.get(parent, ()):
+            return
+        moved_children = dict((dst_key + d[len(src_key):], self.children[d]) for d in self._get_sub_dirs(src_key))
+        moved_unlisted = set(dst_key + d[len(src_key):] for d in self._get_sub_dirs(src_key) if d in self.unlisted)
+        self.delete(src_key)
+        self.delete(dst_key)
+        for d, names in moved_children.items():
+            self.children[d] = names
+            self._dirty.add(d)
+        self.unlisted.update(moved_unlisted)
+        self.add(dst_key, dst_key in moved_children)
+
+    def _compute(self, key:str):
+        if key in self.unlisted:
+            return None
+        fingerprint = hashlib.sha256()
+        for name in sorted(self.children[key]):
+            child = os.path.join(key, name)
+            if child in self.children:
+                child_type, child_value = 'd', self._get_fingerprint(child)
+            else:
+                child_type, child_value = 'f', self.hashes.get(child)
+            if child_value is None:
+                return None
+            fingerprint.update((child_type + name + '\0' + child_value + '\n').encode('utf-8', 'surrogateescape'))
+        return fingerprint.hexdigest()
+
+    def _get_fingerprint(self, key:str):
+        fingerprint = self.fingerprints.get(key)
+        if fingerprint is None and key in self.children and key not in self.fingerprints:
+            # evicted from memory
+            fingerprint = self._compute(key)
+            self.fingerprints.save(key, fingerprint)
+        return fingerprint
+
+    def _flush(self):
+        # deepest first, the root directory last
+        for key in sorted(self._dirty, key=lambda x: -len(x.rstrip('/').split('/'))):
+            if key in self.children:
+                self.fingerprints.save(key, self._compute(key))
+        self._dirty.clear()
+
+    def get(self, key:str) -> str:
+        """
+        Returns the fingerprint of the directory ``key``, or ``None`` if
+        the directory is unknown or if the hash value of any of its children is 
+        unknown.
+        """
+        if self._dirty:
+            self._flush()
+        return self._get_fingerprint(key)
+
+    def get_by_fingerprint(self, fingerprint:str) -> set:
+        """
+        Returns a set of every directory paths for which the fingerprint
+        corresponds to the ``fingerprint`` parameter.
+        """
+        if fingerprint is None:
+            return set()
+        if self._dirty:
+            self._flush()
+        return set(self.fingerprints.get_by_value(fingerprint))
+
+    def count_children(self, key:str) -> int:
+        """
+        Returns the number of files and directories directly under the 
+        directory ``key``, or ``None`` if the directory is unknown.
+        """
+        names = self.children.get(key)
+        return len(names) if names is not None else None
     
+
     
 class LocalState():
     """
@@ -164,7 +832,9 @@ class LocalState():
     :py:class:`LocalState` is keeping tracks of files with two 
     :py:class:`DualAccessMemory` objects. The first one keeping tracks of
     couple ``(size, modification time)``, and the second one of single 
-    ``hash`` value.
+    ``hash`` value. A :py:class:`DirectoryFingerprints` object also keeps a 
+    Merkle-style fingerprint of each directory, so that the source of a copied 
+    folder can be found with a single lookup.
 
     Hash values are computed depending on a default hashing function. This
     default method is based on the Dropbox hashing algorithm, but you can
@@ -196,7 +866,8 @@ class LocalState():
         *Optional*. Default value is :py:meth:`_default_hashing_function` is used, 
         which is based on the Dropbox hashing algorithm. But you can also
         provides your own hashing function, as long as your respect the format
-        of the default one.
+        of the default one. If the function has a ``hash_many(absolute_paths) -> dict`` 
+        attribute, it is used to hash files by batches (see :py:meth:`hash_many`).
     :type custom_hash_function:
         function
     :param custom_intializing_values:
@@ -209,9 +880,84 @@ class LocalState():
         ``key=file_path`` and ``value=[file_hash, file_size, file_time]``.
         You do not need to know the exact content of the main directory at the initialization, 
         and if you later notice unexpected modifications compared to the initial values you sent, 
-        you can still correct each of them using the :py:meth:`save` method.
+        you can still correct each of them using the :py:meth:`save` method. For very large 
+        directories, the values can also be streamed, as any iterable of ``(file_path, 
+        [file_hash, file_size, file_time])`` couples, or as the path of a JSON lines or 
+        CSV file (see :py:mod:`~lazydog.manifests`). The paths that do not exist are 
+        ignored, using a single :py:func:`os.scandir` call per directory (see 
+        :py:class:`~lazydog.traversal.DirectoryListings`).
     :type custom_intializing_values:
         dict
+    :param max_resident_hashes:
+        *Optional*. If not provided or ``None``, every hash value is kept in memory.
+        Else, it is the maximum number of hash values kept in memory (sizes and 
+        modification times, which are cheaper to recompute, always stay in memory), 
+        thus making the memory use predictable when watching very large directories. 
+        Least recently used hash values are evicted first, and then recomputed on 
+        demand. See :py:class:`BoundedDualAccessMemory`. The directory fingerprints, 
+        and the values kept alongside the hash values (see :py:class:`BoundedMemory`), 
+        are bounded by the same number.
+    :type max_resident_hashes:
+        int
+    :param hash_spill_store:
+        *Optional*. Only used with ``max_resident_hashes``. Dictionary-like object
+        (for example a :py:mod:`dbm` database) where evicted hash values are written, 
+        instead of being recomputed. With a memory of a storage (for example 
+        ``SQLiteStorage(path).open_memory('spilled_hashes', ('hash',))``), the evicted 
+        keys are not kept in memory either, see :py:class:`BoundedDualAccessMemory`.
+    :type hash_spill_store:
+        dict
+    :param storage:
+        *Optional*. If not provided or ``None``, the indexes are kept in memory. Else, 
+        any storage of the :py:mod:`lazydog.storages` module, for example a 
+        :py:class:`~lazydog.storages.SQLiteStorage`, thus trading memory for I/O 
+        (note that hash values are kept in memory when using ``max_resident_hashes``). 
+        The values saved with the hash values (see :py:class:`StoredMemory`) are kept 
+        in the same storage, whereas the hashing checkpoints are always kept in memory.
+    :type storage:
+        :py:class:`~lazydog.storages.DictStorage`
+    :param defer_indexing:
+        *Optional*. ``False`` by default. If ``True`` (and if no ``custom_intializing_values`` 
+        are provided), the watched directory is not browsed at initialization: call 
+        :py:meth:`start_indexing` to index it in the background, for example once the 
+        observer is already running. Until :py:meth:`is_ready` returns ``True``, paths 
+        that are not indexed yet are simply unknown (as for new files).
+    :type defer_indexing:
+        boolean
+    :param io_friendly_hashing:
+        *Optional*. ``False`` by default. If ``True`` (and if no ``custom_hash_function`` 
+        is provided), files are hashed with the ``io_friendly`` mode of 
+        :py:func:`~lazydog.dropbox_content_hasher.default_hash_function`, so that 
+        hashing large trees does not evict the page cache used by other applications.
+    :type io_friendly_hashing:
+        boolean
+    :param hashing_workers:
+        *Optional*. Number of hashing threads per device used to index the watched 
+        directory, 1 by default. Either an integer, or a dictionary ``{st_dev: workers}``, 
+        see :py:class:`~lazydog.indexers.HashingScheduler`.
+    :type hashing_workers:
+        int
+    :param resumable_hashing:
+        *Optional*. ``False`` by default. If ``True`` (and if no ``custom_hash_function`` 
+        is provided), the hashing state of the files seen growing is kept, so that when 
+        such a file is only appended (typically log files), only the appended bytes are 
+        hashed (see :py:func:`~lazydog.dropbox_content_hasher.resumable_hash_function`). 
+        :py:attr:`resumed_hashes` and :py:attr:`skipped_bytes` count the resumed hashes 
+        and the bytes that did not have to be read again.
+    :type resumable_hashing:
+        boolean
+    :param keep_block_digests:
+        *Optional*. ``False`` by default. If ``True`` (and if no ``custom_hash_function`` 
+        is provided), the digests of the 4 MiB blocks of each file are kept, so that 
+        the blocks changed by a modification can be identified (see :py:meth:`get_changed_blocks`), 
+        at the cost of 32 bytes of memory per block.
+    :type keep_block_digests:
+        boolean
+    :param path_filter:
+        *Optional*. Exclusion rules of the watched directory: excluded paths are 
+        neither indexed nor reported by :py:meth:`get_differences`.
+    :type path_filter:
+        :py:class:`~lazydog.filters.PathFilter`
 
     :returns: 
         An initialized object representing local state of the aimed folder.
@@ -247,6 +993,14 @@ class LocalState():
         """
         return default_hash_function(absolute_path, LocalState.DEFAULT_DIRECTORY_VALUE)
     
+    @staticmethod
+    def _io_friendly_hashing_function(absolute_path:str):
+        """
+        Same as :py:meth:`_default_hashing_function`, using the ``io_friendly`` mode
+        of :py:func:`~lazydog.dropbox_content_hasher.default_hash_function`.
+        """
+        return default_hash_function(absolute_path, LocalState.DEFAULT_DIRECTORY_VALUE, io_friendly=True)
+    
     # Following 3 methods can be used in other classes
     def absolute_local_path(self, relative_path:str) -> str:
         """
@@ -276,47 +1030,422 @@ class LocalState():
         absolute_path = os.path.normpath(absolute_path)
         return '/' + os.path.relpath(absolute_path, self.absolute_root_folder)
     
-    def hash_function(self, *args, **kwargs):
-        return self._hash_function(*args, **kwargs)
+    def hash_function(self, absolute_path:str) -> str:
+        """
+        Returns the hash value of the file or folder, see :py:meth:`hash_result`, 
+        or ``None`` if the file kept being modified while hashed: such a hash value 
+        may not correspond to any version of the file, and is never saved.
+        """
+        result = self.hash_result(absolute_path)
+        return result.hash if result.is_stable else None
+    
+    def hash_result(self, absolute_path:str) -> HashResult:
+        """
+        Computes the hash value of the file or folder at the ``absolute_path``, 
+        retrying if the file is modified while being hashed (see 
+        :py:func:`~lazydog.dropbox_content_hasher.hash_with_stat`). The 
+        signature of stable results is saved with the hash value, so that 
+        :py:meth:`is_hash_current` can later verify it without hashing again, 
+        as well as the sampled digest of the files bigger than the samples (see 
+        :py:meth:`has_same_sample_digest`). Unstable results are counted in 
+        :py:attr:`unstable_hashes`.
+        """
+        if self.hash_checkpoints is not None or self.block_digests is not None:
+            result = hash_with_stat(self._tracked_hash, absolute_path)
+        else:
+            result = hash_with_stat(self._hash_function, absolute_path)
+        self._keep_signature(absolute_path, result)
+        return result
+    
+    def has_batch_hashing(self) -> bool:
+        """
+        Returns ``True`` if the custom hash function provides the batch protocol 
+        (see :py:meth:`hash_many`).
+        """
+        return self._hash_many is not None
+    
+    def hash_many(self, absolute_paths:list) -> dict:
+        """
+        Computes the hash values of the files or folders at the ``absolute_paths``, 
+        and returns them as a dictionary ``{absolute_path: hash value}``.
+
+        If the custom hash function provides a ``hash_many(absolute_paths) -> dict`` 
+        method (see the ``custom_hash_function`` parameter), the files are hashed by 
+        a single call to it, so that it can batch its work (asking a hashing daemon, 
+        reading a precomputed manifest...). The paths missing from its result, or all 
+        of them if it fails, are hashed one by one with :py:meth:`hash_function`. As 
+        for :py:meth:`hash_result`, the signatures of the files that did not change 
+        while being hashed are saved with their hash value, and the hash values of 
+        the files that changed are ``None``.
+        """
+        if self._hash_many is None:
+            return {x: self.hash_function(x) for x in absolute_paths}
+        signatures = {x: stat_signature(x) for x in absolute_paths}
+        try:
+            file_hashes = dict(self._hash_many(list(absolute_paths)))
+        except Exception:
+            logging.exception('Error while hashing a batch of %d files, hashing them one by one' 
+                              % len(absolute_paths))
+            file_hashes = {}
+        results = {}
+        for absolute_path in absolute_paths:
+            if absolute_path not in file_hashes:
+                results[absolute_path] = self.hash_function(absolute_path)
+                continue
+            result = HashResult(file_hashes[absolute_path], signatures[absolute_path], 
+                                stat_signature(absolute_path))
+            self._keep_signature(absolute_path, result)
+            results[absolute_path] = result.hash if result.is_stable else None
+        return results
+    
+    def _keep_signature(self, absolute_path:str, result:HashResult):
+        key = self.relative_local_path(absolute_path)
+        with self.lock:
+            is_saved = result.is_stable and not result.is_racy and result.hash != LocalState.DEFAULT_DIRECTORY_VALUE
+        is_sampled = is_saved and result.signature[0] > HashCheckpoint.SAMPLES * HashCheckpoint.SAMPLE_SIZE
+        digest = None
+        if is_sampled:
+            # the samples must be read from the very version of the file that has been hashed
+            digest = sample_digest(absolute_path)
+            if digest is not None and stat_signature(absolute_path) != result.signature:
+                digest = None
+        with self.lock:
+            if is_saved:
+                self._fresh_signatures[key] = (result.hash, result.signature, digest)
+            else:
+                self._fresh_signatures.pop(key, None)
+                if not result.is_stable and result.signature_after is not None:
+                    self.unstable_hashes += 1
     
-    def __init__(self, absolute_root_folder, custom_hash_function=None, custom_intializing_values:dict=None):
-        # keep absolute root folder
+    def is_hash_current(self, key:str) -> bool:
+        """
+        Returns ``True`` if the saved hash value of the file at the ``key`` relative 
+        path still corresponds to its content, using a single ``stat`` call: the file 
+        has the same size, modification and change times (in nanoseconds) and inode 
+        as when the hash value was computed. ``False`` if unknown, or if anything changed (in 
+        this case, the content may still be the same).
+        """
+        with self.lock:
+            signature = self.hash_signatures.get(key)
+        return signature is not None and stat_signature(self.absolute_local_path(key)) == signature
+    
+    def has_same_sample_digest(self, key:str) -> bool:
+        """
+        Compares the sampled digest of the file at the ``key`` relative path (a 
+        few small blocks spread over the file, see 
+        :py:func:`~lazydog.dropbox_content_hasher.sample_digest`) with the one 
+        saved with its hash value. Returns ``None`` if unknown (small files, or 
+        hash value not verified by a signature). Reading the samples is cheap, 
+        and ``False`` proves the content changed, whereas ``True`` does not 
+        prove anything.
+
+        Sampled digests are computed along with the hash value of the files, 
+        which costs a few more small reads per hashed file.
+        """
+        with self.lock:
+            saved_digest = self.sample_digests.get(key)
+        if saved_digest is None:
+            return None
+        digest = sample_digest(self.absolute_local_path(key))
+        return None if digest is None else digest == saved_digest
+    
+    def _tracked_hash(self, absolute_path:str) -> str:
+        """
+        Hashes the file with the default hash function, keeping track of:
+
+        * the hashing checkpoint of the file (see ``resumable_hashing``), resuming \
+        from the previous one if any, with \
+        :py:func:`~lazydog.dropbox_content_hasher.resumable_hash_function`. A checkpoint \
+        is kept for the files that are seen growing (bigger than their last known size), \
+        as long as they are only appended.
+        * the digests of the 4 MiB blocks of the file (see ``keep_block_digests``), \
+        that are saved with the hash value, or compared to the saved ones \
+        (see :py:meth:`get_changed_blocks`).
+        """
+        key = self.relative_local_path(absolute_path)
+        block_digests = [] if self.block_digests is not None else None
+        if self.hash_checkpoints is None:
+            file_hash = default_hash_function(absolute_path, LocalState.DEFAULT_DIRECTORY_VALUE, 
+                                              self._io_friendly_hashing, block_digests)
+        else:
+            with self.lock:
+                checkpoint = self.hash_checkpoints.get(key)
+                known_sizetime = self.sizetimes[key]
+            file_hash, new_checkpoint = resumable_hash_function(absolute_path, checkpoint, 
+                                                                LocalState.DEFAULT_DIRECTORY_VALUE, 
+                                                                self._io_friendly_hashing, block_digests)
+            with self.lock:
+                if new_checkpoint is not None and new_checkpoint.resumed_from > 0:
+                    self.resumed_hashes += 1
+                    self.skipped_bytes += new_checkpoint.resumed_from
+                    self.hash_checkpoints[key] = new_checkpoint
+                elif (new_checkpoint is not None and known_sizetime is not None and 
+                      isinstance(known_sizetime[0], int) and new_checkpoint.offset > known_sizetime[0]):
+                    self.hash_checkpoints[key] = new_checkpoint
+                else:
+                    self.hash_checkpoints.pop(key, None)
+        if block_digests is not None and file_hash not in [None, LocalState.DEFAULT_DIRECTORY_VALUE]:
+            with self.lock:
+                self._fresh_block_digests[key] = (file_hash, tuple(block_digests))
+        return file_hash
+    
+    def __init__(self, absolute_root_folder, custom_hash_function=None, custom_intializing_values:dict=None, 
+                 max_resident_hashes:int=None, hash_spill_store=None, storage=None, 
+                 defer_indexing:bool=False, io_friendly_hashing:bool=False, hashing_workers=1, 
+                 resumable_hashing:bool=False, keep_block_digests:bool=False, path_filter=None):
+        # keep absolute root folder, and its exclusion rules
         self.absolute_root_folder = absolute_root_folder
+        self.path_filter = path_filter
+        
+        # the indexes can be updated both by the handler and by the background indexer
+        self.lock = threading.RLock()
+        self.indexer = None
+        self.hashing_workers = hashing_workers
+        
+        # keep hash function, and its batch version if any
+        self._hash_many = getattr(custom_hash_function, 'hash_many', None)
+        if custom_hash_function is not None:
+            self._hash_function = custom_hash_function
+        elif io_friendly_hashing:
+            self._hash_function = LocalState._io_friendly_hashing_function
+        else:
+            self._hash_function = LocalState._default_hashing_function
+        self._io_friendly_hashing = io_friendly_hashing
         
-        # keep hash function
-        self._hash_function = custom_hash_function if custom_hash_function is not None else LocalState._default_hashing_function
+        # hashing checkpoints of the files seen growing (only with the default hash function)
+        self.hash_checkpoints = self._new_memory(max_resident_hashes) if resumable_hashing and custom_hash_function is None else None
+        self.resumed_hashes = 0
+        self.skipped_bytes = 0
+        
+        # couples (file_hash, digests of the 4 MiB blocks) of each file (only with the 
+        # default hash function), and couples computed since the last save, by path
+        self.block_digests = (self._open_side_memory(storage, max_resident_hashes, 'block_digests', ('hash', 'digests'), 
+                                                     _encode_block_digests, _decode_block_digests) 
+                              if keep_block_digests and custom_hash_function is None else None)
+        self._fresh_block_digests = self._new_memory(max_resident_hashes)
+        
+        # (size, mtime_ns, inode, ctime_ns) signatures and sampled digests of the files 
+        # when their saved hash was computed, and tuples (file_hash, signature, sampled 
+        # digest) computed since the last save
+        self.hash_signatures = self._open_side_memory(storage, max_resident_hashes, 'hash_signatures', 
+                                                      ('size', 'mtime_ns', 'ino', 'ctime_ns'))
+        self.sample_digests = self._open_side_memory(storage, max_resident_hashes, 'sample_digests', 
+                                                     ('digest',), bytes.hex, bytes.fromhex)
+        self._fresh_signatures = self._new_memory(max_resident_hashes)
+        self.unstable_hashes = 0
         
         # self.hashes is a dual access dictionary 
         # self.hashes.get(key) with key=file_path returns the value=file_hash
         # self.hashes.get_by_value(value) with value=file_hash returns a set of paths
-        self.hashes = DualAccessMemory()
+        if max_resident_hashes is None:
+            self.hashes = self._open_memory(storage, 'hashes', ('hash',))
+        else:
+            self.hashes = BoundedDualAccessMemory(max_resident_hashes, hash_spill_store)
         
         # self.sizetimes is a dual access dictionary 
         # self.sizetimes.get(key) with key=file_path returns the value=tuple(file_size, file_mtime)
         # self.sizetimes.get_by_value(value) with value=tuple(file_size, file_mtime) returns a set of paths
-        self.sizetimes = DualAccessMemory()
+        self.sizetimes = self._open_memory(storage, 'sizetimes', ('size', 'mtime'))
+        
+        # self.inodes is a dual access dictionary, filled with the stats already taken for self.sizetimes
+        # self.inodes.get(key) with key=file_path returns the value=tuple(st_dev, st_ino)
+        # self.inodes.get_by_value(value) with value=tuple(st_dev, st_ino) returns a set of paths (hard links)
+        self.inodes = self._open_memory(storage, 'inodes', ('dev', 'ino'))
+        
+        # sizetime values saved since the last call to pop_colliding_sizetimes, 
+        # so that only them are checked for new collisions (None until the first call)
+        self._new_sizetimes = None
+        
+        # function returning True if the deletion of a path is still pending (its
+        # Deleted event not processed yet), so that its values are not purged when
+        # detecting it does not exist anymore (see _check_for_deleted_paths)
+        self.is_pending_deletion = None
+        
+        # self.fingerprints keeps a Merkle-style fingerprint of each directory, 
+        # based on the values of self.hashes (see DirectoryFingerprints)
+        self.fingerprints = DirectoryFingerprints(self.hashes, 
+                                                  partial=defer_indexing and custom_intializing_values is None, 
+                                                  max_size=max_resident_hashes)
         
         # Initializing values
         if custom_intializing_values is not None:
-            # custom_intializing_values should be a dict with:
+            # custom_intializing_values should be a dict (or an iterable of couples, 
+            # or the path of a manifest) with:
             # - key=file_path
             # - value=list(file_hash, file_size, file_time)
-            for k, v in custom_intializing_values.items():
-                if os.path.exists(self.absolute_local_path(k)):
-                    self.save(k, v[0], v[1], v[2])
-                    logging.debug('Initial indexing (provided) ' + k + ' - ' + v[0] + ' - ' + str((v[1], v[2])))
-        else:
+            if isinstance(custom_intializing_values, str):
+                custom_intializing_values = read_manifest(custom_intializing_values)
+            elif isinstance(custom_intializing_values, dict):
+                custom_intializing_values = custom_intializing_values.items()
+            listings = DirectoryListings()
+            is_debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+            for k, v in custom_intializing_values:
+                entry = listings.get(self.absolute_local_path(k))
+                if entry is not None and self.path_filter is not None and self.path_filter.is_excluded(k, is_dir_entry(entry), 'indexing'):
+                    continue
+                if entry is not None:
+                    self._save_values(k, v[0], v[1], v[2], is_dir_entry(entry), listings.get_inode(entry))
+                    if is_debug:
+                        logging.debug('Initial indexing (provided) %s - %s - %s' % (k, v[0], (v[1], v[2])))
+        elif not defer_indexing:
             
-            # Default initializing
-            for root, dirs, files in os.walk(self.absolute_root_folder):  
-                for i in dirs + files:
-                    relative_path = self.relative_local_path(os.path.join(root, i))
-                    self.get_hash(relative_path)
-                    self.get_sizetime(relative_path)
-                    logging.debug('Initial indexing (computed) ' + relative_path + ' - ' + self.get_hash(relative_path) + ' - ' + str(self.get_sizetime(relative_path)))
+            # Default initializing: sizes and modification times are saved while 
+            # browsing, then files are hashed per device, in inode order
+            scheduler = HashingScheduler(lambda k, p: self._index_hash(k, p, False), hashing_workers, 
+                                         hash_and_save_many=self._index_hashes if self.has_batch_hashing() else None)
+            prefix_len = len(os.path.join(self.absolute_root_folder, ''))
+            is_debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+            for entry in scan_tree(self.absolute_root_folder, exclude=self.exclude_function()):
+                relative_path = '/' + entry.path[prefix_len:]
+                self._index_entry(relative_path, entry, scheduler)
+                if is_debug:
+                    logging.debug('Initial indexing (computed) %s - %s' % (relative_path, self.get_sizetime(relative_path)))
+            scheduler.start()
+            scheduler.close()
+            scheduler.join()
+    
+    def exclude_function(self):
+        """
+        Returns the ``exclude`` function of :py:func:`~lazydog.traversal.scan_tree` 
+        pruning the paths excluded by the ``path_filter`` (counted as pruned by 
+        the ``'indexing'``), or ``None`` if there is no filter.
+        """
+        if self.path_filter is None:
+            return None
+        prefix_len = len(os.path.join(self.absolute_root_folder, ''))
+        return lambda entry: self.path_filter.is_excluded(entry.path[prefix_len:], is_dir_entry(entry), 'indexing')
+    
+    def _index_entry(self, key:str, entry:os.DirEntry, scheduler:HashingScheduler=None, priority:int=1) -> bool:
+        """
+        Saves the size, modification time and inode of the :py:class:`os.DirEntry` 
+        in parameter, and its hash value, unless they are already known. If a
+        ``scheduler`` is provided, files are submitted to it instead of being hashed
+        right away. Returns ``True`` if anything has been saved (and nothing submitted).
+        """
+        if key in self.hashes and key in self.sizetimes:
+            return False
+        is_dir = is_dir_entry(entry)
+        with self.lock:
+            if key not in self.sizetimes:
+                self._save_sizetime_from_entry(key, entry)
+            inode = self.inodes[key]
+            if key not in self.hashes:
+                # a child of its directory, whose fingerprint is unknown until hashed
+                self.fingerprints.add(key, is_dir)
+        if key not in self.hashes:
+            if scheduler is not None and not is_dir and inode is not None:
+                scheduler.submit(key, entry.path, inode[0], inode[1], priority)
+                return False
+            self._index_hash(key, entry.path, is_dir)
+        return True
+    
+    def _index_hash(self, key:str, absolute_path:str, is_dir:bool):
+        """
+        Computes and saves the hash value of the ``key`` relative path, unless 
+        it is already known. The hash value is computed without holding the lock.
+        """
+        if key in self.hashes:
+            return
+        file_hash = self.hash_function(absolute_path)
+        with self.lock:
+            if key not in self.hashes:
+                self._save_hash(key, file_hash, is_dir)
+    
+    def _index_hashes(self, couples:list):
+        """
+        Same as :py:meth:`_index_hash`, for a batch of ``(key, absolute_path)`` 
+        couples of files, hashed with :py:meth:`hash_many`.
+        """
+        couples = [x for x in couples if x[0] not in self.hashes]
+        file_hashes = self.hash_many([x[1] for x in couples])
+        with self.lock:
+            for key, absolute_path in couples:
+                if key not in self.hashes:
+                    self._save_hash(key, file_hashes[absolute_path], False)
+    
+    def _set_listed(self, key:str=None):
+        """
+        Called by the :py:class:`~lazydog.indexers.BackgroundIndexer`, once every 
+        entry of the directory ``key`` is registered, or with no ``key`` once the
+        whole directory is indexed (see :py:class:`DirectoryFingerprints`).
+        """
+        with self.lock:
+            if key is None:
+                self.fingerprints.set_complete()
+            else:
+                self.fingerprints.set_listed(key)
+    
+    def start_indexing(self, workers=None, low_io_priority:bool=False):
+        """
+        Starts indexing the watched directory in the background, with ``workers`` 
+        hashing threads per device, by default the ``hashing_workers`` parameter (see 
+        :py:class:`~lazydog.indexers.BackgroundIndexer`). Only useful when the object 
+        has been initialized with ``defer_indexing=True``.
+        """
+        if self.indexer is None:
+            workers = workers if workers is not None else self.hashing_workers
+            self.indexer = BackgroundIndexer(self, workers, low_io_priority)
+            self.indexer.start()
+        return self.indexer
+    
+    def is_ready(self) -> bool:
+        """
+        Returns ``True`` if the whole watched directory is indexed, ``False`` 
+        while the background indexing (see :py:meth:`start_indexing`) is running.
+        """
+        return self.indexer is None or self.indexer.is_ready()
+    
+    def indexing_progress(self) -> dict:
+        """
+        Returns the status of the background indexing, see 
+        :py:meth:`~lazydog.indexers.BackgroundIndexer.progress` (counters are 
+        ``None`` if the directory has not been indexed in the background).
+        """
+        if self.indexer is None:
+            return {'ready': True, 'discovered': None, 'indexed': None}
+        return self.indexer.progress()
+    
+    def notify_live_event(self, key:str):
+        """
+        Tells the background indexer (if still running) that the ``key`` relative 
+        path has been touched by a live event, see 
+        :py:meth:`~lazydog.indexers.BackgroundIndexer.prioritize`.
+        """
+        if self.indexer is not None and not self.indexer.is_ready():
+            self.indexer.prioritize(key)
     
 
     
+    @staticmethod
+    def _new_memory(max_size:int):
+        return PathMemory() if max_size is None else BoundedMemory(max_size)
+    
+    @staticmethod
+    def _open_memory(storage, name:str, columns:tuple):
+        if storage is None:
+            return DualAccessMemory()
+        return storage.open_memory(name, columns)
+    
+    @staticmethod
+    def _open_side_memory(storage, max_resident_hashes:int, name:str, columns:tuple, encode=None, decode=None):
+        # values kept alongside the hash values, in the storage only if the hash values are
+        if storage is None or max_resident_hashes is not None:
+            return LocalState._new_memory(max_resident_hashes)
+        return StoredMemory(storage.open_memory(name, columns), encode, decode)
+    
+    def flush(self):
+        """
+        Writes the pending modifications of the indexes, when they are 
+        kept in a persistent storage (see ``storage`` parameter).
+        """
+        with self.lock:
+            self.hashes.flush()
+            self.sizetimes.flush()
+            self.inodes.flush()
+            for memory in [self.hash_signatures, self.sample_digests, self.block_digests]:
+                if isinstance(memory, StoredMemory):
+                    memory.flush()
+    
     def get_hash(self, key:str, compute_if_none:bool=True) -> str:
         """
         Gets the ``file_hash`` value of the file at the ``key`` relative path. If the file is unknown
@@ -338,18 +1467,110 @@ class LocalState():
             File or directory hash value, if path exists, else ``None``.
         :rtype: 
             str
+
+        .. note: If the hash value has been evicted from memory (see ``max_resident_hashes``),
+            it is always recomputed, whatever the ``compute_if_none`` parameter.
+        """
+        if self.hashes.get(key) is None and (compute_if_none or self.hashes.is_evicted(key)):
+            if self.hashes.is_evicted(key):
+                self.hashes.recomputations += 1
+            absolute_path = self.absolute_local_path(key)
+            file_hash = self.hash_function(absolute_path)
+            with self.lock:
+                self._save_hash(key, file_hash, os.path.isdir(absolute_path))
+        with self.lock:
+            return self.hashes[key]
+    
+    def _save_hash(self, key:str, file_hash, is_dir:bool):
+        if file_hash is None and not is_dir:
+            # not hashed (modified while being read, or unreadable): computed again when needed
+            self.hashes.delete(key)
+            self.fingerprints.add(key)
+            self._fresh_signatures.pop(key, None)
+            self.hash_signatures.pop(key, None)
+            self.sample_digests.pop(key, None)
+            return
+        self.hashes[key] = file_hash
+        self.fingerprints.add(key, is_dir)
+        fresh = self._fresh_signatures.pop(key, None)
+        if fresh is not None and fresh[0] == file_hash:
+            self.hash_signatures[key] = fresh[1]
+            if fresh[2] is not None:
+                self.sample_digests[key] = fresh[2]
+            else:
+                self.sample_digests.pop(key, None)
+        else:
+            self.hash_signatures.pop(key, None)
+            self.sample_digests.pop(key, None)
+        if self.block_digests is not None:
+            fresh = self._fresh_block_digests.pop(key, None)
+            if fresh is not None and fresh[0] == file_hash:
+                self.block_digests[key] = fresh
+            elif key in self.block_digests and self.block_digests[key][0] != file_hash:
+                self.block_digests.pop(key)
+    
+    def get_changed_blocks(self, key:str) -> list:
+        """
+        Compares the digests of the 4 MiB blocks of the file at the ``key`` relative 
+        path, as computed by the latest call to :py:meth:`hash_function`, with the 
+        saved ones. Returns the sorted list of the indexes of the new blocks that differ 
+        (if the file has been truncated, the removed blocks are not listed, the new 
+        size tells it), or ``None`` if any of the two versions is unknown (see the 
+        ``keep_block_digests`` parameter).
         """
-        if key not in self.hashes and compute_if_none:
-            self.hashes[key] = self.hash_function(self.absolute_local_path(key))
-        return self.hashes[key]
+        if self.block_digests is None:
+            return None
+        with self.lock:
+            saved = self.block_digests.get(key)
+            fresh = self._fresh_block_digests.get(key)
+        if saved is None or fresh is None:
+            return None
+        old_digests, new_digests = saved[1], fresh[1]
+        return [i for i, digest in enumerate(new_digests) if i >= len(old_digests) or old_digests[i] != digest]
         
-    def get_files_by_hash_key(self, hash_key:str) -> set:
+    def get_files_by_hash_key(self, hash_key:str, sizetime_key=None) -> set:
         """
         Returns a set of every file or directory paths for which the 
         hash value corresponds to the ``hash_key`` parameter.
+
+        The files having the ``sizetime_key`` couple (file_size, file_modification_time) 
+        and whose hash value is unknown are also checked, computing their hash value: 
+        the files modified since their hash value was saved (see :py:meth:`save_sizetime`), 
+        and the ones whose hash value has been evicted from memory (see 
+        ``max_resident_hashes``). These files are hashed without holding the lock.
+        """
+        candidates = []
+        with self.lock:
+            file_paths = set(self.hashes.get_by_value(hash_key))
+            if sizetime_key is not None:
+                candidates = [x for x in self.sizetimes.get_by_value(sizetime_key).copy() 
+                              if x not in file_paths and (self.hashes.is_evicted(x) or self.hashes.get(x) is None)]
+        if candidates:
+            file_hashes = self._compute_hashes(candidates)
+            file_paths.update([x for x in candidates if file_hashes[x] == hash_key])
+        with self.lock:
+            return self._check_for_deleted_paths(file_paths)
+    
+    def _compute_hashes(self, keys:list) -> dict:
         """
-        file_paths = self.hashes.get_by_value(hash_key)
-        return self._check_for_deleted_paths(file_paths)
+        Same as :py:meth:`get_hash`, for several paths whose hash value has to be 
+        computed, at once (see :py:meth:`hash_many`). Returns a dictionary 
+        ``{key: hash value}``. The files are hashed without holding the lock, and 
+        the hash values are only saved for the paths still known, and not hashed
+        in the meantime.
+        """
+        if len(keys) < 2:
+            return {x: self.get_hash(x) for x in keys}
+        absolute_paths = {self.absolute_local_path(x): x for x in keys}
+        for key in keys:
+            if self.hashes.is_evicted(key):
+                self.hashes.recomputations += 1
+        file_hashes = self.hash_many(list(absolute_paths))
+        with self.lock:
+            for absolute_path, key in absolute_paths.items():
+                if key in self.sizetimes and (self.hashes.is_evicted(key) or self.hashes.get(key) is None):
+                    self._save_hash(key, file_hashes[absolute_path], os.path.isdir(absolute_path))
+        return {absolute_paths[x]: file_hash for x, file_hash in file_hashes.items()}
 
     def get_sizetime(self, key:str, compute_if_none:bool=True):
         """
@@ -373,14 +1594,38 @@ class LocalState():
         :rtype: 
             str
         """
-        if key not in self.sizetimes and compute_if_none:
-            if os.path.isdir(self.absolute_local_path(key)):
-                self.sizetimes[key] = (LocalState.DEFAULT_DIRECTORY_VALUE, 
-                                       LocalState.DEFAULT_DIRECTORY_VALUE)
-            elif os.path.exists(self.absolute_local_path(key)):
-                self.sizetimes[key] = (os.path.getsize(self.absolute_local_path(key)), 
-                                       round(os.path.getmtime(self.absolute_local_path(key)), 3))
-        return self.sizetimes[key]
+        with self.lock:
+            if key not in self.sizetimes and compute_if_none:
+                try:
+                    self._save_sizetime_from_stat(key, os.stat(self.absolute_local_path(key)))
+                except OSError:
+                    pass
+            return self.sizetimes[key]
+    
+    def _save_sizetime_from_stat(self, key:str, file_stat:os.stat_result):
+        if stat.S_ISDIR(file_stat.st_mode):
+            self.sizetimes[key] = (LocalState.DEFAULT_DIRECTORY_VALUE, 
+                                   LocalState.DEFAULT_DIRECTORY_VALUE)
+        else:
+            self._save_sizetime(key, (file_stat.st_size, round(file_stat.st_mtime, 3)))
+        self.inodes[key] = (file_stat.st_dev, file_stat.st_ino)
+    
+    def _save_sizetime(self, key:str, sizetime:tuple):
+        self.sizetimes[key] = sizetime
+        if self._new_sizetimes is not None:
+            self._new_sizetimes.add(sizetime)
+        
+    def _save_sizetime_from_entry(self, key:str, entry:os.DirEntry):
+        """
+        Same as :py:meth:`get_sizetime`, but using the type and the ``stat`` 
+        information already cached by the :py:class:`os.DirEntry` in parameter 
+        (see :py:func:`~lazydog.traversal.scan_tree`), so that no more system call 
+        is needed when browsing the watched directory.
+        """
+        try:
+            self._save_sizetime_from_stat(key, entry.stat())
+        except OSError:
+            pass
         
     def get_files_by_sizetime_key(self, sizetime_key) -> set:
         """
@@ -388,14 +1633,75 @@ class LocalState():
         couple (file_size, file_modification_time) value corresponds 
         to the ``sizetime_key`` parameter.
         """
-        file_paths = self.sizetimes.get_by_value(sizetime_key)
-        return self._check_for_deleted_paths(file_paths)
+        with self.lock:
+            file_paths = self.sizetimes.get_by_value(sizetime_key)
+            return self._check_for_deleted_paths(file_paths)
+    
+    def get_colliding_sizetimes(self) -> list:
+        """
+        Returns the list of the couples ``(file_size, file_modification_time)`` shared 
+        by several files. Only these files can be compared with their hash values 
+        when identifying copy events (directories are not returned).
+        """
+        with self.lock:
+            return [x for x in self.sizetimes.get_shared_values() 
+                    if x != (LocalState.DEFAULT_DIRECTORY_VALUE, LocalState.DEFAULT_DIRECTORY_VALUE)]
+    
+    def pop_colliding_sizetimes(self) -> list:
+        """
+        Same as :py:meth:`get_colliding_sizetimes`, but only returns the couples 
+        ``(file_size, file_modification_time)`` saved since the previous call, that 
+        are now shared by several files. The first call returns every colliding 
+        couple, and starts tracking the saved ones, so that the next calls do not 
+        browse the whole index.
+        """
+        with self.lock:
+            if self._new_sizetimes is None:
+                self._new_sizetimes = set()
+                return self.get_colliding_sizetimes()
+            new_sizetimes, self._new_sizetimes = self._new_sizetimes, set()
+            return [x for x in new_sizetimes 
+                    if x != (LocalState.DEFAULT_DIRECTORY_VALUE, LocalState.DEFAULT_DIRECTORY_VALUE) 
+                    and len(self.sizetimes.get_by_value(x)) > 1]
+    
+    def has_resident_hash(self, key:str) -> bool:
+        """
+        Returns ``True`` if the hash value of the ``key`` relative path is known and 
+        kept in memory, so that :py:meth:`get_hash` returns it without any I/O.
+        """
+        with self.lock:
+            return not self.hashes.is_evicted(key) and self.hashes.get(key) is not None
+    
+    def get_inode(self, key:str):
+        """
+        Returns the couple ``(st_dev, st_ino)`` identifying the file or folder 
+        at the ``key`` relative path, as it was when its size and modification time
+        were last taken, or ``None`` if unknown. The value is never computed, so it
+        is still available after the file has been deleted or moved away, until the
+        path is deleted from the local state (by :py:meth:`delete`, or when a lookup
+        detects that the path does not exist anymore and no deletion of it is pending,
+        see :py:attr:`is_pending_deletion`).
+        """
+        with self.lock:
+            return self.inodes[key]
+    
+    def get_files_by_inode(self, inode_key) -> set:
+        """
+        Returns a set of every file or directory paths for which the 
+        couple ``(st_dev, st_ino)`` value corresponds to the ``inode_key`` 
+        parameter (several paths means that they are hard links of the same file).
+        """
+        with self.lock:
+            file_paths = self.inodes.get_by_value(inode_key)
+            return self._check_for_deleted_paths(file_paths)
     
     def _check_for_deleted_paths(self, paths:set):
         deleted_paths = [x for x in paths if not os.path.exists(self.absolute_local_path(x))]
         for dp in deleted_paths:
-            self.hashes.delete(dp)
-            self.sizetimes.delete(dp)
+            # the values of a pending deletion are still needed (for example, to pair it 
+            # with a `Created` event of the same inode), and deleted with its event
+            if self.is_pending_deletion is None or not self.is_pending_deletion(dp):
+                self.delete(dp)
         return paths - set(deleted_paths)
     
     def save(self, key:str, file_hash, file_size, file_mtime):
@@ -435,12 +1741,48 @@ class LocalState():
         :returns: 
             ``None``
         """
-        if os.path.isdir(self.absolute_local_path(key)):
+        try:
+            file_stat = os.stat(self.absolute_local_path(key))
+        except OSError:
+            file_stat = None
+        is_dir = file_stat is not None and stat.S_ISDIR(file_stat.st_mode)
+        inode = (file_stat.st_dev, file_stat.st_ino) if file_stat is not None else None
+        self._save_values(key, file_hash, file_size, file_mtime, is_dir, inode)
+    
+    def _save_values(self, key:str, file_hash, file_size, file_mtime, is_dir:bool, inode:tuple):
+        if is_dir:
             file_hash = LocalState.DEFAULT_DIRECTORY_VALUE
             file_size = LocalState.DEFAULT_DIRECTORY_VALUE
             file_mtime = LocalState.DEFAULT_DIRECTORY_VALUE
-        self.hashes[key] = file_hash
-        self.sizetimes[key] = (file_size, file_mtime)
+        with self.lock:
+            if inode is not None:
+                self.inodes[key] = inode
+            self._save_hash(key, file_hash, is_dir)
+            self._save_sizetime(key, (file_size, file_mtime))
+    
+    def save_sizetime(self, key:str, file_size, file_mtime):
+        """
+        Same as :py:meth:`save`, for a file whose hash value is not known yet, 
+        so that it is not computed until needed: the file stays referenced in 
+        :py:attr:`hashes`, with a ``None`` hash value, which is computed by the next 
+        call to :py:meth:`get_hash`, or when looking for a file having the same 
+        sizetime key with :py:meth:`get_files_by_hash_key` (so that a modified 
+        file is still found as the source of its copies).
+        """
+        try:
+            file_stat = os.stat(self.absolute_local_path(key))
+        except OSError:
+            file_stat = None
+        with self.lock:
+            if file_stat is not None:
+                self.inodes[key] = (file_stat.st_dev, file_stat.st_ino)
+            self.hashes[key] = None
+            # still a child of its directory, whose fingerprint is unknown until hashed again
+            self.fingerprints.add(key)
+            self._fresh_signatures.pop(key, None)
+            self.hash_signatures.pop(key, None)
+            self.sample_digests.pop(key, None)
+            self._save_sizetime(key, (file_size, file_mtime))
     
     def delete(self, delete_key:str):
         """
@@ -449,8 +1791,19 @@ class LocalState():
         by an external objects, that do not need to keep track of 
         this path anymore.
         """
-        self.hashes.delete(delete_key)
-        self.sizetimes.delete(delete_key)
+        with self.lock:
+            self.hashes.delete(delete_key)
+            self.sizetimes.delete(delete_key)
+            self.inodes.delete(delete_key)
+            self.fingerprints.delete(delete_key)
+            self.hash_signatures.delete(delete_key)
+            self.sample_digests.delete(delete_key)
+            self._fresh_signatures.delete(delete_key)
+            self._fresh_block_digests.delete(delete_key)
+            if self.hash_checkpoints:
+                self.hash_checkpoints.delete(delete_key)
+            if self.block_digests:
+                self.block_digests.delete(delete_key)
     
     def move(self, src_key:str, dst_key:str):
         """
@@ -459,8 +1812,108 @@ class LocalState():
         and that you want to keep the already computed values in 
         reference, without recomputing them all.
         """
-        self.hashes.move(src_key, dst_key)
-        self.sizetimes.move(src_key, dst_key)
+        with self.lock:
+            self.hashes.move(src_key, dst_key)
+            self.sizetimes.move(src_key, dst_key)
+            self.inodes.move(src_key, dst_key)
+            self.fingerprints.move(src_key, dst_key)
+            self.hash_signatures.move(src_key, dst_key)
+            self.sample_digests.move(src_key, dst_key)
+            self._fresh_signatures.move(src_key, dst_key)
+            self._fresh_block_digests.move(src_key, dst_key)
+            if self.hash_checkpoints:
+                self.hash_checkpoints.move(src_key, dst_key)
+            if self.block_digests:
+                self.block_digests.move(src_key, dst_key)
+
+    def get_tree_values(self, key:str) -> list:
+        """
+        Returns the list of the known ``(key, file_hash, file_size, file_mtime)`` values 
+        of the ``key`` relative path and of every path under it (hash values are never
+        computed, so they may be ``None``). These values can be saved into another 
+        local state with :py:meth:`save`, without hashing the files again.
+        """
+        prefix = key if key.endswith('/') else key + '/'
+        with self.lock:
+            keys = [x for x in self.sizetimes.keys() if x == key or x.startswith(prefix)]
+            return [(x, self.hashes[x]) + tuple(self.sizetimes[x]) for x in keys]
+
+    def get_fingerprint(self, key:str) -> str:
+        """
+        Returns the Merkle-style fingerprint of the directory at the ``key`` 
+        relative path (see :py:class:`DirectoryFingerprints`), or ``None`` if 
+        the directory is unknown, or if any of its children is not hashed yet.
+        """
+        with self.lock:
+            return self.fingerprints.get(key)
+
+    def get_dirs_by_fingerprint(self, fingerprint:str) -> set:
+        """
+        Returns a set of every directory paths for which the fingerprint 
+        corresponds to the ``fingerprint`` parameter. Two directories with the same 
+        fingerprint contain the same files and sub-directories, with the same contents.
+        """
+        with self.lock:
+            dir_paths = self.fingerprints.get_by_fingerprint(fingerprint)
+            return self._check_for_deleted_paths(dir_paths)
+
+    def get_differences(self) -> list:
+        """
+        Compares the watched directory with the local state, for example after 
+        some events have been lost. Only the types, sizes and modification times 
+        are compared (one ``scandir`` per directory), so no file is hashed.
+
+        :returns:
+            The list of the ``(change, key, is_dir)`` differences, where ``change`` 
+            is ``'deleted'``, ``'created'`` or ``'modified'``. Deleted paths come 
+            first (only the highest ones, since deletions are recursive), then 
+            created and modified paths (parent paths before their children paths).
+        :rtype:
+            list
+        """
+        dir_value = (LocalState.DEFAULT_DIRECTORY_VALUE, LocalState.DEFAULT_DIRECTORY_VALUE)
+        seen_keys = set(['/'])
+        deleted = []
+        others = []
+        for entry in scan_tree(self.absolute_root_folder, exclude=self.exclude_function()):
+            key = self.relative_local_path(entry.path)
+            is_dir = is_dir_entry(entry)
+            with self.lock:
+                sizetime = self.sizetimes[key]
+                known = sizetime is not None or key in self.hashes
+            if not known:
+                others.append(('created', key, is_dir))
+            elif sizetime is not None and is_dir != (sizetime == dir_value):
+                # a file replaced by a directory, or the other way around
+                deleted.append(('deleted', key, not is_dir))
+                others.append(('created', key, is_dir))
+            elif sizetime is not None and not is_dir:
+                try:
+                    file_stat = entry.stat()
+                except OSError:
+                    continue
+                if sizetime != (file_stat.st_size, round(file_stat.st_mtime, 3)):
+                    others.append(('modified', key, False))
+            seen_keys.add(key)
+        with self.lock:
+            known_keys = set(self.sizetimes.keys())
+            known_keys.update(self.hashes.keys())
+            for key in known_keys - seen_keys:
+                deleted.append(('deleted', key, self.sizetimes[key] == dir_value))
+        # only the highest deleted paths are kept, since deletions are recursive
+        deleted_dirs = set(x[1] for x in deleted if x[2])
+        deleted = [x for x in deleted if not self._has_parent_in(x[1], deleted_dirs)]
+        deleted.sort(key=lambda x: x[1], reverse=True)
+        return deleted + others
+
+    @staticmethod
+    def _has_parent_in(key:str, parent_keys:set) -> bool:
+        parent_key = os.path.dirname(key)
+        while parent_key != '/':
+            if parent_key in parent_keys:
+                return True
+            parent_key = os.path.dirname(parent_key)
+        return False
             
     
     
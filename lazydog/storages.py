@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018 Clément Warneys <clement.warneys@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+:module: lazydog.storages
+:synopsis: Storage backends for the indexes of the local state \
+(hash values, sizes and modification times, inodes).
+:author: Clément Warneys <clement.warneys@gmail.com>
+
+By default, the :py:class:`~lazydog.states.LocalState` keeps its indexes in
+memory, using :py:class:`~lazydog.states.DualAccessMemory` objects. This module
+allows to trade memory for I/O, depending on the deployment, by storing them
+elsewhere. Each storage provides the same interface as
+:py:class:`~lazydog.states.DualAccessMemory` (:py:meth:`get`, :py:meth:`get_by_value`,
+:py:meth:`save`, recursive :py:meth:`delete` and :py:meth:`move`, ``key in object``...),
+so they can be used interchangeably:
+
+* :py:class:`DictStorage` keeps the indexes in memory (default behaviour).
+* :py:class:`SQLiteStorage` keeps the indexes in a SQLite database, with one \
+table per index and indexed columns, so that external tools can also read them. \
+Recursive deletions and moves are done with prefix range queries.
+* :py:class:`DbmStorage` keeps the indexes in :py:mod:`dbm` databases (standard \
+library only), for persistence and external read access. It does not reduce the \
+memory use: since :py:mod:`dbm` has no ordered keys, every key and every by-value \
+entry is also kept in memory.
+
+Only :py:class:`SQLiteStorage` trades memory for I/O. In both persistent storages, writes are batched: they are committed every
+``batch_size`` writes, or when calling :py:meth:`~lazydog.states.LocalState.flush`.
+
+How to use it:
+
+.. code-block:: python
+
+    local_states = LocalState('/watched/dir', storage=SQLiteStorage('/var/lib/lazydog/index.db'))
+
+"""
+
+import dbm
+import json
+import sqlite3
+import threading
+
+from lazydog.states import DualAccessMemory, SortedKeyIndex
+
+
+class DictStorage():
+    """
+    In-memory storage, each index being a :py:class:`~lazydog.states.DualAccessMemory`.
+    This is the default storage of the :py:class:`~lazydog.states.LocalState`.
+    """
+
+    def open_memory(self, name:str, columns:tuple=('value',)) -> DualAccessMemory:
+        """
+        Returns a new dual-access dictionary for the index called ``name``.
+        ``columns`` is only useful for other storages.
+        """
+        return DualAccessMemory()
+
+
+class SQLiteStorage():
+    """
+    SQLite storage. Each index is a table of the database, named as the index, with a
+    ``path`` primary key, and one column per value item (for example ``size`` and ``mtime``),
+    which are indexed together.
+
+    :param database_path:
+        Path of the SQLite database file (``':memory:'`` for a temporary one).
+    :type database_path:
+        str
+    :param batch_size:
+        *Optional*. Number of writes after which the current transaction is committed.
+    :type batch_size:
+        int
+    """
+
+    def __init__(self, database_path:str, batch_size:int=1000):
+        self.connection = sqlite3.connect(database_path, check_same_thread=False)
+        self.batch_size = batch_size
+        self._pending_writes = 0
+        self._lock = threading.RLock()
+
+    def open_memory(self, name:str, columns:tuple=('value',)):
+        """
+        Returns a :py:class:`SQLiteDualAccessMemory` for the index called ``name``,
+        whose values have as many items as ``columns``.
+        """
+        return SQLiteDualAccessMemory(self, name, columns)
+
+    def execute(self, sql:str, parameters:tuple=()) -> list:
+        """Executes a read query and returns all the resulting rows."""
+        with self._lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def write(self, sql:str, parameters:tuple=()):
+        """Executes a write query, which is committed with the next batch."""
+        with self._lock:
+            self.connection.execute(sql, parameters)
+            self._pending_writes += 1
+            if self._pending_writes >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """Commits the pending writes."""
+        with self._lock:
+            self.connection.commit()
+            self._pending_writes = 0
+
+    def close(self):
+        """Commits the pending writes and closes the database."""
+        with self._lock:
+            self.flush()
+            self.connection.close()
+
+
+class SQLiteDualAccessMemory():
+    """
+    Same interface as :py:class:`~lazydog.states.DualAccessMemory`, backed by a table
+    of a :py:class:`SQLiteStorage` database. Values are single values if there is only
+    one column, else tuples.
+    """
+
+    def __init__(self, storage:SQLiteStorage, table:str, columns:tuple=('value',)):
+        self.storage = storage
+        self.table = table
+        self.columns = tuple(columns)
+        self._columns_sql = ', '.join(self.columns)
+        self.storage.write('CREATE TABLE IF NOT EXISTS %s (path TEXT PRIMARY KEY, %s)' % (table, self._columns_sql))
+        self.storage.write('CREATE INDEX IF NOT EXISTS %s_by_value ON %s (%s)' % (table, table, self._columns_sql))
+        self.storage.flush()
+
+    def _to_row(self, value) -> tuple:
+        return tuple(value) if len(self.columns) > 1 else (value,)
+
+    def _from_row(self, row:tuple):
+        return tuple(row) if len(self.columns) > 1 else row[0]
+
+    @staticmethod
+    def _prefix_range(key:str) -> tuple:
+        # every path starting with 'key/' is between 'key/' and 'key0'
+        complete_key = key if key.endswith('/') else key + '/'
+        return complete_key, complete_key[:-1] + '0'
+
+    def get(self, key):
+        rows = self.storage.execute('SELECT %s FROM %s WHERE path = ?' % (self._columns_sql, self.table), (key,))
+        return self._from_row(rows[0]) if rows else None
+
+    def get_by_value(self, value) -> set:
+        conditions = []
+        parameters = []
+        for column, item in zip(self.columns, self._to_row(value)):
+            if item is None:
+                conditions.append(column + ' IS NULL')
+            else:
+                conditions.append(column + ' = ?')
+                parameters.append(item)
+        rows = self.storage.execute('SELECT path FROM %s WHERE %s' % (self.table, ' AND '.join(conditions)), tuple(parameters))
+        return set(row[0] for row in rows)
+
+    def get_shared_values(self) -> list:
+        rows = self.storage.execute('SELECT %s FROM %s GROUP BY %s HAVING COUNT(*) > 1' 
+                                    % (self._columns_sql, self.table, self._columns_sql))
+        return [self._from_row(row) for row in rows]
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __setitem__(self, key, value):
+        return self.save(key, value)
+
+    def __contains__(self, key):
+        return len(self.storage.execute('SELECT 1 FROM %s WHERE path = ?' % self.table, (key,))) > 0
+
+    def keys(self) -> list:
+        return [row[0] for row in self.storage.execute('SELECT path FROM %s' % self.table)]
+
+    def is_evicted(self, key) -> bool:
+        return False
+
+    def save(self, key:str, value):
+        self.storage.write('INSERT OR REPLACE INTO %s (path, %s) VALUES (?, %s)' % (
+            self.table, self._columns_sql, ', '.join('?' * len(self.columns))), (key,) + self._to_row(value))
+
+    def delete(self, delete_key:str):
+        self.storage.write('DELETE FROM %s WHERE path = ? OR (path >= ? AND path < ?)' % self.table,
+                           (delete_key,) + self._prefix_range(delete_key))
+
+    def move(self, src_key:str, dst_key:str):
+        # existing destination paths are replaced
+        self.storage.write('UPDATE OR REPLACE %s SET path = ? || substr(path, ?) WHERE path = ? OR (path >= ? AND path < ?)' % self.table,
+                           (dst_key, len(src_key) + 1, src_key) + self._prefix_range(src_key))
+
+    def flush(self):
+        self.storage.flush()
+
+
+class DbmStorage():
+    """
+    :py:mod:`dbm` storage. Each index is kept in two :py:mod:`dbm` databases, named
+    after ``database_path`` and the index name: one for the values, and one with an
+    entry per value and key (to preserve the :py:meth:`get_by_value` access).
+
+    This storage is meant for persistence and external read access, not for reducing
+    the memory use: the keys and the by-value entries are also kept in memory (see
+    :py:class:`DbmDualAccessMemory`). Use :py:class:`SQLiteStorage` for that.
+
+    :param database_path:
+        Prefix of the path of the :py:mod:`dbm` database files.
+    :type database_path:
+        str
+    :param batch_size:
+        *Optional*. Number of writes kept in memory before writing them in the databases.
+    :type batch_size:
+        int
+    """
+
+    def __init__(self, database_path:str, batch_size:int=1000):
+        self.database_path = database_path
+        self.batch_size = batch_size
+
+    def open_memory(self, name:str, columns:tuple=('value',)):
+        """
+        Returns a :py:class:`DbmDualAccessMemory` for the index called ``name``.
+        ``columns`` is not used.
+        """
+        return DbmDualAccessMemory(self.database_path + '-' + name, self.batch_size)
+
+
+_DELETED = object()
+
+
+class DbmDualAccessMemory():
+    """
+    Same interface as :py:class:`~lazydog.states.DualAccessMemory`, backed by
+    :py:mod:`dbm` databases. Values are serialized in JSON. The by-value database
+    has one entry per key, named after the value and the key (``value\\0key``), so
+    that a write only adds or deletes single entries. Writes are kept in a
+    write-back cache, and written in the databases every ``batch_size`` writes, or
+    when calling :py:meth:`flush`.
+
+    .. note: :py:mod:`dbm` does not support range queries, so every key and every
+        by-value entry is also kept in memory, in a
+        :py:class:`~lazydog.states.SortedKeyIndex`: recursive deletions and moves only
+        browse the range of the keys starting with the moved or deleted path,
+        :py:meth:`get_by_value` only browses the range of the entries starting with
+        the value, and ``key in object`` does not read the databases. The memory use
+        is therefore of the same order as a :py:class:`~lazydog.states.DualAccessMemory`:
+        these databases are meant for persistence and external read access only.
+
+    Every access holds a lock, since the indexer and hashing threads read the
+    memories of the local state without holding its lock.
+    """
+
+    def __init__(self, database_path:str, batch_size:int=1000):
+        self._memories = dbm.open(database_path, 'c')
+        self._dual_memories = dbm.open(database_path + '-by-value', 'c')
+        self.batch_size = batch_size
+        self._pending_writes = 0
+        self._lock = threading.RLock()
+
+        # write-back caches
+        self._memories_cache = {}
+        self._dirty_dual_keys = set()
+
+        # resident indexes of the keys and of the by-value entries
+        self._keys = SortedKeyIndex((self._decode_key(k) for k in self._memories.keys()), batch_size)
+        self._dual_keys = SortedKeyIndex((self._decode_key(k) for k in self._dual_memories.keys()), batch_size)
+
+    @staticmethod
+    def _encode_key(key:str) -> bytes:
+        return key.encode('utf-8', 'surrogateescape')
+
+    @staticmethod
+    def _decode_key(encoded_key:bytes) -> str:
+        return encoded_key.decode('utf-8', 'surrogateescape')
+
+    @staticmethod
+    def _encode_value(value) -> str:
+        # JSON escapes the control characters, so the encoded value never contains '\0'
+        return json.dumps(value)
+
+    @staticmethod
+    def _decode_value(encoded_value:str):
+        value = json.loads(encoded_value)
+        return tuple(value) if isinstance(value, list) else value
+
+    def _lookup(self, key:str) -> str:
+        # returns the encoded value, or None if the key is unknown
+        encoded_value = self._memories_cache.get(key)
+        if encoded_value is None:
+            data = self._memories.get(self._encode_key(key))
+            encoded_value = data.decode('utf-8') if data is not None else None
+        return None if encoded_value is _DELETED else encoded_value
+
+    def get(self, key):
+        with self._lock:
+            encoded_value = self._lookup(key)
+        return self._decode_value(encoded_value) if encoded_value is not None else None
+
+    def get_by_value(self, value) -> set:
+        # every entry of the value is between 'value\0' and 'value\1'
+        encoded_value = self._encode_value(value)
+        prefix_len = len(encoded_value) + 1
+        with self._lock:
+            dual_keys = self._dual_keys.get_range(encoded_value + '\0', encoded_value + '\1')
+        return set(k[prefix_len:] for k in dual_keys)
+
+    def get_shared_values(self) -> list:
+        # the entries of a same value are consecutive
+        shared_values = []
+        previous_value = None
+        with self._lock:
+            dual_keys = self._dual_keys.get_range()
+        for dual_key in dual_keys:
+            encoded_value = dual_key.split('\0', 1)[0]
+            if encoded_value == previous_value and (not shared_values or shared_values[-1] != encoded_value):
+                shared_values.append(encoded_value)
+            previous_value = encoded_value
+        return [self._decode_value(x) for x in shared_values]
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __setitem__(self, key, value):
+        return self.save(key, value)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._keys
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._keys)
+
+    def is_evicted(self, key) -> bool:
+        return False
+
+    def _remove_dual(self, key:str, encoded_value:str):
+        if encoded_value is not None:
+            dual_key = encoded_value + '\0' + key
+            self._dual_keys.discard(dual_key)
+            self._dirty_dual_keys.add(dual_key)
+
+    def _remove(self, key:str):
+        if key in self._keys:
+            self._remove_dual(key, self._lookup(key))
+            self._memories_cache[key] = _DELETED
+            self._keys.discard(key)
+
+    def _get_children(self, key:str) -> list:
+        with self._lock:
+            children = self._keys.get_children(key)
+            if key in self._keys:
+                children.append(key)
+            return children
+
+    def save(self, key:str, value):
+        encoded_value = self._encode_value(value)
+        with self._lock:
+            previous_encoded_value = self._lookup(key)
+            if encoded_value != previous_encoded_value:
+                self._remove_dual(key, previous_encoded_value)
+                dual_key = encoded_value + '\0' + key
+                self._dual_keys.add(dual_key)
+                self._dirty_dual_keys.add(dual_key)
+            self._memories_cache[key] = encoded_value
+            self._keys.add(key)
+            self._written()
+
+    def delete(self, delete_key:str):
+        with self._lock:
+            for key in self._get_children(delete_key):
+                self._remove(key)
+            self._written()
+
+    def move(self, src_key:str, dst_key:str):
+        with self._lock:
+            for old_key in self._get_children(src_key):
+                value = self.get(old_key)
+                self._remove(old_key)
+                self.save(old_key.replace(src_key, dst_key, 1), value)
+
+    def _written(self):
+        self._pending_writes += 1
+        if self._pending_writes >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the cached writes in the databases."""
+        with self._lock:
+            if not self._memories_cache and not self._dirty_dual_keys:
+                return
+            for key, encoded_value in self._memories_cache.items():
+                encoded_key = self._encode_key(key)
+                if encoded_value is not _DELETED:
+                    self._memories[encoded_key] = encoded_value.encode('utf-8')
+                elif encoded_key in self._memories:
+                    del self._memories[encoded_key]
+            for dual_key in self._dirty_dual_keys:
+                encoded_dual_key = self._encode_key(dual_key)
+                if dual_key in self._dual_keys:
+                    self._dual_memories[encoded_dual_key] = b''
+                elif encoded_dual_key in self._dual_memories:
+                    del self._dual_memories[encoded_dual_key]
+            self._memories_cache.clear()
+            self._dirty_dual_keys.clear()
+            self._pending_writes = 0
+            for database in [self._memories, self._dual_memories]:
+                if hasattr(database, 'sync'):
+                    database.sync()
+
+    def close(self):
+        """Writes the cached writes and closes the databases."""
+        with self._lock:
+            self.flush()
+            self._memories.close()
+            self._dual_memories.close()
@@ -0,0 +1,98 @@
+
+import sys
+import os
+import hashlib
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from dropbox_content_hasher import default_hash_function, resumable_hash_function, DropboxContentHasher
+from dropbox_content_hasher import hash_with_stat, stat_signature
+
+def test_io_friendly_hashing(tmpdir):
+    file_path = str(tmpdir) + '/file.bin'
+    with open(file_path, 'wb') as f:
+        f.write(os.urandom(DropboxContentHasher.BLOCK_SIZE * 2 + 1000))
+    assert default_hash_function(file_path, io_friendly=True) == default_hash_function(file_path)
+    assert default_hash_function(str(tmpdir), io_friendly=True) == 'DIR'
+    assert default_hash_function(str(tmpdir) + '/nothing', io_friendly=True) is None
+
+def test_resumable_hashing(tmpdir):
+    file_path = str(tmpdir) + '/file.log'
+    with open(file_path, 'wb') as f:
+        f.write(os.urandom(DropboxContentHasher.BLOCK_SIZE + 1000))
+    file_hash, checkpoint = resumable_hash_function(file_path)
+    assert file_hash == default_hash_function(file_path)
+    assert checkpoint.offset == DropboxContentHasher.BLOCK_SIZE + 1000 and checkpoint.resumed_from == 0
+    # appended: only the new bytes are hashed
+    with open(file_path, 'ab') as f:
+        f.write(os.urandom(DropboxContentHasher.BLOCK_SIZE))
+    file_hash, new_checkpoint = resumable_hash_function(file_path, checkpoint)
+    assert file_hash == default_hash_function(file_path)
+    assert new_checkpoint.resumed_from == checkpoint.offset
+    # the checkpoint can be used again
+    file_hash, _ = resumable_hash_function(file_path, checkpoint)
+    assert file_hash == default_hash_function(file_path)
+    # modified prefix: hashed from the beginning
+    with open(file_path, 'r+b') as f:
+        f.write(b'modified')
+    file_hash, checkpoint = resumable_hash_function(file_path, new_checkpoint)
+    assert file_hash == default_hash_function(file_path)
+    assert checkpoint.resumed_from == 0
+    # truncated: hashed from the beginning
+    with open(file_path, 'r+b') as f:
+        f.truncate(100)
+    file_hash, checkpoint = resumable_hash_function(file_path, checkpoint)
+    assert file_hash == default_hash_function(file_path)
+    assert checkpoint.resumed_from == 0
+    assert resumable_hash_function(str(tmpdir)) == ('DIR', None)
+    assert resumable_hash_function(str(tmpdir) + '/nothing') == (None, None)
+
+def test_block_digests(tmpdir):
+    file_path = str(tmpdir) + '/file.bin'
+    with open(file_path, 'wb') as f:
+        f.write(os.urandom(DropboxContentHasher.BLOCK_SIZE * 2 + 1000))
+    block_digests = []
+    file_hash = default_hash_function(file_path, block_digests=block_digests)
+    assert len(block_digests) == 3
+    assert file_hash == hashlib.sha256(b''.join(block_digests)).hexdigest()
+    resumed_digests = []
+    file_hash, checkpoint = resumable_hash_function(file_path, block_digests=resumed_digests)
+    assert resumed_digests == block_digests
+    with open(file_path, 'ab') as f:
+        f.write(os.urandom(DropboxContentHasher.BLOCK_SIZE))
+    resumed_digests = []
+    file_hash, checkpoint = resumable_hash_function(file_path, checkpoint, block_digests=resumed_digests)
+    assert checkpoint.resumed_from > 0
+    assert resumed_digests[:2] == block_digests[:2] and len(resumed_digests) == 4
+    assert file_hash == default_hash_function(file_path)
+
+def test_hash_with_stat(tmpdir):
+    file_path = str(tmpdir) + '/file.txt'
+    with open(file_path, 'w') as f:
+        f.write('content')
+    os.utime(file_path, (1000000000, 1000000000))
+    result = hash_with_stat(default_hash_function, file_path)
+    assert result.hash == default_hash_function(file_path)
+    assert result.is_stable and not result.is_racy
+    assert result.signature == stat_signature(file_path) == (7, 1000000000 * 10**9, os.stat(file_path).st_ino, 
+                                                                os.stat(file_path).st_ctime_ns)
+    # file modified while hashing: hashed again
+    calls = []
+    def appending_hash_function(absolute_path:str):
+        calls.append(absolute_path)
+        if len(calls) == 1:
+            with open(absolute_path, 'a') as f:
+                f.write(' appended')
+        return default_hash_function(absolute_path)
+    result = hash_with_stat(appending_hash_function, file_path)
+    assert len(calls) == 2
+    assert result.is_stable and result.is_racy
+    assert result.hash == default_hash_function(file_path)
+    # always modified: unstable
+    def always_appending_hash_function(absolute_path:str):
+        with open(absolute_path, 'a') as f:
+            f.write(' appended')
+        return default_hash_function(absolute_path)
+    result = hash_with_stat(always_appending_hash_function, file_path, retries=1)
+    assert not result.is_stable and result.signature is None
+    result = hash_with_stat(default_hash_function, str(tmpdir) + '/nothing')
+    assert result.hash is None and not result.is_stable
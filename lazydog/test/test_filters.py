@@ -0,0 +1,38 @@
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from filters import PathFilter
+
+def test_PF_patterns():
+    path_filter = PathFilter(['# comment', '', 'node_modules/', '/build/', '*.pyc', '!keep.pyc', 'docs/**/*.tmp', 'a?c.log', 'v[0-9].txt'])
+    assert path_filter.patterns == ['node_modules/', '/build/', '*.pyc', '!keep.pyc', 'docs/**/*.tmp', 'a?c.log', 'v[0-9].txt']
+    # directory only patterns, anchored or not
+    assert path_filter.is_excluded('/node_modules', is_dir=True)
+    assert path_filter.is_excluded('/dir1/node_modules', is_dir=True)
+    assert not path_filter.is_excluded('/node_modules', is_dir=False)
+    assert path_filter.is_excluded('/build', is_dir=True)
+    assert not path_filter.is_excluded('/dir1/build', is_dir=True)
+    # the content of an excluded directory is excluded
+    assert path_filter.is_excluded('/dir1/node_modules/lib/index.js')
+    assert path_filter.is_excluded('/build/keep.pyc')
+    # the last matching pattern decides
+    assert path_filter.is_excluded('/dir1/file.pyc')
+    assert not path_filter.is_excluded('/dir1/keep.pyc')
+    assert path_filter.is_excluded('/docs/file.tmp') and path_filter.is_excluded('/docs/a/b/file.tmp')
+    assert not path_filter.is_excluded('/other/docs/file.tmp')
+    assert path_filter.is_excluded('/abc.log') and not path_filter.is_excluded('/ac.log')
+    assert path_filter.is_excluded('/v1.txt') and not path_filter.is_excluded('/vx.txt')
+    assert not path_filter.is_excluded('/') and not path_filter.is_excluded('/dir1', is_dir=True)
+    assert not PathFilter([]).is_excluded('/file.pyc')
+
+def test_PF_pruned(tmpdir):
+    with open(str(tmpdir) + '/.gitignore', 'w') as f:
+        f.write('.git/\n*.swp\n')
+    path_filter = PathFilter.from_file(str(tmpdir) + '/.gitignore')
+    assert path_filter.is_excluded('/.git', is_dir=True, site='watches')
+    assert path_filter.is_excluded('/.git/HEAD', site='events')
+    assert path_filter.is_excluded('/file.swp', site='events')
+    assert not path_filter.is_excluded('/file.txt', site='events')
+    assert path_filter.pruned == {'watches': 1, 'events': 2}
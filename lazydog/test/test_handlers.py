@@ -8,7 +8,20 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from events import LazydogEvent
 from states import LocalState
-from handlers import HighlevelEventHandler
+from handlers import HighlevelEventHandler, FusedEventHandler, MovePairing
+from queues import DatedlocaleventQueue
+from revised_watchdog.events import OverflowEvent
+from filters import PathFilter
+from revised_watchdog.observers.inotify_c import CLOSE_WRITE_EVENTS, InotifyEvent, InotifyConstants
+
+from watchdog.events import (
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent,
+    DirCreatedEvent,
+    DirDeletedEvent
+    )
 
 
 
@@ -429,6 +442,309 @@ def test_H_complex_4c():
     assert check_local_state()
 
 
+# folder copies found by fingerprint, only from entirely referenced sources
+def test_H_copied_folder_sources(tmpdir):
+    copy_dir = str(tmpdir)
+    for name in ['/src', '/new', '/copy']:
+        os.mkdir(copy_dir + name)
+    for name in ['/src/a.txt', '/src/b.txt', '/new/b.txt', '/copy/a.txt', '/copy/b.txt']:
+        with open(copy_dir + name, 'w') as f:
+            f.write(os.path.basename(name))
+    local_states = LocalState(copy_dir)
+    handler = HighlevelEventHandler(DatedlocaleventQueue(local_states), local_states)
+    assert handler._get_copied_folder_sources('/copy') == set(['/src'])
+    assert handler._get_copied_folder_sources('/new') == set()
+    # hash value of a source file forgotten
+    local_states.save_sizetime('/src/a.txt', 1, local_states.get_sizetime('/src/a.txt')[1])
+    assert handler._get_copied_folder_sources('/new') == set()
+    # source file not referenced at all
+    local_states.delete('/src/a.txt')
+    assert local_states.get_dirs_by_fingerprint(local_states.get_fingerprint('/new')) == set(['/src', '/new'])
+    assert handler._get_copied_folder_sources('/new') == set()
+
+
+# copy of a file modified since its hash value was saved
+def test_H_copy_after_modify(tmpdir):
+    modified_dir = str(tmpdir)
+    with open(modified_dir + '/f.txt', 'w') as f:
+        f.write('before')
+    local_states = LocalState(modified_dir)
+    handler = HighlevelEventHandler(DatedlocaleventQueue(local_states), local_states)
+    with open(modified_dir + '/f.txt', 'w') as f:
+        f.write('after modification')
+    event = LazydogEvent(FileModifiedEvent(modified_dir + '/f.txt'), local_states)
+    assert handler._is_really_modified(event) and not event.is_hashed
+    handler._update_local_state(event)
+    # still referenced, its hash value being computed when needed
+    assert '/f.txt' in local_states.hashes
+    assert local_states.get_hash('/f.txt', compute_if_none=False) is None
+    shutil.copy2(modified_dir + '/f.txt', modified_dir + '/g.txt')
+    handler.posttreat_lowlevel_event(LazydogEvent(FileCreatedEvent(modified_dir + '/g.txt'), local_states))
+    assert [(e.type, e.path, e.to_path) for e in handler.events_list] == [('copied', '/f.txt', '/g.txt')]
+    assert local_states.get_hash('/f.txt', compute_if_none=False) == local_states.get_hash('/g.txt')
+
+
+# split move: deleted then created events of the same inode, in both orders
+def test_H_complex_5(tmpdir):
+    split_dir = str(tmpdir)
+    os.mkdir(split_dir + '/d')
+    with open(split_dir + '/d/f.txt', 'w') as f:
+        f.write('split move')
+    local_states = LocalState(split_dir)
+    handler = HighlevelEventHandler(DatedlocaleventQueue(local_states), local_states)
+    # file, deleted event first
+    os.rename(split_dir + '/d/f.txt', split_dir + '/f.txt')
+    handler.posttreat_lowlevel_event(LazydogEvent(FileDeletedEvent(split_dir + '/d/f.txt'), local_states))
+    handler.posttreat_lowlevel_event(LazydogEvent(FileCreatedEvent(split_dir + '/f.txt'), local_states))
+    assert len(handler.events_list) == 1
+    e = handler.events_list[0]
+    assert e.is_moved_event()
+    assert e.path == '/d/f.txt'
+    assert e.to_path == '/f.txt'
+    assert local_states.get_inode('/f.txt') == e.file_id
+    handler.events_list.clear()
+    # directory, created event first, then simulated content
+    os.rename(split_dir + '/f.txt', split_dir + '/d/f.txt')
+    local_states.move('/f.txt', '/d/f.txt')
+    os.rename(split_dir + '/d', split_dir + '/e')
+    handler.posttreat_lowlevel_event(LazydogEvent(DirCreatedEvent(split_dir + '/e'), local_states))
+    handler.posttreat_lowlevel_event(LazydogEvent(DirDeletedEvent(split_dir + '/d'), local_states))
+    handler.posttreat_lowlevel_event(LazydogEvent(FileCreatedEvent(split_dir + '/e/f.txt'), local_states))
+    assert len(handler.events_list) == 1
+    e = handler.events_list[0]
+    assert e.is_dir_moved_event()
+    assert e.path == '/d'
+    assert e.to_path == '/e'
+    assert local_states.get_hash('/e/f.txt', compute_if_none=False) is not None
+    # hard link is not a copy
+    handler.events_list.clear()
+    os.link(split_dir + '/e/f.txt', split_dir + '/link.txt')
+    handler.posttreat_lowlevel_event(LazydogEvent(FileCreatedEvent(split_dir + '/link.txt'), local_states))
+    assert len(handler.events_list) == 1
+    assert handler.events_list[0].is_file_created_event()
+
+# split move: a lookup between both events does not forget the deleted path
+def test_H_split_move_lookup(tmpdir):
+    split_dir = str(tmpdir)
+    os.mkdir(split_dir + '/d')
+    with open(split_dir + '/d/f.txt', 'w') as f:
+        f.write('split move')
+    local_states = LocalState(split_dir)
+    handler = HighlevelEventHandler(DatedlocaleventQueue(local_states), local_states)
+    inode = local_states.get_inode('/d/f.txt')
+    os.rename(split_dir + '/d/f.txt', split_dir + '/f.txt')
+    handler.posttreat_lowlevel_event(LazydogEvent(FileDeletedEvent(split_dir + '/d/f.txt'), local_states))
+    assert local_states.get_files_by_inode(inode) == set()
+    assert local_states.get_inode('/d/f.txt') == inode
+    handler.posttreat_lowlevel_event(LazydogEvent(FileCreatedEvent(split_dir + '/f.txt'), local_states))
+    assert [(e.type, e.path, e.to_path) for e in handler.events_list] == [('moved', '/d/f.txt', '/f.txt')]
+    # without pending deletion, the path is forgotten
+    os.remove(split_dir + '/f.txt')
+    assert local_states.get_files_by_inode(inode) == set()
+    assert local_states.get_inode('/f.txt') is None
+
+def test_H_complex_6(tmpdir):
+    tiers_dir = str(tmpdir)
+    with open(tiers_dir + '/big.bin', 'wb') as f:
+        f.write(b'a' * 1024 * 1024)
+    os.utime(tiers_dir + '/big.bin', (1000000000, 1000000000))
+    local_states = LocalState(tiers_dir)
+    handler = HighlevelEventHandler(DatedlocaleventQueue(local_states), local_states)
+    modified = lambda: LazydogEvent(FileModifiedEvent(tiers_dir + '/big.bin'), local_states)
+    # unchanged since hashed
+    e = modified()
+    assert not handler._is_really_modified(e) and not e.is_hashed
+    assert handler.verification_counters == {'stat': 1, 'sample': 0, 'hash': 0}
+    # same size and time, but different samples (saved with the hash value)
+    with open(tiers_dir + '/big.bin', 'r+b') as f:
+        f.write(b'b')
+    os.utime(tiers_dir + '/big.bin', (1000000000, 1000000000))
+    e = modified()
+    assert handler._is_really_modified(e) and not e.is_hashed
+    assert handler.verification_counters == {'stat': 1, 'sample': 1, 'hash': 0}
+    # saved without reading the whole file
+    handler._update_local_state(e)
+    assert local_states.get_hash('/big.bin', compute_if_none=False) is None
+    # new size
+    with open(tiers_dir + '/big.bin', 'ab') as f:
+        f.write(b'c')
+    e = modified()
+    assert handler._is_really_modified(e) and not e.is_hashed
+    assert handler.verification_counters == {'stat': 2, 'sample': 1, 'hash': 0}
+    handler._update_local_state(e)
+    # just modified (no signature nor samples), same size and time: only the full hash value can tell
+    local_states.get_hash('/big.bin')
+    e = modified()
+    assert not handler._is_really_modified(e) and e.is_hashed
+    assert handler.verification_counters == {'stat': 2, 'sample': 1, 'hash': 1}
+
+# lost low-level events: the differences are found by a rescan
+def test_H_complex_7(tmpdir):
+    rescan_dir = str(tmpdir)
+    os.mkdir(rescan_dir + '/d')
+    for name in ['/kept.txt', '/changed.txt', '/d/deleted.txt']:
+        with open(rescan_dir + name, 'w') as f:
+            f.write(name)
+    local_states = LocalState(rescan_dir)
+    queue = DatedlocaleventQueue(local_states)
+    handler = HighlevelEventHandler(queue, local_states)
+    shutil.rmtree(rescan_dir + '/d')
+    os.mkdir(rescan_dir + '/new')
+    with open(rescan_dir + '/new/created.txt', 'w') as f:
+        f.write('created')
+    with open(rescan_dir + '/changed.txt', 'a') as f:
+        f.write('changed')
+    queue.dispatch(OverflowEvent(rescan_dir))
+    assert queue.is_empty()
+    assert handler.overflows() == 1
+    assert queue.pop_rescan_request() and not queue.pop_rescan_request()
+    assert handler.rescan() == 4
+    assert handler.rescan_counters == {'rescans': 1, 'differences': 4}
+    events = dict((e.ref_path, e) for e in handler.events_list)
+    assert events['/d'].is_dir_deleted_event()
+    assert events['/new'].is_dir_created_event()
+    assert events['/new/created.txt'].is_file_created_event()
+    assert events['/changed.txt'].is_modified_event()
+    assert len(handler.events_list) == 4
+    # once released, the local state is up to date
+    for e in handler.events_list:
+        handler._update_local_state(e)
+    handler.events_list.clear()
+    assert handler.rescan() == 0
+
+# lost low-level events, while some others are still pending: they are not reported twice
+def test_H_rescan_pending(tmpdir):
+    rescan_dir = str(tmpdir)
+    os.mkdir(rescan_dir + '/d')
+    for name in ['/changed.txt', '/d/deleted.txt', '/lost.txt']:
+        with open(rescan_dir + name, 'w') as f:
+            f.write(name)
+    local_states = LocalState(rescan_dir)
+    queue = DatedlocaleventQueue(local_states)
+    handler = HighlevelEventHandler(queue, local_states)
+    with open(rescan_dir + '/created.txt', 'w') as f:
+        f.write('created')
+    with open(rescan_dir + '/changed.txt', 'a') as f:
+        f.write('changed')
+    shutil.rmtree(rescan_dir + '/d')
+    os.remove(rescan_dir + '/lost.txt')
+    # post-treated, but not released yet
+    queue.dispatch(FileCreatedEvent(rescan_dir + '/created.txt'))
+    queue.dispatch(FileModifiedEvent(rescan_dir + '/changed.txt'))
+    handler._posttreat_queued_events()
+    assert len(handler.events_list) == 2
+    # still queued when the overflow happens
+    queue.dispatch(DirDeletedEvent(rescan_dir + '/d'))
+    queue.dispatch(OverflowEvent(rescan_dir))
+    assert queue.pop_rescan_request()
+    # only the deletion of '/lost.txt' has been lost
+    assert handler.rescan() == 1
+    assert queue.is_empty()
+    events = dict((e.ref_path, e) for e in handler.events_list)
+    assert sorted(events) == ['/changed.txt', '/created.txt', '/d', '/lost.txt']
+    assert events['/created.txt'].is_file_created_event()
+    assert events['/changed.txt'].is_modified_event()
+    assert events['/d'].is_dir_deleted_event() and events['/lost.txt'].is_deleted_event()
+
+# low-level events read and post-treated by the handler thread itself
+def test_H_fused(tmpdir):
+    HighlevelEventHandler.POSTTREATMENT_TIME_LIMIT = datetime.timedelta(seconds=1)
+    HighlevelEventHandler.CREATE_EVENT_TIME_LIMIT_FOR_EMPTY_FILES = datetime.timedelta(seconds=0)
+    fused_dir = str(tmpdir)
+    os.mkdir(fused_dir + '/a')
+    for name in ['/a/f.txt', '/k.txt']:
+        with open(fused_dir + name, 'w') as f:
+            f.write(name)
+    handler = HighlevelEventHandler.get_instance(fused_dir, fused_pipeline=True)
+    assert isinstance(handler, FusedEventHandler)
+    handler.start()
+    try:
+        time.sleep(0.1)
+        shutil.copy2(fused_dir + '/a/f.txt', fused_dir + '/h.txt')
+        os.rename(fused_dir + '/k.txt', fused_dir + '/a/k.txt')
+        events = []
+        duration = time.time()
+        while len(events) < 2 and time.time() - duration < 10:
+            time.sleep(0.1)
+            events.extend(handler.get_available_events())
+        assert handler.get_available_events() == []
+        assert [(e.type, e.path, e.to_path) for e in events] == [
+            ('copied', '/a/f.txt', '/h.txt'), ('moved', '/k.txt', '/a/k.txt')]
+        assert handler.is_idle()
+    finally:
+        handler.stop()
+        handler.join(5)
+    assert not handler.is_alive()
+
+def test_H_move_pairing():
+    moves = MovePairing(0.5)
+    moves.add([InotifyEvent(1, InotifyConstants.IN_CREATE, 0, b'f.txt', b'/w/f.txt'), 
+               InotifyEvent(1, InotifyConstants.IN_MOVED_FROM, 7, b'g.txt', b'/w/g.txt')], 10.0)
+    moves.add([InotifyEvent(1, InotifyConstants.IN_MOVED_TO, 7, b'h.txt', b'/w/h.txt')], 10.2)
+    # every event is held, not only the moves
+    assert moves.ready_events(10.4) == []
+    assert round(moves.next_timeout(10.4), 3) == 0.1
+    assert moves.ready_events(10.5) == [FileCreatedEvent('/w/f.txt')]
+    assert moves.ready_events(10.6) == []
+    assert moves.ready_events(10.8) == [FileMovedEvent('/w/g.txt', '/w/h.txt')]
+    assert moves.is_empty() and moves.next_timeout(10.8) is None
+
+def test_H_path_filter(tmpdir):
+    filtered_dir = str(tmpdir)
+    for name in ['/a', '/node_modules']:
+        os.mkdir(filtered_dir + name)
+    for name in ['/a/f.txt', '/a/f.pyc', '/node_modules/x.js']:
+        with open(filtered_dir + name, 'w') as f:
+            f.write(name)
+    path_filter = PathFilter(['node_modules/', '*.pyc'])
+    handler = HighlevelEventHandler.get_instance(filtered_dir, path_filter=path_filter)
+    handler.start()
+    try:
+        assert handler.local_states.get_sizetime('/a/f.txt', compute_if_none=False) is not None
+        assert handler.local_states.get_sizetime('/a/f.pyc', compute_if_none=False) is None
+        assert handler.local_states.get_sizetime('/node_modules', compute_if_none=False) is None
+        assert path_filter.pruned['watches'] == 1 and path_filter.pruned['indexing'] >= 2
+        for name in ['/a/g.pyc', '/node_modules/y.js', '/a/g.txt']:
+            with open(filtered_dir + name, 'w') as f:
+                f.write(name)
+        # renamed as an excluded file: seen as deleted
+        os.rename(filtered_dir + '/a/f.txt', filtered_dir + '/a/h.pyc')
+        events = []
+        duration = time.time()
+        while len(events) < 2 and time.time() - duration < 10:
+            time.sleep(0.1)
+            events.extend(handler.get_available_events())
+        assert sorted((e.type, e.path) for e in events) == [('created', '/a/g.txt'), ('deleted', '/a/f.txt')]
+        assert path_filter.pruned['events'] >= 1
+    finally:
+        handler.stop()
+        handler.join(5)
+
+def test_H_event_masks(tmpdir):
+    masked_dir = str(tmpdir)
+    os.mkdir(masked_dir + '/logs')
+    with open(masked_dir + '/logs/f.txt', 'w') as f:
+        f.write('a')
+    handler = HighlevelEventHandler.get_instance(masked_dir, fused_pipeline=True, 
+                                                 event_masks={'/logs': CLOSE_WRITE_EVENTS})
+    handler.start()
+    try:
+        time.sleep(0.1)
+        # many writes, a single close
+        with open(masked_dir + '/logs/f.txt', 'a') as f:
+            for i in range(100):
+                f.write('b')
+                f.flush()
+        events = []
+        duration = time.time()
+        while not events and time.time() - duration < 10:
+            time.sleep(0.1)
+            events = handler.get_available_events()
+        assert [(e.type, e.path) for e in events] == [('modified', '/logs/f.txt')]
+    finally:
+        handler.stop()
+        handler.join(5)
+
 
 def test_H_basics_99():
     HANDLER.stop()
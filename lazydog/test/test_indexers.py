@@ -0,0 +1,197 @@
+
+import sys
+import os
+import ctypes
+import platform
+import threading
+import pytest
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from states import LocalState
+from indexers import BackgroundIndexer, SpeculativeHasher, HashingScheduler, lower_io_priority
+
+TEST_DIR = None
+
+def create_dir(dirname:str):
+    os.mkdir(TEST_DIR + dirname)
+
+def create_file(filename:str, content:str=''):
+    with open(TEST_DIR + filename, 'w') as f:
+        f.write(content)
+
+def test_BI_deferred(tmpdir):
+    global TEST_DIR
+    TEST_DIR = str(tmpdir)
+    create_dir('/dir1')
+    create_dir('/dir1/dir2')
+    create_file('/file1.txt', 'a')
+    create_file('/dir1/file2.txt', 'b')
+    create_file('/dir1/dir2/file3.txt', 'c')
+    LS = LocalState(TEST_DIR, defer_indexing=True)
+    assert LS.get_hash('/file1.txt', compute_if_none=False) is None
+    assert LS.get_sizetime('/dir1/file2.txt', compute_if_none=False) is None
+    assert LS.is_ready()
+    assert LS.indexing_progress()['ready']
+
+def test_BI_background():
+    LS = LocalState(TEST_DIR, defer_indexing=True)
+    indexer = LS.start_indexing(workers=2)
+    assert indexer.wait_until_ready(10)
+    assert LS.is_ready()
+    assert LS.indexing_progress() == {'ready': True, 'discovered': 5, 'indexed': 5}
+    reference = LocalState(TEST_DIR)
+    for key in ['/dir1', '/dir1/dir2', '/file1.txt', '/dir1/file2.txt', '/dir1/dir2/file3.txt']:
+        assert LS.get_hash(key, compute_if_none=False) == reference.get_hash(key, compute_if_none=False)
+        assert LS.get_sizetime(key, compute_if_none=False) == reference.get_sizetime(key, compute_if_none=False)
+    assert LS.get_files_by_hash_key(reference.get_hash('/dir1/file2.txt')) == set(['/dir1/file2.txt'])
+    assert LS.get_fingerprint('/dir1') == reference.get_fingerprint('/dir1')
+
+def test_HS_order():
+    hashed = []
+    scheduler = HashingScheduler(lambda k, p: hashed.append(k), workers_per_device={1: 1, 2: 2})
+    for key, device, inode in [('/a', 1, 30), ('/b', 1, 10), ('/c', 2, 5), ('/d', 1, 20)]:
+        scheduler.submit(key, TEST_DIR + key, device, inode)
+    scheduler.submit('/e', TEST_DIR + '/e', 1, 40, priority=0)
+    assert scheduler.pending() == 5
+    scheduler.start()
+    scheduler.close()
+    scheduler.join()
+    assert scheduler.pending() == 0
+    # one queue per device, prioritized files first, then by inode
+    assert [x for x in hashed if x != '/c'] == ['/e', '/b', '/d', '/a']
+    assert '/c' in hashed
+    assert len([t for t in scheduler._threads if 'device 2' in t.name]) == 2
+
+def test_BI_live_events():
+    LS = LocalState(TEST_DIR, defer_indexing=True)
+    # already saved by a live event: kept as it is
+    LS.save('/file1.txt', 'live_hash', 1, 1.0)
+    # touched by a live event: not indexed, but its directory is indexed first
+    LS.indexer = BackgroundIndexer(LS)
+    LS.notify_live_event('/dir1/dir2/file3.txt')
+    entry, priority = LS.indexer._next_entry()
+    assert entry.path == TEST_DIR + '/dir1/dir2/file3.txt' and priority == 0
+    LS.indexer.start()
+    assert LS.indexer.wait_until_ready(10)
+    assert LS.get_hash('/file1.txt', compute_if_none=False) == 'live_hash'
+    assert LS.get_hash('/dir1/dir2/file3.txt', compute_if_none=False) is None
+    assert LS.get_hash('/dir1/file2.txt', compute_if_none=False) is not None
+    # once ready, live events are ignored by the indexer
+    LS.notify_live_event('/dir1/file2.txt')
+    assert not LS.indexer._priority_dirs
+
+def test_SH_warm_up():
+    create_dir('/same')
+    for i in range(4):
+        create_file('/same/file%d.txt' % i, 'same content')
+        os.utime(TEST_DIR + '/same/file%d.txt' % i, (1000000000, 1000000000))
+    LS = LocalState(TEST_DIR, max_resident_hashes=4)
+    assert (12, 1000000000.0) in LS.get_colliding_sizetimes()
+    assert not [x for x in LS.get_colliding_sizetimes() if x[0] == 'DIR']
+    # the colliding files hashed last by the indexing threads may still be resident:
+    # the other values are read again, so that none of the colliding ones is
+    for key in ['/file1.txt', '/dir1/file2.txt', '/dir1/dir2/file3.txt', '/dir1']:
+        LS.get_hash(key)
+    assert not [i for i in range(4) if LS.has_resident_hash('/same/file%d.txt' % i)]
+    hasher = SpeculativeHasher(LS, is_idle=lambda: False)
+    assert hasher.warm_up() == 0
+    hasher = SpeculativeHasher(LS)
+    # at most half of the resident hash values are renewed
+    assert hasher.warm_up() == 2
+    assert hasher.hashed == 2 and hasher.hashed_bytes > 0
+    # the remaining colliding files are warmed up by the next call
+    assert hasher.warm_up() == 2
+    assert hasher.warm_up() == 0
+    # then, only the sizetime values saved in the meantime are checked
+    for name in ['/new1.txt', '/new2.txt']:
+        create_file(name, 'new')
+        os.utime(TEST_DIR + name, (2000000000, 2000000000))
+        LS.get_sizetime(name)
+    assert hasher.warm_up() == 2
+    assert LS.has_resident_hash('/new1.txt') and LS.has_resident_hash('/new2.txt')
+    assert LS.pop_colliding_sizetimes() == []
+
+# ioprio_get system call numbers, per architecture
+IOPRIO_GET_SYSCALLS = {'x86_64': 252, 'i386': 290, 'i686': 290, 'aarch64': 31, 
+                       'armv7l': 315, 'ppc64le': 274}
+
+def test_lower_io_priority():
+    results = []
+    def lower_and_check():
+        is_lowered = lower_io_priority()
+        results.append(os.getpriority(os.PRIO_PROCESS, threading.get_native_id()))
+        if is_lowered:
+            # 'who' is 0, which means the calling thread: (class << 13) | data
+            libc = ctypes.CDLL(None, use_errno=True)
+            results.append(libc.syscall(IOPRIO_GET_SYSCALLS[platform.machine()], 1, 0))
+    thread = threading.Thread(target=lower_and_check)
+    thread.start()
+    thread.join()
+    # only the calling thread is lowered
+    assert results[0] == 19
+    assert os.getpriority(os.PRIO_PROCESS, threading.get_native_id()) != 19
+    LS = LocalState(TEST_DIR, defer_indexing=True, io_friendly_hashing=True)
+    assert LS.start_indexing(low_io_priority=True).wait_until_ready(10)
+    assert LS.get_hash('/dir1/file2.txt', compute_if_none=False) == LocalState(TEST_DIR).get_hash('/dir1/file2.txt')
+    if platform.machine() not in IOPRIO_GET_SYSCALLS:
+        pytest.skip('ioprio system calls unknown on %s' % platform.machine())
+    # idle class
+    assert results[1:] == [3 << 13]
+
+def test_HS_batches():
+    batches = []
+    scheduler = HashingScheduler(None, hash_and_save_many=lambda couples: batches.append([x[0] for x in couples]))
+    for i in range(HashingScheduler.BATCH_SIZE + 1):
+        scheduler.submit('/%d' % i, TEST_DIR + '/%d' % i, 1, i)
+    scheduler.start()
+    scheduler.close()
+    scheduler.join()
+    assert scheduler.pending() == 0
+    assert [len(x) for x in batches] == [HashingScheduler.BATCH_SIZE, 1]
+    assert batches[0][:2] == ['/0', '/1']
+
+def test_HS_shared():
+    scheduler = HashingScheduler(None, workers_per_device=2)
+    scheduler.start()
+    indexers = [BackgroundIndexer(LocalState(TEST_DIR, defer_indexing=True), scheduler=scheduler) for _ in range(2)]
+    for indexer in indexers:
+        indexer.local_states.indexer = indexer
+        # indexed in the calling thread, the files being hashed by the shared workers
+        indexer.run()
+        assert indexer.is_ready() and scheduler.pending(indexer) == 0
+        assert indexer.local_states.get_hash('/dir1/file2.txt', compute_if_none=False) is not None
+    assert indexers[0].progress() == indexers[1].progress()
+    scheduler.close()
+    assert scheduler.pending() == 0
+
+def test_BI_fingerprints(tmpdir):
+    root = str(tmpdir)
+    for name in ['/src', '/new']:
+        os.mkdir(root + name)
+    for name in ['/src/a.txt', '/src/b.txt', '/new/b.txt']:
+        with open(root + name, 'w') as f:
+            f.write(os.path.basename(name))
+    LS = LocalState(root, defer_indexing=True)
+    # hashed by live events, before their directories are indexed
+    LS.get_hash('/src/b.txt')
+    LS.get_hash('/new/b.txt')
+    assert LS.get_fingerprint('/src') is None and LS.get_fingerprint('/new') is None
+    # every entry registered, the files being only submitted to the scheduler
+    indexer = LS.indexer = BackgroundIndexer(LS)
+    next_entry = indexer._next_entry()
+    while next_entry is not None:
+        entry, priority = next_entry
+        key = '/' + entry.path[indexer._prefix_len:]
+        indexer._list(key, priority)
+        LS._index_entry(key, entry, indexer, priority)
+        next_entry = indexer._next_entry()
+    indexer._end_listing(1)
+    assert LS.get_fingerprint('/new') is not None
+    assert LS.get_fingerprint('/src') is None
+    assert LS.get_dirs_by_fingerprint(LS.get_fingerprint('/new')) == set(['/new'])
+    assert not LS.is_ready() and LS.indexing_progress()['discovered'] == 5
+    # the remaining files are hashed by the indexer thread: its readiness is awaited
+    indexer.start()
+    assert indexer.wait_until_ready(10)
+    assert LS.is_ready() and LS.indexing_progress()['ready']
+    assert LS.get_fingerprint('/src') is not None and LS.get_fingerprint('/') is not None
@@ -0,0 +1,43 @@
+
+import sys
+import os
+import time
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from revised_watchdog.observers.inotify_buffer import BatchedDelayedQueue, InotifyBuffer
+
+def test_batched_delayed_queue():
+    queue = BatchedDelayedQueue(0.1)
+    queue.put_many([1, 2])
+    queue.put_many([])
+    time.sleep(0.05)
+    queue.put_many([3])
+    assert queue.remove(lambda x: x == 2) == 2
+    assert len(queue) == 2
+    # the delay of the oldest element is over, not the one of the newest
+    duration = time.time()
+    assert queue.get_many() == [1]
+    assert queue.get_many() == [3]
+    assert time.time() - duration < 0.2
+    # closing wakes the consumer up
+    threading.Timer(0.05, queue.close).start()
+    assert queue.get_many() == []
+
+def test_inotify_buffer_moves(tmpdir):
+    root = str(tmpdir).encode()
+    buffer = InotifyBuffer(root)
+    try:
+        for i in range(3):
+            os.mknod(root + b'/f%d' % i)
+        for i in range(3):
+            os.rename(root + b'/f%d' % i, root + b'/g%d' % i)
+        events = []
+        while len(events) < 6:
+            events.extend(buffer.read_events())
+        assert [x.src_path for x in events[:3]] == [root + b'/f%d' % i for i in range(3)]
+        # every move event is paired with its origin, in the same batch
+        assert [(x[0].src_path, x[1].src_path) for x in events[3:]] == [
+            (root + b'/f%d' % i, root + b'/g%d' % i) for i in range(3)]
+    finally:
+        buffer.close()
@@ -0,0 +1,309 @@
+
+import sys
+import os
+import select
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from revised_watchdog.observers.inotify_c import WatchTree, Inotify, DEFAULT_EVENT_BUFFER_SIZE, STRUCTURE_EVENTS, CLOSE_WRITE_EVENTS
+from filters import PathFilter
+
+def test_watch_tree():
+    watches = WatchTree()
+    for wd, path in enumerate([b'/w', b'/w/a', b'/w/a/b', b'/w/a/b/c', b'/w/a/bc']):
+        watches.add(path, wd)
+    assert len(watches) == 5
+    assert watches.get_wd(b'/w/a/b/') == 2
+    # siblings sharing a prefix are not moved
+    watches.move(b'/w/a/b', b'/w/d')
+    assert watches.get_path(2) == b'/w/d'
+    assert watches.get_path(3) == b'/w/d/c'
+    assert watches.get_path(4) == b'/w/a/bc'
+    assert watches.get_wd(b'/w/a/b') is None
+    # replaced directory keeps its path until its watch is removed
+    watches.move(b'/w/a/bc', b'/w/d')
+    assert watches.get_path(4) == b'/w/d'
+    assert watches.get_path(2) == b'/w/d' and watches.get_path(3) == b'/w/d/c'
+    assert watches.remove_wd(2) and watches.remove_wd(3)
+    assert not watches.remove_wd(3)
+    assert watches.get_wd(b'/w/d') == 4
+    assert watches.remove(b'/w/d') == 4
+    assert len(watches) == 2
+    try:
+        watches.remove(b'/w/d')
+        assert False
+    except KeyError:
+        pass
+    assert WatchTree._split('relative/path/') == ['relative', 'path']
+
+def test_inotify_moves(tmpdir):
+    root = str(tmpdir).encode()
+    for path in [b'/a', b'/a/b', b'/a/b/c', b'/a/bc']:
+        os.mkdir(root + path)
+    inotify = Inotify(root, recursive=True)
+    try:
+        os.rename(root + b'/a/b', root + b'/a/d')
+        events = inotify.read_events()
+        assert [x.src_path for x in events if x.is_moved_to] == [root + b'/a/d']
+        os.mkdir(root + b'/a/d/c/e')
+        os.mkdir(root + b'/a/bc/f')
+        events = inotify.read_events()
+        assert sorted(x.src_path for x in events if x.is_create) == [root + b'/a/bc/f', root + b'/a/d/c/e']
+    finally:
+        inotify.close()
+
+def test_inotify_chunked_simulation(tmpdir):
+    root = str(tmpdir).encode()
+    os.mkdir(root + b'/w')
+    inotify = Inotify(root + b'/w', recursive=True)
+    chunk_size = Inotify.SIMULATION_CHUNK_SIZE
+    Inotify.SIMULATION_CHUNK_SIZE = 4
+    try:
+        # a tree moved in from outside the watched directory
+        for path in [b'/d', b'/d/s1', b'/d/s2', b'/d/s1/s3']:
+            os.mkdir(root + path)
+        for i in range(5):
+            os.mknod(root + b'/d/s1/f%d' % i)
+        os.rename(root + b'/d', root + b'/w/d')
+        events = inotify.read_events()
+        assert len(events) == 1 + 4 and inotify.has_pending_simulations()
+        # paused while the consumer is late
+        inotify.backlog = lambda: Inotify.MAX_SIMULATION_BACKLOG
+        assert inotify.read_events() == []
+        inotify.backlog = None
+        while inotify.has_pending_simulations():
+            events.extend(inotify.read_events())
+        paths = [x.src_path for x in events]
+        assert len(paths) == 1 + 3 + 5
+        # breadth-first, every directory before its content
+        assert paths.index(root + b'/w/d/s2') < paths.index(root + b'/w/d/s1/f0')
+        assert paths.index(root + b'/w/d/s1/s3') > paths.index(root + b'/w/d/s2')
+        assert all(x.is_moved_to and x.cookie == -1 for x in events[1:])
+        # every directory is under observation
+        os.mknod(root + b'/w/d/s1/s3/f')
+        assert [x.src_path for x in inotify.read_events() if x.is_create] == [root + b'/w/d/s1/s3/f']
+    finally:
+        Inotify.SIMULATION_CHUNK_SIZE = chunk_size
+        inotify.close()
+
+def test_inotify_simulation_order(tmpdir):
+    root = str(tmpdir).encode()
+    for path in [b'/w', b'/d']:
+        os.mkdir(root + path)
+    names = [b'f%d' % i for i in range(10)]
+    for name in names:
+        os.mknod(root + b'/d/' + name)
+    inotify = Inotify(root + b'/w', recursive=True)
+    chunk_size = Inotify.SIMULATION_CHUNK_SIZE
+    Inotify.SIMULATION_CHUNK_SIZE = 4
+    try:
+        os.rename(root + b'/d', root + b'/w/d')
+        events = inotify.read_events()
+        simulated = [x.name for x in events[1:]]
+        assert len(simulated) == 4
+        # changed before the listing reaches them: only the kernel events are reported
+        remaining = sorted(set(names) - set(simulated))
+        for name in remaining[:3]:
+            os.remove(root + b'/w/d/' + name)
+        os.mknod(root + b'/w/d/new')
+        while inotify.has_pending_simulations() or select.select([inotify.fd], [], [], 0.1)[0]:
+            events.extend(inotify.read_events())
+        for name in remaining[:3]:
+            assert [x.is_delete for x in events if x.name == name] == [True]
+        assert [x.is_create for x in events if x.name == b'new'] == [True]
+        assert sorted(x.name for x in events[1:] if x.is_moved_to) == sorted(simulated + remaining[3:])
+        assert inotify._seen_names == {}
+    finally:
+        Inotify.SIMULATION_CHUNK_SIZE = chunk_size
+        inotify.close()
+
+def test_inotify_overflow(tmpdir):
+    root = str(tmpdir).encode()
+    os.mkdir(root + b'/w')
+    inotify = Inotify(root + b'/w', recursive=True)
+    try:
+        # more events than the kernel queue can keep, then a directory whose event is lost
+        for i in range(int(open('/proc/sys/fs/inotify/max_queued_events').read()) + 1):
+            os.mknod(root + b'/w/f%d' % i)
+        os.mkdir(root + b'/w/late')
+        events = []
+        while select.select([inotify._inotify_fd], [], [], 0)[0] or inotify.has_pending_simulations():
+            events.extend(inotify.read_events())
+        assert inotify.overflows == 1
+        overflows = [x for x in events if x.wd == -1]
+        assert len(overflows) == 1 and overflows[0].src_path == root + b'/w'
+        # the lost directory is under observation, without simulated events
+        assert not [x for x in events if x.src_path == root + b'/w/late']
+        os.mknod(root + b'/w/late/f')
+        assert [x.src_path for x in inotify.read_events() if x.is_create] == [root + b'/w/late/f']
+    finally:
+        inotify.close()
+
+def test_inotify_adaptive_buffer(tmpdir):
+    root = str(tmpdir).encode()
+    inotify = Inotify(root)
+    try:
+        names = [b'f' * (i % 200 + 1) + b'%d' % i for i in range(8000)]
+        for name in names:
+            os.mknod(root + b'/' + name)
+        events = inotify.read_events()
+        # the read came back full: the next one reads more at once
+        assert len(inotify._event_buffer) == 2 * DEFAULT_EVENT_BUFFER_SIZE
+        while select.select([inotify._inotify_fd], [], [], 0)[0]:
+            events.extend(inotify.read_events())
+        assert len(inotify._event_buffer) <= Inotify.MAX_EVENT_BUFFER_SIZE
+        assert [x.name for x in events] == names
+        assert [x.src_path for x in events[:2]] == [root + b'/' + x for x in names[:2]]
+    finally:
+        inotify.close()
+
+def test_inotify_path_filter(tmpdir):
+    root = str(tmpdir).encode()
+    for path in [b'/w', b'/w/a', b'/w/node_modules', b'/w/node_modules/lib']:
+        os.mkdir(root + path)
+    path_filter = PathFilter(['node_modules/'])
+    inotify = Inotify(root + b'/w', recursive=True, path_filter=path_filter)
+    try:
+        # excluded directories are never under observation
+        assert inotify._watches.get_wd(root + b'/w/a') is not None
+        assert inotify._watches.get_wd(root + b'/w/node_modules') is None
+        assert inotify._watches.get_wd(root + b'/w/node_modules/lib') is None
+        os.mkdir(root + b'/w/a/node_modules')
+        os.mknod(root + b'/w/node_modules/f')
+        inotify.read_events()
+        assert inotify._watches.get_wd(root + b'/w/a/node_modules') is None
+        # moved out of an excluded directory: observed, as if moved in
+        os.rename(root + b'/w/node_modules/lib', root + b'/w/a/lib')
+        events = inotify.read_events()
+        assert [x.src_path for x in events if x.is_moved_to] == [root + b'/w/a/lib']
+        assert inotify._watches.get_wd(root + b'/w/a/lib') is not None
+        # renamed as an excluded directory: no longer observed
+        os.mkdir(root + b'/w/a/lib/sub')
+        inotify.read_events()
+        os.rename(root + b'/w/a/lib', root + b'/w/a/node_modules')
+        inotify.read_events()
+        assert inotify._watches.get_wd(root + b'/w/a/node_modules') is None
+        assert inotify._watches.get_wd(root + b'/w/a/node_modules/sub') is None
+        assert path_filter.pruned['watches'] >= 3
+    finally:
+        inotify.close()
+
+def test_inotify_event_masks(tmpdir):
+    root = str(tmpdir).encode()
+    for path in [b'/w', b'/w/a', b'/w/archives', b'/w/archives/x', b'/w/logs']:
+        os.mkdir(root + path)
+    inotify = Inotify(root + b'/w', recursive=True, event_masks={'/archives/': STRUCTURE_EVENTS, 'logs': CLOSE_WRITE_EVENTS})
+    try:
+        assert inotify._watches.get_mask(inotify._watches.get_wd(root + b'/w/archives/x')) == STRUCTURE_EVENTS
+        for path in [b'/w/a/f', b'/w/archives/f', b'/w/logs/f']:
+            with open(root + path, 'w') as f:
+                f.write('content')
+        events = inotify.read_events()
+        assert [x.src_path for x in events if x.is_create] == [root + b'/w/a/f', root + b'/w/archives/f', root + b'/w/logs/f']
+        # the kernel only reports the events of the mask of each sub-tree
+        assert [x.src_path for x in events if x.is_modify] == [root + b'/w/a/f']
+        assert [x.src_path for x in events if x.is_close_write] == [root + b'/w/logs/f']
+        # a moved directory keeps its mask, and gives it to its new sub-directories
+        os.rename(root + b'/w/archives', root + b'/w/a/old')
+        inotify.read_events()
+        os.mkdir(root + b'/w/a/old/y')
+        inotify.read_events()
+        assert inotify._watches.get_mask(inotify._watches.get_wd(root + b'/w/a/old/y')) == STRUCTURE_EVENTS
+        with open(root + b'/w/a/old/y/f', 'w') as f:
+            f.write('content')
+        assert [x.is_create for x in inotify.read_events()] == [True]
+    finally:
+        inotify.close()
+
+def test_inotify_removed_watches(tmpdir):
+    root = str(tmpdir).encode()
+    for path in [b'/w', b'/w/a', b'/w/a/b', b'/w/a/b/c']:
+        os.mkdir(root + path)
+    inotify = Inotify(root + b'/w', recursive=True, path_filter=PathFilter(['build/']))
+    try:
+        os.rename(root + b'/w/a', root + b'/w/build')
+        inotify.read_events()
+        assert len(inotify._watches) == 1
+        # the last events of the removed watches are dropped
+        os.mknod(root + b'/w/f')
+        while select.select([inotify.fd], [], [], 0.1)[0]:
+            events = inotify.read_events()
+        assert [x.src_path for x in events] == [root + b'/w/f']
+    finally:
+        inotify.close()
+
+def test_inotify_remove_watch(tmpdir):
+    root = str(tmpdir).encode()
+    for path in [b'/w', b'/w/a', b'/w/a/b']:
+        os.mkdir(root + path)
+    inotify = Inotify(root + b'/w', recursive=True)
+    try:
+        inotify.remove_watch(root + b'/w/a')
+        assert inotify._watches.get_wd(root + b'/w/a') is None
+        assert inotify._watches.get_wd(root + b'/w/a/b') is not None
+        # only the removed directory is no longer observed
+        for path in [b'/w/a/f', b'/w/a/b/f', b'/w/f']:
+            os.mknod(root + path)
+        events = []
+        while select.select([inotify.fd], [], [], 0.1)[0]:
+            events.extend(inotify.read_events())
+        assert [x.src_path for x in events] == [root + b'/w/a/b/f', root + b'/w/f']
+        try:
+            inotify.remove_watch(root + b'/w/a')
+            assert False
+        except KeyError:
+            pass
+    finally:
+        inotify.close()
+
+def test_inotify_moved_out(tmpdir):
+    root = str(tmpdir).encode()
+    for path in [b'/w', b'/w/a', b'/w/a/b', b'/w/c', b'/out']:
+        os.mkdir(root + path)
+    inotify = Inotify(root + b'/w', recursive=True)
+    def read_all():
+        events = []
+        while select.select([inotify.fd], [], [], 0.1)[0]:
+            events.extend(inotify.read_events())
+        return events
+    try:
+        os.rename(root + b'/w/a', root + b'/out/a')
+        assert [(x.is_moved_from, x.src_path) for x in read_all()] == [(True, root + b'/w/a')]
+        # the whole moved-out sub-tree stops producing events
+        assert sorted(inotify._watches.get_wds_under(root + b'/w')) == sorted(
+            inotify._watches.get_wd(root + x) for x in [b'/w', b'/w/c'])
+        for path in [b'/out/a/f', b'/out/a/b/f']:
+            os.mknod(root + path)
+        os.rename(root + b'/out/a/b', root + b'/out/b')
+        assert read_all() == []
+        # a directory moved inside the watched directories is still watched
+        os.rename(root + b'/w/c', root + b'/w/d')
+        os.mknod(root + b'/w/d/f')
+        assert [x.src_path for x in read_all() if x.is_create] == [root + b'/w/d/f']
+    finally:
+        inotify.close()
+
+def test_inotify_moved_out_and_in(tmpdir):
+    root = str(tmpdir).encode()
+    for path in [b'/w', b'/w/archives', b'/w/archives/x', b'/out']:
+        os.mkdir(root + path)
+    inotify = Inotify(root + b'/w', recursive=True, event_masks={'/archives/': STRUCTURE_EVENTS})
+    def read_all():
+        events = []
+        while select.select([inotify.fd], [], [], 0.1)[0]:
+            events.extend(inotify.read_events())
+        return events
+    try:
+        os.rename(root + b'/w/archives/x', root + b'/out/x')
+        read_all()
+        # no longer watched: what happens outside is not reported
+        assert inotify._watches.get_wd(root + b'/w/archives/x') is None
+        os.mknod(root + b'/out/x/f')
+        assert read_all() == []
+        os.rename(root + b'/out/x', root + b'/w/archives/x')
+        events = read_all()
+        assert [x.src_path for x in events if x.is_moved_to] == [root + b'/w/archives/x', root + b'/w/archives/x/f']
+        assert inotify._watches.get_mask(inotify._watches.get_wd(root + b'/w/archives/x')) == STRUCTURE_EVENTS
+        os.mknod(root + b'/w/archives/x/g')
+        assert [x.src_path for x in read_all() if x.is_create] == [root + b'/w/archives/x/g']
+    finally:
+        inotify.close()
@@ -0,0 +1,45 @@
+
+import sys
+import os
+import json
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from states import LocalState
+from manifests import read_json_lines, read_csv, read_manifest
+
+TEST_DIR = None
+
+def create_file(filename:str):
+    os.mknod(TEST_DIR + filename)
+
+def test_manifests_read(tmpdir):
+    global TEST_DIR
+    TEST_DIR = str(tmpdir)
+    os.mkdir(TEST_DIR + '/dir1')
+    create_file('/dir1/file1.txt')
+    create_file('/file2.txt')
+    with open(TEST_DIR + '/manifest.jsonl', 'w') as f:
+        f.write(json.dumps({'path': '/dir1', 'hash': 'DIR', 'size': 'DIR', 'mtime': 'DIR'}) + '\n\n')
+        f.write(json.dumps({'path': '/dir1/file1.txt', 'hash': 'H1', 'size': 1, 'mtime': 1523055888.0}) + '\n')
+        f.write(json.dumps({'path': '/dir1/missing.txt', 'hash': 'H2', 'size': 2, 'mtime': 1523055888.0}) + '\n')
+    with open(TEST_DIR + '/manifest.csv', 'w') as f:
+        f.write('/dir1,DIR,DIR,DIR\n/dir1/file1.txt,H1,1,1523055888.0\n/dir1/missing.txt,H2,2,1523055888.0\n')
+    assert list(read_json_lines(TEST_DIR + '/manifest.jsonl')) == list(read_csv(TEST_DIR + '/manifest.csv'))
+    assert list(read_manifest(TEST_DIR + '/manifest.csv'))[1] == ('/dir1/file1.txt', ('H1', 1, 1523055888.0))
+    try:
+        read_manifest(TEST_DIR + '/manifest.txt')
+        assert False
+    except ValueError:
+        pass
+
+def test_manifests_local_state():
+    for manifest in [TEST_DIR + '/manifest.jsonl', TEST_DIR + '/manifest.csv', read_csv(TEST_DIR + '/manifest.csv')]:
+        LS = LocalState(TEST_DIR, custom_intializing_values=manifest)
+        assert LS.get_hash('/dir1/file1.txt') == 'H1'
+        assert LS.get_sizetime('/dir1/file1.txt') == (1, 1523055888.0)
+        assert LS.get_inode('/dir1/file1.txt') == (os.stat(TEST_DIR + '/dir1/file1.txt').st_dev, 
+                                                  os.stat(TEST_DIR + '/dir1/file1.txt').st_ino)
+        assert LS.get_hash('/dir1', compute_if_none=False) == LocalState.DEFAULT_DIRECTORY_VALUE
+        # missing files are ignored, unlisted ones are not computed
+        assert LS.get_hash('/dir1/missing.txt', compute_if_none=False) is None
+        assert LS.get_hash('/file2.txt', compute_if_none=False) is None
@@ -7,6 +7,8 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from queues import DatedlocaleventQueue
 from states import LocalState
 from revised_watchdog.observers.inotify import InotifyObserver
+from watchdog.events import FileCreatedEvent
+from revised_watchdog.events import OverflowEvent
 
 TEST_DIR = None
 TESTED_QUEUE = None
@@ -58,3 +60,41 @@ def test_DatedlocaleventQueue():
 
 
 
+
+def test_DatedlocaleventQueue_batches():
+    # a rename storm is moved by batches, from the inotify buffer to the queue
+    queue = DatedlocaleventQueue(LocalState(TEST_DIR))
+    observer = InotifyObserver()
+    observer.schedule(queue, TEST_DIR, recursive=True)
+    observer.start()
+    try:
+        time.sleep(0.1)
+        for i in range(100):
+            create_file('/storm%d.txt' % i)
+        for i in range(100):
+            os.rename(TEST_DIR + '/storm%d.txt' % i, TEST_DIR + '/renamed%d.txt' % i)
+        time.sleep(1)
+    finally:
+        observer.stop()
+        observer.join()
+    events = queue.next_many()
+    assert queue.is_empty()
+    assert [e.path for e in events if e.is_file_created_event()] == ['/storm%d.txt' % i for i in range(100)]
+    assert [(e.path, e.to_path) for e in events if e.is_moved_event()] == [
+        ('/storm%d.txt' % i, '/renamed%d.txt' % i) for i in range(100)]
+
+def test_DatedlocaleventQueue_overflow():
+    # the events read before an overflow are queued before it is notified
+    queue = DatedlocaleventQueue(LocalState(TEST_DIR))
+    queued = []
+    def on_overflow(event):
+        queued.append(queue.size())
+        DatedlocaleventQueue.on_overflow(queue, event)
+    queue.on_overflow = on_overflow
+    create_file('/before.txt')
+    create_file('/after.txt')
+    queue.dispatch_many([FileCreatedEvent(TEST_DIR + '/before.txt'), OverflowEvent(TEST_DIR), 
+                         FileCreatedEvent(TEST_DIR + '/after.txt')])
+    assert queued == [1]
+    assert queue.pop_rescan_request()
+    assert [e.path for e in queue.next_many()] == ['/before.txt', '/after.txt']
@@ -2,10 +2,15 @@
 import sys
 import os
 import time
+import threading
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from states import DualAccessMemory
 from states import LocalState
+from states import DirectoryFingerprints
+from states import BoundedDualAccessMemory
+from states import BoundedMemory
+from states import PathMemory
 
 DAM = DualAccessMemory()
 
@@ -233,3 +238,426 @@ def test_LS_basics_6():
     
 
 
+
+
+DF = None
+DF_HASHES = DualAccessMemory()
+
+def test_DF_basics_1():
+    global DF
+    DF = DirectoryFingerprints(DF_HASHES)
+    for k, v in [('/a/f1', 'H1'), ('/a/f2', 'H2'), ('/a/sub/f3', 'H3'), ('/b/f1', 'H1'), ('/b/f2', 'H2')]:
+        DF_HASHES[k] = v
+        DF.add(k)
+    assert DF.count_children('/a') == 3
+    assert DF.get('/a') is not None
+    assert DF.get('/a') != DF.get('/b')
+    DF_HASHES['/b/sub/f3'] = 'H3'
+    DF.add('/b/sub/f3')
+    assert DF.get('/a') == DF.get('/b')
+    assert DF.get_by_fingerprint(DF.get('/a')) == set(['/a', '/b'])
+
+# incremental update
+def test_DF_basics_2():
+    DF_HASHES['/b/sub/f3'] = 'H4'
+    DF.add('/b/sub/f3')
+    assert DF.get('/a') != DF.get('/b')
+    assert DF.get('/a/sub') != DF.get('/b/sub')
+    assert DF.get_by_fingerprint(DF.get('/a')) == set(['/a'])
+    DF_HASHES['/b/sub/f3'] = 'H3'
+    DF.add('/b/sub/f3')
+    assert DF.get('/a') == DF.get('/b')
+
+# the root directory is computed after its sub-directories
+def test_DF_basics_3():
+    hashes = DualAccessMemory()
+    fingerprints = DirectoryFingerprints(hashes)
+    hashes['/a/f1'] = 'H1'
+    fingerprints.add('/a/f1')
+    for i in range(20):
+        hashes['/d%d/f' % i] = 'H'
+        fingerprints.add('/d%d/f' % i)
+        assert fingerprints.get('/') is not None
+
+# unknown hash, deletion and move
+def test_DF_complex_1():
+    DF_HASHES['/b/sub/f4'] = None
+    DF.add('/b/sub/f4')
+    assert DF.get('/b') is None
+    DF_HASHES.delete('/b/sub/f4')
+    DF.delete('/b/sub/f4')
+    assert DF.get('/a') == DF.get('/b')
+    DF_HASHES.move('/b', '/c/b')
+    DF.move('/b', '/c/b')
+    assert DF.get('/b') is None
+    assert DF.count_children('/') == 2
+    assert DF.get_by_fingerprint(DF.get('/a')) == set(['/a', '/c/b'])
+    DF.delete('/c')
+    assert DF.get_by_fingerprint(DF.get('/a')) == set(['/a'])
+    assert DF.count_children('/c/b') is None
+
+def test_LS_fingerprints():
+    global LS
+    create_file('/test6.txt')
+    LS = LocalState(TEST_DIR, custom_hash_function=dumb_hash_function)
+    os.mkdir(TEST_DIR + '/dir1')
+    os.mkdir(TEST_DIR + '/dir2')
+    create_file('/dir1/f.txt')
+    create_file('/dir2/f.txt')
+    LS.get_hash('/dir1/f.txt')
+    assert LS.get_dirs_by_fingerprint(LS.get_fingerprint('/dir1')) == set(['/dir1'])
+    LS.get_hash('/dir2/f.txt')
+    assert LS.get_dirs_by_fingerprint(LS.get_fingerprint('/dir1')) == set(['/dir1', '/dir2'])
+    os.system('rm -r ' + TEST_DIR + '/dir2')
+    assert LS.get_dirs_by_fingerprint(LS.get_fingerprint('/dir1')) == set(['/dir1'])
+    assert LS.get_fingerprint('/dir2') is None
+
+def test_LS_fingerprints_sizetime(tmpdir):
+    root = str(tmpdir)
+    for name in ['/src', '/new']:
+        os.mkdir(root + name)
+    for name, content in [('/src/a.txt', 'a'), ('/src/b.txt', 'b'), ('/new/b.txt', 'b')]:
+        with open(root + name, 'w') as f:
+            f.write(content)
+    state = LocalState(root)
+    assert state.get_fingerprint('/src') is not None
+    # a file whose hash value is forgotten is still a child of its directory
+    state.save_sizetime('/src/a.txt', 1, state.get_sizetime('/src/a.txt')[1])
+    assert state.get_fingerprint('/src') is None
+    assert state.get_dirs_by_fingerprint(state.get_fingerprint('/new')) == set(['/new'])
+    state.get_hash('/src/a.txt')
+    assert state.get_fingerprint('/src') is not None
+
+
+BDAM = None
+SPILL = {}
+
+def test_BDAM_basics_1():
+    global BDAM
+    BDAM = BoundedDualAccessMemory(2)
+    BDAM['key1'] = 'value1'
+    BDAM['key2'] = 'value2'
+    assert BDAM.get('key1') == 'value1' # key2 is now the least recently used
+    BDAM['key3'] = 'value1'
+    assert BDAM.evictions == 1
+    assert 'key2' not in BDAM
+    assert BDAM.is_evicted('key2')
+    assert BDAM.get('key2') is None
+    assert BDAM.get_by_value('value1') == set(['key1', 'key3'])
+    BDAM['key2'] = 'value2'
+    assert not BDAM.is_evicted('key2')
+    assert len(BDAM.memories) == 2
+
+def test_BDAM_spill():
+    global BDAM
+    BDAM = BoundedDualAccessMemory(2, SPILL)
+    BDAM['dir/key1'] = 'value1'
+    BDAM['dir/key2'] = 'value2'
+    BDAM['key3'] = 'value3'
+    assert SPILL == {'dir/key1': 'value1'}
+    assert 'dir/key1' in BDAM
+    BDAM.move('dir', 'moved_dir')
+    assert SPILL == {'moved_dir/key1': 'value1'}
+    assert BDAM.get('moved_dir/key1') == 'value1'
+    assert BDAM.spill_hits == 1
+    assert BDAM.is_evicted('key3')
+    assert SPILL == {'key3': 'value3'}
+    BDAM.delete('moved_dir')
+    assert SPILL == {'key3': 'value3'}
+    assert 'moved_dir/key1' not in BDAM
+    assert 'moved_dir/key2' not in BDAM
+
+def test_BDAM_evicted():
+    memory = BoundedDualAccessMemory(2)
+    for i in range(6):
+        memory['key%d' % i] = 'value%d' % i
+    # without spill store, only the last evicted keys are remembered
+    assert len(memory.evicted) == 2
+    assert memory.is_evicted('key3') and not memory.is_evicted('key0')
+
+def test_BDAM_recursive():
+    spill = {}
+    memory = BoundedDualAccessMemory(2, spill)
+    for key in ['/d/1', '/d/2', '/d/3', '/e/1']:
+        memory[key] = key
+    assert sorted(spill) == ['/d/1', '/d/2']
+    # the evicted keys replace the resident ones, and the other way around
+    memory.move('/d', '/e')
+    assert sorted(spill) == ['/e/1', '/e/2'] and list(memory.memories) == ['/e/3']
+    assert memory.get('/e/1') == '/d/1' and not memory.is_evicted('/e/1')
+    assert sorted(memory.keys()) == ['/e/1', '/e/2', '/e/3']
+    memory.delete('/e')
+    assert spill == {} and memory.keys() == [] and not memory._spilled_keys
+    # without spill store, the evicted keys are moved and deleted the same way
+    memory = BoundedDualAccessMemory(1)
+    for key in ['/a/1', '/a/2']:
+        memory[key] = key
+    memory.move('/a', '/b')
+    assert memory.is_evicted('/b/1') and not memory.is_evicted('/a/1')
+    memory.delete('/b')
+    assert not memory.is_evicted('/b/1') and len(memory.memories) == 0
+
+def test_BM_basics():
+    memory = BoundedMemory(2)
+    memory['key1'] = 'value1'
+    memory['key2'] = 'value2'
+    assert memory.get('key1') == 'value1' # key2 is now the least recently used
+    memory['key3'] = 'value3'
+    assert dict(memory) == {'key1': 'value1', 'key3': 'value3'}
+    assert memory.evictions == 1
+    assert memory.get('key2') is None
+    assert memory.pop('key1') == 'value1' and len(memory) == 1
+
+def test_PM_basics():
+    memory = PathMemory()
+    for key in ['/b/2', '/a', '/b', '/b/1', '/b0', '/b/1/x']:
+        memory[key] = key
+    memory.delete('/b/1')
+    assert sorted(memory) == ['/a', '/b', '/b/2', '/b0']
+    memory['/b/1'] = 'new'
+    memory.move('/b', '/c')
+    assert memory == {'/a': '/a', '/b0': '/b0', '/c': '/b', '/c/1': 'new', '/c/2': '/b/2'}
+    # the index only lists the kept keys
+    assert memory._get_children('/c') == ['/c/1', '/c/2', '/c']
+    assert memory._get_children('/b') == []
+    memory = BoundedMemory(2)
+    for key in ['/d/1', '/d/2', '/d/3']:
+        memory[key] = key
+    memory.move('/d', '/e')
+    assert memory == {'/e/2': '/d/2', '/e/3': '/d/3'}
+
+def test_DF_bounded():
+    hashes = DualAccessMemory()
+    fingerprints = DirectoryFingerprints(hashes, max_size=2)
+    for key in ['/a/b/f.txt', '/a/c/f.txt', '/d/f.txt']:
+        hashes[key] = 'hash'
+        fingerprints.add(key)
+    assert fingerprints.get('/a/b') == fingerprints.get('/a/c') == fingerprints.get('/d')
+    assert len(fingerprints.fingerprints.memories) == 2
+    # evicted fingerprints are computed again when needed
+    assert fingerprints.get('/') is not None
+    assert fingerprints.get('/a/b') is not None
+
+def test_LS_bounded():
+    global LS
+    LS = LocalState(TEST_DIR, max_resident_hashes=1)
+    assert LS.hashes.evictions > 0
+    with open(TEST_DIR + '/test6.txt', 'w') as f:
+        f.write('bounded')
+    LS.save('/test6.txt', LS.hash_function(TEST_DIR + '/test6.txt'), *LS.get_sizetime('/test6.txt'))
+    LS.get_hash('/test.txt')
+    assert LS.hashes.is_evicted('/test6.txt')
+    recomputations = LS.hashes.recomputations
+    assert LS.get_hash('/test6.txt', compute_if_none=False) is not None
+    assert LS.hashes.recomputations == recomputations + 1
+    sizetime = LS.get_sizetime('/test6.txt')
+    LS.get_hash('/test.txt')
+    assert LS.get_files_by_hash_key(LS.hash_function(TEST_DIR + '/test6.txt'), sizetime) == set(['/test6.txt'])
+    # the values kept alongside the hash values are bounded as well
+    assert isinstance(LS.hash_signatures, BoundedMemory) and len(LS.hash_signatures) <= 1
+
+def test_LS_resumable_hashing():
+    global LS
+    with open(TEST_DIR + '/test7.log', 'w') as f:
+        f.write('first line\n')
+    LS = LocalState(TEST_DIR, resumable_hashing=True)
+    assert LS.hash_checkpoints == {}
+    # first time the file grows: hashed from the beginning, and checkpoint kept
+    with open(TEST_DIR + '/test7.log', 'a') as f:
+        f.write('second line\n')
+    LS.save('/test7.log', LS.hash_function(TEST_DIR + '/test7.log'), os.path.getsize(TEST_DIR + '/test7.log'), 1.0)
+    assert '/test7.log' in LS.hash_checkpoints
+    assert LS.resumed_hashes == 0
+    # then only the appended bytes are hashed
+    with open(TEST_DIR + '/test7.log', 'a') as f:
+        f.write('third line\n')
+    assert LS.hash_function(TEST_DIR + '/test7.log') == LS._default_hashing_function(TEST_DIR + '/test7.log')
+    assert LS.resumed_hashes == 1
+    assert LS.skipped_bytes == len('first line\nsecond line\n')
+    LS.move('/test7.log', '/test8.log')
+    assert '/test8.log' in LS.hash_checkpoints
+    LS.delete('/test8.log')
+    assert LS.hash_checkpoints == {}
+
+def test_LS_block_digests():
+    global LS
+    block_size = 4 * 1024 * 1024
+    with open(TEST_DIR + '/test9.bin', 'wb') as f:
+        f.write(os.urandom(block_size * 3))
+    LS = LocalState(TEST_DIR, keep_block_digests=True)
+    assert len(LS.block_digests['/test9.bin'][1]) == 3
+    # modification of the second block
+    with open(TEST_DIR + '/test9.bin', 'r+b') as f:
+        f.seek(block_size + 10)
+        f.write(b'modified')
+    new_hash = LS.hash_function(TEST_DIR + '/test9.bin')
+    assert LS.get_changed_blocks('/test9.bin') == [1]
+    LS.save('/test9.bin', new_hash, block_size * 3, 1.0)
+    assert LS.get_changed_blocks('/test9.bin') is None
+    # appended block
+    with open(TEST_DIR + '/test9.bin', 'ab') as f:
+        f.write(b'appended')
+    LS.hash_function(TEST_DIR + '/test9.bin')
+    assert LS.get_changed_blocks('/test9.bin') == [3]
+    LS.move('/test9.bin', '/test10.bin')
+    assert '/test10.bin' in LS.block_digests
+    # the digests computed since the last save follow the file as well
+    assert LS.get_changed_blocks('/test10.bin') == [3]
+    LS.delete('/test10.bin')
+    assert '/test10.bin' not in LS.block_digests
+    assert len(LS._fresh_block_digests) == 0
+    assert LocalState(TEST_DIR).get_changed_blocks('/test.txt') is None
+    os.remove(TEST_DIR + '/test9.bin')
+
+def test_LS_hash_signatures():
+    global LS
+    with open(TEST_DIR + '/test11.txt', 'w') as f:
+        f.write('signed')
+    os.utime(TEST_DIR + '/test11.txt', (1000000000, 1000000000))
+    with open(TEST_DIR + '/test12.txt', 'w') as f:
+        f.write('racy')
+    LS = LocalState(TEST_DIR)
+    assert LS.is_hash_current('/test11.txt')
+    # just modified: the signature does not prove anything
+    assert not LS.is_hash_current('/test12.txt')
+    LS.move('/test11.txt', '/test13.txt')
+    os.rename(TEST_DIR + '/test11.txt', TEST_DIR + '/test13.txt')
+    assert '/test13.txt' in LS.hash_signatures
+    LS.delete('/test13.txt')
+    LS.get_hash('/test13.txt')
+    assert LS.is_hash_current('/test13.txt')
+    os.utime(TEST_DIR + '/test13.txt', (1000000001, 1000000001))
+    assert not LS.is_hash_current('/test13.txt')
+    # setting the modification time back does not restore the signature (change time)
+    os.utime(TEST_DIR + '/test13.txt', (1000000000, 1000000000))
+    assert not LS.is_hash_current('/test13.txt')
+    LS.delete('/test13.txt')
+    LS.get_hash('/test13.txt')
+    assert LS.is_hash_current('/test13.txt')
+    # saving another hash value forgets the signature
+    LS.save('/test13.txt', 'other_hash', 6, 1000000000.0)
+    assert not LS.is_hash_current('/test13.txt')
+    LS.delete('/test13.txt')
+    assert '/test13.txt' not in LS.hash_signatures
+    # the signature computed since the last save follows the file as well
+    LS.hash_function(TEST_DIR + '/test13.txt')
+    LS.move('/test13.txt', '/test14.txt')
+    assert '/test14.txt' in LS._fresh_signatures and '/test13.txt' not in LS._fresh_signatures
+    LS.delete('/test14.txt')
+    assert len(LS._fresh_signatures) == 0
+    os.remove(TEST_DIR + '/test13.txt')
+    os.remove(TEST_DIR + '/test12.txt')
+
+def test_LS_unstable_hashes(tmpdir):
+    root = str(tmpdir)
+    def changing_hash_function(absolute_path:str):
+        # the file is written every time it is hashed
+        with open(absolute_path, 'a') as f:
+            f.write('a')
+        return 'changing'
+    with open(root + '/file.txt', 'w') as f:
+        f.write('a')
+    LS = LocalState(root, changing_hash_function)
+    # only the size and modification time are saved
+    assert '/file.txt' not in LS.hashes
+    assert LS.get_sizetime('/file.txt', compute_if_none=False) is not None
+    assert LS.unstable_hashes > 0
+    assert LS.get_hash('/file.txt') is None
+    assert '/file.txt' not in LS.hash_signatures
+
+def test_LS_sample_digests():
+    global LS
+    with open(TEST_DIR + '/test15.bin', 'wb') as f:
+        f.write(b'a' * 1024 * 1024)
+    os.utime(TEST_DIR + '/test15.bin', (1000000000, 1000000000))
+    with open(TEST_DIR + '/test16.txt', 'w') as f:
+        f.write('small')
+    os.utime(TEST_DIR + '/test16.txt', (1000000000, 1000000000))
+    LS = LocalState(TEST_DIR)
+    # computed along with the hash value
+    assert LS.has_same_sample_digest('/test15.bin')
+    LS.delete('/test15.bin')
+    assert LS.has_same_sample_digest('/test15.bin') is None
+    LS.get_hash('/test15.bin')
+    assert LS.has_same_sample_digest('/test15.bin')
+    # small files are not sampled
+    assert LS.has_same_sample_digest('/test16.txt') is None
+    # the first sample always starts at the beginning of the file
+    with open(TEST_DIR + '/test15.bin', 'r+b') as f:
+        f.write(b'b')
+    assert LS.has_same_sample_digest('/test15.bin') is False
+    # saved without hash value: computed again when needed
+    file_hash = LS.hash_function(TEST_DIR + '/test15.bin')
+    LS.save_sizetime('/test15.bin', 1024 * 1024, 1000000000.0)
+    assert LS.get_hash('/test15.bin', compute_if_none=False) is None
+    assert LS.has_same_sample_digest('/test15.bin') is None
+    assert LS.get_files_by_hash_key(file_hash, (1024 * 1024, 1000000000.0)) == set(['/test15.bin'])
+    assert LS.get_hash('/test15.bin', compute_if_none=False) == file_hash
+    LS.delete('/test15.bin')
+    assert '/test15.bin' not in LS.sample_digests
+    os.remove(TEST_DIR + '/test15.bin')
+    os.remove(TEST_DIR + '/test16.txt')
+
+def test_LS_hash_many():
+    global LS
+    batches = []
+    def batch_hash_function(absolute_path:str):
+        return 'single'
+    def hash_many(absolute_paths:list) -> dict:
+        batches.append(len(absolute_paths))
+        # the last path is left to the single-path function
+        return {x: 'batch' if 'test17' in x else 'other' for x in absolute_paths[:-1]}
+    batch_hash_function.hash_many = hash_many
+    for i in range(3):
+        with open(TEST_DIR + '/test17_%d.txt' % i, 'w') as f:
+            f.write('same')
+        os.utime(TEST_DIR + '/test17_%d.txt' % i, (1000000000, 1000000000))
+    LS = LocalState(TEST_DIR, batch_hash_function)
+    assert LS.has_batch_hashing()
+    assert len(batches) == 1
+    assert set(LS.get_hash('/test17_%d.txt' % i, compute_if_none=False) for i in range(3)) <= set(['batch', 'single'])
+    assert 'batch' in [LS.get_hash('/test17_%d.txt' % i, compute_if_none=False) for i in range(3)]
+    assert LS.is_hash_current('/test17_0.txt') or LS.is_hash_current('/test17_1.txt')
+    # copy candidates are hashed at once
+    batches.clear()
+    for i in range(3):
+        LS.save_sizetime('/test17_%d.txt' % i, 4, 1000000000.0)
+    assert len(LS.get_files_by_hash_key('batch', (4, 1000000000.0))) == 2
+    assert batches == [3]
+    # failing batch: hashed one by one
+    def failing_hash_many(absolute_paths:list) -> dict:
+        raise OSError('daemon not available')
+    batch_hash_function.hash_many = failing_hash_many
+    LS = LocalState(TEST_DIR, batch_hash_function)
+    assert LS.get_hash('/test17_0.txt') == 'single'
+    for i in range(3):
+        os.remove(TEST_DIR + '/test17_%d.txt' % i)
+
+def test_LS_hash_key_unlocked(tmpdir):
+    root = str(tmpdir)
+    locked = None
+    def hash_function(absolute_path:str):
+        return 'single'
+    def try_lock():
+        locked.append(state.lock.acquire(timeout=1))
+        if locked[-1]:
+            state.lock.release()
+    def hash_many(absolute_paths:list) -> dict:
+        # another thread can use the local state while copy candidates are hashed
+        if locked is not None:
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+        return {x: 'same' for x in absolute_paths}
+    hash_function.hash_many = hash_many
+    for i in range(2):
+        with open(root + '/f%d.txt' % i, 'w') as f:
+            f.write('same')
+        os.utime(root + '/f%d.txt' % i, (1000000000, 1000000000))
+    state = LocalState(root, hash_function)
+    locked = []
+    for i in range(2):
+        state.save_sizetime('/f%d.txt' % i, 4, 1000000000.0)
+    assert state.get_files_by_hash_key('same', (4, 1000000000.0)) == set(['/f0.txt', '/f1.txt'])
+    assert locked == [True]
+    assert state.get_hash('/f0.txt', compute_if_none=False) == 'same'
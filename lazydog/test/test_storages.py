@@ -0,0 +1,188 @@
+
+import sys
+import os
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from storages import DictStorage, SQLiteStorage, DbmStorage
+from states import LocalState, BoundedDualAccessMemory
+
+TEST_DIR = None
+MEMORIES = []
+
+def test_open_memories(tmpdir):
+    global TEST_DIR
+    TEST_DIR = str(tmpdir)
+    MEMORIES.append(DictStorage().open_memory('hashes'))
+    MEMORIES.append(SQLiteStorage(TEST_DIR + '/index.db', batch_size=2).open_memory('sizetimes', ('size', 'mtime')))
+    MEMORIES.append(DbmStorage(TEST_DIR + '/index', batch_size=2).open_memory('sizetimes'))
+
+def test_memories_basics():
+    for m in MEMORIES:
+        m.save('/key1', (1, 2.5))
+        m['/key1bis'] = (1, 2.5)
+        m['/key2'] = ('DIR', 'DIR')
+        assert m.get('/key0') is None
+        assert m['/key1'] == (1, 2.5)
+        assert '/key1bis' in m
+        assert '/key0' not in m
+        assert m.get_by_value((1, 2.5)) == set(['/key1', '/key1bis'])
+        m['/key1bis'] = (2, 2.5)
+        assert m.get_by_value((1, 2.5)) == set(['/key1'])
+        assert m.get_by_value((3, 3)) == set()
+        m.flush()
+        assert m['/key2'] == ('DIR', 'DIR')
+
+def test_memories_recursive():
+    for m in MEMORIES:
+        m['/key2/sub1'] = (5, 5)
+        m['/key2/sub2'] = (5, 5)
+        m['/key20'] = (5, 5)
+        m.move('/key2', '/moved')
+        assert '/key2/sub1' not in m
+        assert m.get_by_value((5, 5)) == set(['/moved/sub1', '/moved/sub2', '/key20'])
+        assert m['/moved'] == ('DIR', 'DIR')
+        m.delete('/moved')
+        assert m.get_by_value((5, 5)) == set(['/key20'])
+        assert '/moved' not in m
+        # move to existing key
+        m.move('/key20', '/key1')
+        assert m['/key1'] == (5, 5)
+        assert m.get_by_value((1, 2.5)) == set()
+        assert sorted(m.keys()) == ['/key1', '/key1bis']
+
+def test_memories_shared_values():
+    for m in MEMORIES:
+        assert m.get_shared_values() == []
+        m['/key3'] = (2, 2.5)
+        assert m.get_shared_values() == [(2, 2.5)]
+        m.delete('/key3')
+        assert m.get_shared_values() == []
+
+def test_persistence():
+    MEMORIES[1].flush()
+    MEMORIES[2].flush()
+    m = SQLiteStorage(TEST_DIR + '/index.db').open_memory('sizetimes', ('size', 'mtime'))
+    assert m.get_by_value((5, 5)) == set(['/key1'])
+    assert m.get_by_value(('DIR', 'DIR')) == set()
+    MEMORIES[2].close()
+    m = DbmStorage(TEST_DIR + '/index').open_memory('sizetimes')
+    assert m.get_by_value((5, 5)) == set(['/key1'])
+    assert m['/key1bis'] == (2, 2.5)
+
+def test_LS_storage():
+    os.mkdir(TEST_DIR + '/watched')
+    os.mkdir(TEST_DIR + '/watched/dir')
+    with open(TEST_DIR + '/watched/dir/f.txt', 'w') as f:
+        f.write('storage')
+    storage = SQLiteStorage(':memory:')
+    LS = LocalState(TEST_DIR + '/watched', storage=storage)
+    file_hash = LS.get_hash('/dir/f.txt')
+    assert LS.get_files_by_hash_key(file_hash) == set(['/dir/f.txt'])
+    assert LS.get_inode('/dir/f.txt') == (os.stat(TEST_DIR + '/watched/dir/f.txt').st_dev, os.stat(TEST_DIR + '/watched/dir/f.txt').st_ino)
+    os.rename(TEST_DIR + '/watched/dir', TEST_DIR + '/watched/moved')
+    LS.move('/dir', '/moved')
+    LS.flush()
+    assert storage.execute('SELECT path FROM hashes WHERE hash = ?', (file_hash,)) == [('/moved/f.txt',)]
+    assert LS.get_dirs_by_fingerprint(LS.get_fingerprint('/moved')) == set(['/moved'])
+
+def test_dbm_key_index():
+    m = DbmStorage(TEST_DIR + '/keys', batch_size=2).open_memory('hashes')
+    for key in ['/b/2', '/a', '/b', '/b/1', '/b0', '/b/1/x']:
+        m[key] = 'hash'
+    assert sorted(m._keys) == ['/a', '/b', '/b/1', '/b/1/x', '/b/2', '/b0']
+    assert m._get_children('/b') == ['/b/1', '/b/1/x', '/b/2', '/b']
+    m.delete('/b/1')
+    m['/b/1'] = 'other'
+    assert m._get_children('/b') == ['/b/1', '/b/2', '/b']
+    m.move('/b', '/c')
+    assert sorted(m._keys) == ['/a', '/b0', '/c', '/c/1', '/c/2']
+    assert '/c/2' in m and '/b/2' not in m
+    m.close()
+    # the index is loaded again from the databases
+    m = DbmStorage(TEST_DIR + '/keys').open_memory('hashes')
+    assert m._get_children('/c') == ['/c/1', '/c/2', '/c']
+    assert m['/c/1'] == 'other'
+
+def test_dbm_by_value_entries():
+    m = DbmStorage(TEST_DIR + '/values', batch_size=2).open_memory('sizetimes')
+    for key, value in [('/a', (1, 1.0)), ('/b', (1, 1.0)), ('/c', (2, 1.0)), ('/d', (1, 10.0))]:
+        m[key] = value
+    m['/c'] = (1, 1.0)
+    m['/a'] = (1, 1.0)
+    m.flush()
+    # one entry per value and key, the previous value of '/c' being deleted
+    assert sorted(m._dual_memories.keys()) == [b'[1, 1.0]\0/a', b'[1, 1.0]\0/b', b'[1, 1.0]\0/c', b'[1, 10.0]\0/d']
+    assert m.get_by_value((1, 1.0)) == set(['/a', '/b', '/c'])
+    assert m.get_by_value((1, 10.0)) == set(['/d'])
+    assert m.get_shared_values() == [(1, 1.0)]
+    m.move('/c', '/e')
+    m.delete('/a')
+    m.close()
+    m = DbmStorage(TEST_DIR + '/values').open_memory('sizetimes')
+    assert m.get_by_value((1, 1.0)) == set(['/b', '/e'])
+    assert m.get_by_value((2, 1.0)) == set()
+
+def test_dbm_threads():
+    # the indexer and hashing threads read the memories while the state is updated
+    m = DbmStorage(TEST_DIR + '/threads', batch_size=10).open_memory('hashes')
+    errors = []
+    def read():
+        try:
+            for _ in range(2000):
+                m.get_by_value('hash')
+                m.get('/a/1')
+                m.get_shared_values()
+        except Exception as e:
+            errors.append(e)
+    thread = threading.Thread(target=read)
+    thread.start()
+    for i in range(200):
+        for j in range(5):
+            m['/a/%d' % j] = 'hash'
+        m.move('/a', '/b')
+        m.delete('/b')
+    thread.join()
+    assert errors == []
+    m.close()
+
+def test_LS_side_state_storage():
+    with open(TEST_DIR + '/watched/big.bin', 'wb') as f:
+        f.write(b'a' * 1024 * 1024)
+    os.utime(TEST_DIR + '/watched/big.bin', (1000000000, 1000000000))
+    storage = DbmStorage(TEST_DIR + '/side')
+    LS = LocalState(TEST_DIR + '/watched', storage=storage, keep_block_digests=True)
+    assert LS.is_hash_current('/big.bin')
+    LS.delete('/big.bin')
+    LS.get_hash('/big.bin')
+    LS.flush()
+    # signatures, sampled digests and block digests are kept in the storage
+    LS = LocalState(TEST_DIR + '/watched', storage=storage, keep_block_digests=True, 
+                    custom_intializing_values={})
+    assert LS.is_hash_current('/big.bin')
+    assert LS.has_same_sample_digest('/big.bin')
+    assert LS.block_digests['/big.bin'][0] == LS.get_hash('/big.bin', compute_if_none=False)
+    with open(TEST_DIR + '/watched/big.bin', 'r+b') as f:
+        f.write(b'b')
+    LS.hash_function(TEST_DIR + '/watched/big.bin')
+    assert LS.get_changed_blocks('/big.bin') == [0]
+    LS.move('/big.bin', '/moved.bin')
+    assert '/moved.bin' in LS.hash_signatures and '/moved.bin' in LS.sample_digests
+    LS.delete('/moved.bin')
+    assert '/moved.bin' not in LS.hash_signatures and '/moved.bin' not in LS.block_digests
+
+def test_storage_spill_store():
+    storage = SQLiteStorage(':memory:')
+    memory = BoundedDualAccessMemory(1, storage.open_memory('spilled_hashes', ('hash',)))
+    for key in ['/d/1', '/d/2', '/e']:
+        memory[key] = 'hash' + key
+    # the storage is the record of the evicted keys: none is kept in memory
+    assert dict(memory.memories) == {'/e': 'hash/e'}
+    assert memory.evicted is None and memory._spilled_keys is None
+    memory.move('/d', '/f')
+    assert memory.is_evicted('/f/1') and not memory.is_evicted('/d/1')
+    assert memory.get('/f/2') == 'hash/d/2' and memory.spill_hits == 1
+    assert not memory.is_evicted('/f/2') and memory.is_evicted('/e')
+    memory.delete('/f')
+    assert '/f/1' not in memory and '/f/2' not in memory
+    assert storage.execute('SELECT path FROM spilled_hashes WHERE hash IS NOT NULL') == [('/e',)]
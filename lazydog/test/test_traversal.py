@@ -0,0 +1,59 @@
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from traversal import scan_tree, relative_entry_paths, DirectoryListings
+
+TEST_DIR = None
+
+def create_dir(dirname:str):
+    os.mkdir(TEST_DIR + dirname)
+
+def create_file(filename:str):
+    os.mknod(TEST_DIR + filename)
+
+def test_scan_tree_basics(tmpdir):
+    global TEST_DIR
+    TEST_DIR = str(tmpdir)
+    create_dir('/dir1')
+    create_dir('/dir1/dir2')
+    create_file('/file1.txt')
+    create_file('/dir1/file2.txt')
+    create_file('/dir1/dir2/file3.txt')
+    paths = [e.path for e in scan_tree(TEST_DIR)]
+    assert sorted(paths) == sorted([TEST_DIR + x for x in ['/dir1', '/dir1/dir2', '/file1.txt', '/dir1/file2.txt', '/dir1/dir2/file3.txt']])
+    # every directory is yielded before its content
+    assert paths.index(TEST_DIR + '/dir1') < paths.index(TEST_DIR + '/dir1/file2.txt')
+    assert paths.index(TEST_DIR + '/dir1/dir2') < paths.index(TEST_DIR + '/dir1/dir2/file3.txt')
+
+def test_scan_tree_exclude():
+    paths = [e.path for e in scan_tree(TEST_DIR, exclude=lambda e: e.name == 'dir2')]
+    assert sorted(paths) == sorted([TEST_DIR + x for x in ['/dir1', '/file1.txt', '/dir1/file2.txt']])
+
+def test_scan_tree_symlinks():
+    os.symlink(TEST_DIR + '/dir1', TEST_DIR + '/link1')
+    paths = [e.path for e in scan_tree(TEST_DIR)]
+    assert TEST_DIR + '/link1' in paths
+    assert TEST_DIR + '/link1/file2.txt' not in paths
+    assert TEST_DIR + '/link1/file2.txt' in [e.path for e in scan_tree(TEST_DIR, follow_symlinks=True)]
+    os.remove(TEST_DIR + '/link1')
+
+def test_relative_entry_paths():
+    assert relative_entry_paths(TEST_DIR + '/dir1') == set(['dir2', 'file2.txt', 'dir2/file3.txt'])
+    assert relative_entry_paths(TEST_DIR + '/unexisting') == set()
+
+def test_directory_listings():
+    listings = DirectoryListings(max_directories=1)
+    assert listings.get(TEST_DIR + '/dir1/file2.txt').name == 'file2.txt'
+    assert listings.get(TEST_DIR + '/dir1/unexisting') is None
+    assert listings.get(TEST_DIR + '/dir1/dir2/') is not None
+    assert listings.scanned == 1
+    assert listings.get(TEST_DIR + '/unexisting/file.txt') is None
+    entry = listings.get(TEST_DIR + '/file1.txt')
+    file_stat = os.stat(TEST_DIR + '/file1.txt')
+    assert listings.get_inode(entry) == (file_stat.st_dev, file_stat.st_ino)
+    # broken symbolic link does not exist
+    os.symlink(TEST_DIR + '/unexisting', TEST_DIR + '/link2')
+    assert DirectoryListings().get(TEST_DIR + '/link2') is None
+    os.remove(TEST_DIR + '/link2')
@@ -0,0 +1,119 @@
+
+import sys
+import os
+import time
+import shutil
+import asyncio
+import threading
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from watchers import AsyncWatcher, MultiRootWatcher
+
+async def watch(watched_dir:str, batch_size:int=None, batch_timeout:float=0) -> list:
+    received = []
+    async with AsyncWatcher(watched_dir) as watcher:
+        # the handler is not running as a thread
+        assert not watcher.handler.is_alive()
+        for name in ['/a.txt', '/b.txt']:
+            with open(watched_dir + name, 'w') as f:
+                f.write(name)
+        os.rename(watched_dir + '/b.txt', watched_dir + '/c.txt')
+        async def consume():
+            async for item in watcher.events(batch_size, batch_timeout):
+                received.append(item)
+                if sum(len(x) if isinstance(x, list) else 1 for x in received) == 2:
+                    return
+        await asyncio.wait_for(consume(), 10)
+    return received
+
+def test_AW_events(tmpdir):
+    received = asyncio.run(watch(str(tmpdir)))
+    assert [(e.type, e.path) for e in received] == [('created', '/a.txt'), ('created', '/c.txt')]
+
+def test_AW_batches(tmpdir):
+    received = asyncio.run(watch(str(tmpdir), batch_size=10, batch_timeout=0.1))
+    assert len(received) == 1
+    assert [(e.type, e.path) for e in received[0]] == [('created', '/a.txt'), ('created', '/c.txt')]
+
+def test_MRW_roots(tmpdir):
+    roots = [str(tmpdir) + '/one', str(tmpdir) + '/two']
+    for root in roots:
+        os.mkdir(root)
+    os.mkdir(roots[0] + '/d')
+    for name in ['/f.txt', '/k.txt', '/d/e.txt']:
+        with open(roots[0] + name, 'w') as f:
+            f.write(name * 10)
+    watcher = MultiRootWatcher(hashing_workers=2)
+    watcher.add_root('one', roots[0])
+    watcher.add_root('two', roots[1])
+    for root in [roots[0] + '/d', str(tmpdir)]:
+        try:
+            watcher.add_root('three', root)
+            assert False
+        except ValueError:
+            pass
+    watcher.start()
+    try:
+        deadline = time.time() + 10
+        while not watcher.is_ready() and time.time() < deadline:
+            time.sleep(0.1)
+        assert watcher.is_ready()
+        shutil.copy2(roots[0] + '/f.txt', roots[1] + '/g.txt')
+        os.rename(roots[0] + '/k.txt', roots[1] + '/k.txt')
+        os.rename(roots[0] + '/d', roots[1] + '/d')
+        with open(roots[0] + '/new.txt', 'w') as f:
+            f.write('new')
+        received = []
+        while len(received) < 4 and time.time() < deadline + 10:
+            time.sleep(0.2)
+            received.extend(watcher.get_available_events())
+        summary = sorted(((e.root_id, e.src_root_id, e.type, e.path, e.to_path) for e in received), key=str)
+        assert summary == [('one', None, 'created', '/new.txt', None), 
+                           ('two', 'one', 'copied', '/f.txt', '/g.txt'), 
+                           ('two', 'one', 'moved', '/d', '/d'), 
+                           ('two', 'one', 'moved', '/k.txt', '/k.txt')]
+        # the values of the moved files are now known by the destination root only
+        two = watcher.handlers['two'].local_states
+        assert two.get_hash('/d/e.txt', compute_if_none=False) is not None
+        assert watcher.handlers['one'].local_states.get_hash('/d/e.txt', compute_if_none=False) is None
+    finally:
+        watcher.stop()
+        watcher.join(5)
+    assert not watcher.is_alive()
+
+def test_MRW_posttreatment(tmpdir):
+    # a root busy hashing delays neither the reading of the events nor the other roots
+    roots = [str(tmpdir) + '/one', str(tmpdir) + '/two']
+    for root in roots:
+        os.mkdir(root)
+    hashing_threads = []
+    def hashing_function(absolute_path:str):
+        if absolute_path.endswith('/slow.txt'):
+            hashing_threads.append(threading.current_thread())
+            time.sleep(3)
+        return 'HASH' + absolute_path
+    watcher = MultiRootWatcher(hashing_function)
+    watcher.add_root('one', roots[0])
+    watcher.add_root('two', roots[1])
+    watcher.start()
+    try:
+        deadline = time.time() + 10
+        while not watcher.is_ready() and time.time() < deadline:
+            time.sleep(0.1)
+        start = time.time()
+        with open(roots[0] + '/slow.txt', 'w') as f:
+            f.write('slow')
+        with open(roots[1] + '/fast.txt', 'w') as f:
+            f.write('fast')
+        received = {}
+        while len(received) < 2 and time.time() < start + 15:
+            time.sleep(0.1)
+            for e in watcher.get_available_events():
+                received[e.path] = time.time() - start
+        assert set(received) == set(['/slow.txt', '/fast.txt'])
+        assert received['/fast.txt'] < 3 < received['/slow.txt']
+        assert hashing_threads and watcher not in hashing_threads
+    finally:
+        watcher.stop()
+        watcher.join(10)
+    assert not watcher.is_alive()
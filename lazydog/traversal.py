@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018 Clément Warneys <clement.warneys@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+:module: lazydog.traversal
+:synopsis: Shared directory-tree traversal helpers, based on :py:func:`os.scandir`.
+:author: Clément Warneys <clement.warneys@gmail.com>
+
+Every place where lazydog needs to browse a directory tree (initial indexing
+of the :py:class:`~lazydog.states.LocalState`, counting files of a directory,
+comparing two folders, or simulating events for a directory moved into the
+watched one) relies on the :py:func:`scan_tree` generator defined here. Checking
+the existence of many given paths relies on :py:class:`DirectoryListings`.
+
+Compared to :py:func:`os.walk` followed by one ``os.path.*`` call per entry,
+:py:func:`scan_tree` directly yields the :py:class:`os.DirEntry` objects returned by
+:py:func:`os.scandir`, so the caller can use the file type (``d_type``) and the
+cached ``stat`` information without any additional system call.
+
+"""
+
+import os
+import collections
+
+
+def scan_tree(absolute_path:str, follow_symlinks:bool=False, exclude=None):
+    """
+    Iteratively browses the ``absolute_path`` directory and all its sub-directories,
+    and yields one :py:class:`os.DirEntry` object per file or directory found
+    (the ``absolute_path`` directory itself is not yielded).
+
+    The traversal uses an explicit stack instead of recursion, so the depth of
+    the tree is not limited by the interpreter. Each directory is yielded before
+    its own content, so the caller can do something with a directory (for example
+    putting it under observation) before getting its children. Directories that
+    cannot be read (deleted in the meantime, permission denied...) are silently
+    skipped.
+
+    :param absolute_path:
+        Absolute path of the directory to browse.
+    :type absolute_path:
+        str
+    :param follow_symlinks:
+        *Optional*. ``False`` by default, which means that symbolic links to
+        directories are yielded but never browsed.
+    :type follow_symlinks:
+        boolean
+    :param exclude:
+        *Optional*. Function receiving an :py:class:`os.DirEntry` and returning
+        ``True`` if the entry shall be excluded. An excluded entry is not
+        yielded, and if it is a directory, its content is not browsed at all.
+    :type exclude:
+        function
+    :returns:
+        A generator of :py:class:`os.DirEntry` objects.
+    :rtype:
+        generator
+    """
+    stack = [absolute_path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                subdirs = []
+                for entry in entries:
+                    if exclude is not None and exclude(entry):
+                        continue
+                    yield entry
+                    try:
+                        if entry.is_dir(follow_symlinks=follow_symlinks):
+                            subdirs.append(entry.path)
+                    except OSError:
+                        pass
+        except OSError:
+            continue
+        # reversed, so that sub-directories are browsed in scandir order
+        stack.extend(reversed(subdirs))
+
+
+def is_dir_entry(entry:os.DirEntry) -> bool:
+    """
+    Returns ``True`` if the :py:class:`os.DirEntry` in parameter is a directory
+    (following symbolic links, as :py:func:`os.path.isdir` does). ``False`` if it
+    is not, or if it does not exist anymore.
+    """
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+def relative_entry_paths(absolute_path:str, follow_symlinks:bool=False, exclude=None) -> set:
+    """
+    Returns the set of the paths (relative to ``absolute_path``) of every
+    file and directory contained in the ``absolute_path`` directory, recursively.
+    Empty ``set()`` if the directory does not exist.
+    """
+    prefix_len = len(os.path.join(absolute_path, ''))
+    return set(entry.path[prefix_len:] for entry in scan_tree(absolute_path, follow_symlinks, exclude))
+
+
+class DirectoryListings():
+    """
+    Checks the existence of many paths with a single :py:func:`os.scandir` call 
+    per directory, instead of one ``os.path.exists`` call per path. The listings 
+    of the ``max_directories`` latest directories are kept, so that paths grouped 
+    by directory (as in a sorted list of paths) are checked with exactly one 
+    ``scandir`` per directory.
+
+    :param max_directories:
+        *Optional*. Number of directory listings kept, 64 by default.
+    :type max_directories:
+        int
+    """
+
+    def __init__(self, max_directories:int=64):
+        self.max_directories = max_directories
+        # absolute directory path -> (st_dev, {name: os.DirEntry}), or None if unreadable
+        self._listings = collections.OrderedDict()
+        self.scanned = 0
+
+    def _listing(self, absolute_dir_path:str):
+        if absolute_dir_path in self._listings:
+            self._listings.move_to_end(absolute_dir_path)
+            return self._listings[absolute_dir_path]
+        try:
+            device = os.stat(absolute_dir_path).st_dev
+            with os.scandir(absolute_dir_path) as entries:
+                listing = (device, {entry.name: entry for entry in entries})
+        except OSError:
+            listing = None
+        self.scanned += 1
+        self._listings[absolute_dir_path] = listing
+        if len(self._listings) > self.max_directories:
+            self._listings.popitem(last=False)
+        return listing
+
+    def get(self, absolute_path:str) -> os.DirEntry:
+        """
+        Returns the :py:class:`os.DirEntry` of the ``absolute_path`` file or
+        directory, or ``None`` if it does not exist (as for :py:func:`os.path.exists`, 
+        a symbolic link whose target does not exist does not exist either).
+        """
+        absolute_path = os.path.normpath(absolute_path)
+        listing = self._listing(os.path.dirname(absolute_path))
+        entry = listing[1].get(os.path.basename(absolute_path)) if listing is not None else None
+        if entry is not None and entry.is_symlink() and not os.path.exists(absolute_path):
+            return None
+        return entry
+
+    def get_inode(self, entry:os.DirEntry) -> tuple:
+        """
+        Returns the ``(st_dev, st_ino)`` couple of the :py:class:`os.DirEntry` 
+        returned by :py:meth:`get`, as :py:func:`os.stat` would (following symbolic 
+        links), or ``None`` if it does not exist anymore. Regular files are on the 
+        device of their directory, so no system call is needed for them.
+        """
+        try:
+            if entry.is_symlink() or entry.is_dir():
+                file_stat = entry.stat()
+                return (file_stat.st_dev, file_stat.st_ino)
+            return (self._listing(os.path.dirname(entry.path))[0], entry.inode())
+        except (OSError, TypeError):
+            return None
@@ -0,0 +1,680 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018 Clément Warneys <clement.warneys@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+:module: lazydog.watchers
+:synopsis: :py:mod:`asyncio` and multi-directory front ends of the high-level events handler.
+:author: Clément Warneys <clement.warneys@gmail.com>
+
+The :py:class:`AsyncWatcher` class watches a directory from an :py:mod:`asyncio`
+event loop, without any dedicated thread::
+
+    async with AsyncWatcher('/path/to/watch') as watcher:
+        async for event in watcher.events():
+            print(event)
+
+The ``inotify`` file descriptor is registered with :py:meth:`asyncio.loop.add_reader`,
+and the low-level events are aggregated by a :py:class:`~lazydog.handlers.FusedEventHandler`
+(which is not started as a thread). Reading and pairing the events is done by
+the event loop, while the post-treatment (which may hash files) runs in an executor.
+Several watchers can share the same executor, so that watching many directories
+does not cost one thread per directory.
+
+The :py:class:`MultiRootWatcher` class watches many directories from a single
+thread, with a single ``inotify`` file descriptor and a single pool of hashing
+threads (the post-treatments of the roots running in an executor, as well), and 
+recognizes the copies and moves between them::
+
+    watcher = MultiRootWatcher()
+    watcher.add_root('project-1', '/path/to/project-1')
+    watcher.add_root('project-2', '/path/to/project-2')
+    watcher.start()
+    for event in watcher.get_available_events():
+        print(event.root_id, event)
+
+"""
+
+import os
+import time
+import asyncio
+import logging
+import selectors
+import threading
+import collections
+import concurrent.futures
+
+from lazydog.states import LocalState
+from lazydog.queues import DatedlocaleventQueue
+from lazydog.indexers import BackgroundIndexer, HashingScheduler
+from lazydog.handlers import HighlevelEventHandler, FusedEventHandler, MovePairing
+from lazydog.revised_watchdog.events import EVENT_TYPE_OVERFLOW
+from watchdog.events import EVENT_TYPE_MOVED, DirCreatedEvent, FileCreatedEvent, DirDeletedEvent, FileDeletedEvent
+from watchdog.utils import unicode_paths
+
+
+class AsyncWatcher():
+    """
+    Watches the ``watched_dir`` directory from the running :py:mod:`asyncio`
+    event loop. Use :py:meth:`start` and :py:meth:`close`, or an ``async with``
+    statement, then iterate over :py:meth:`events`.
+
+    :param watched_dir:
+        The path you want to watch.
+    :type watched_dir:
+        str
+    :param executor:
+        *Optional*. The :py:class:`concurrent.futures.Executor` running the initial
+        indexing and the post-treatment of the events. The default executor of the
+        event loop is used by default.
+    :type executor:
+        :py:class:`concurrent.futures.Executor`
+    :param options:
+        *Optional*. Any other parameter of :py:meth:`~lazydog.handlers.HighlevelEventHandler.get_instance`,
+        for example ``hashing_function`` or ``background_indexing``.
+    """
+
+    def __init__(self, watched_dir:str, executor=None, **options):
+        self.watched_dir = watched_dir
+        self.executor = executor
+        self.options = options
+        self.handler = None
+        self._loop = None
+        self._released = None
+        self._timer = None
+        # classified low-level events waiting for the post-treatment
+        self._waiting_events = []
+        self._processing = None
+        self._closed = False
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def start(self):
+        """
+        Indexes the watched directory (in the executor), then starts watching it.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._released = asyncio.Queue()
+        self.handler = await self._loop.run_in_executor(
+            self.executor, lambda: HighlevelEventHandler.get_instance(self.watched_dir, fused_pipeline=True, **self.options))
+        self._loop.add_reader(self.handler._inotify._inotify_fd, self._on_readable)
+
+    async def close(self):
+        """
+        Stops watching the directory. The iterators of :py:meth:`events` stop
+        once the events already released have been consumed.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+        if self.handler is not None:
+            self._loop.remove_reader(self.handler._inotify._inotify_fd)
+            if self._processing is not None:
+                await self._processing
+            self.handler.stop()
+            self.handler._inotify.close()
+        if self._released is not None:
+            self._released.put_nowait(None)
+
+    def _on_readable(self):
+        # called by the event loop when some low-level events can be read
+        self._handle_events(self.handler._inotify.read_events())
+
+    def _on_timer(self):
+        # called by the event loop when something is due (see FusedEventHandler._next_timeout)
+        self._timer = None
+        if self.handler._inotify.has_pending_simulations():
+            self._handle_events(self.handler._inotify.read_events())
+        else:
+            self._handle_events([])
+
+    def _handle_events(self, inotify_events:list):
+        now = time.monotonic()
+        self.handler._moves.add(inotify_events, now)
+        self._waiting_events.extend(self.handler._moves.ready_events(now))
+        self._posttreat()
+
+    def _posttreat(self):
+        # one post-treatment at a time: the events read in the meantime wait for the next one
+        if self._closed or self._processing is not None:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._processing = self._loop.run_in_executor(self.executor, self._posttreat_in_executor, self._waiting_events)
+        self._waiting_events = []
+        self._processing.add_done_callback(self._posttreated)
+
+    def _posttreat_in_executor(self, events:list) -> list:
+        # post-treats the events, and returns the released high-level events
+        if events:
+            self.handler.lowlevel_event_queue.dispatch_many(events)
+        self.handler._posttreat_queued_events()
+        return HighlevelEventHandler.get_available_events(self.handler)
+
+    def _posttreated(self, future):
+        self._processing = None
+        try:
+            released = future.result()
+        except Exception:
+            logging.exception('Post-treatment of the events of %s failed', self.watched_dir)
+            released = []
+        for event in released:
+            self._released.put_nowait(event)
+        if self._closed:
+            return
+        if self._waiting_events:
+            self._posttreat()
+            return
+        timeout = self.handler._next_timeout(time.monotonic())
+        if timeout is not None:
+            self._timer = self._loop.call_later(timeout, self._on_timer)
+
+    async def events(self, batch_size:int=None, batch_timeout:float=0):
+        """
+        Asynchronous iterator of the high-level events, as they are released
+        (see :py:meth:`~lazydog.handlers.HighlevelEventHandler.get_available_events`).
+
+        :param batch_size:
+            *Optional*. If given, lists of at most ``batch_size`` events are
+            yielded instead of single events.
+        :type batch_size:
+            int
+        :param batch_timeout:
+            *Optional*. Number of seconds waiting for more events to complete a
+            batch, once its first event has been released. By default, a batch
+            only contains the events already released.
+        :type batch_timeout:
+            float
+        """
+        while True:
+            event = await self._released.get()
+            if event is None:
+                self._released.put_nowait(None)
+                return
+            if batch_size is None:
+                yield event
+                continue
+            batch = [event]
+            deadline = self._loop.time() + batch_timeout
+            while len(batch) < batch_size:
+                if self._released.empty():
+                    timeout = deadline - self._loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        event = await asyncio.wait_for(self._released.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    event = self._released.get_nowait()
+                if event is None:
+                    self._released.put_nowait(None)
+                    break
+                batch.append(event)
+            yield batch
+
+
+class MultiRootWatcher(threading.Thread):
+    """
+    Watches several directories (the *roots*, added with :py:meth:`add_root`) 
+    from a single thread. Every root keeps its own :py:class:`~lazydog.states.LocalState` 
+    and :py:class:`~lazydog.handlers.FusedEventHandler` (which is not started as a 
+    thread), but all of them share:
+
+    * the same ``inotify`` instance, read by this thread, which pairs the moves \
+    and routes each low-level event to the root it belongs to,
+    * the same :py:class:`~lazydog.indexers.HashingScheduler`, hashing the files \
+    of the roots, which are indexed in the background one after another,
+    * the same :py:class:`concurrent.futures.Executor`, running the post-treatment \
+    of the events of the roots (which may hash files), so that a root busy hashing \
+    delays neither the reading of the events nor the other roots. The post-treatments \
+    of a same root run one at a time, in order.
+
+    The released high-level events (see :py:meth:`get_available_events`) carry the 
+    identifier of their root in their ``root_id`` attribute. Between roots:
+
+    * a move is released as a single `Moved` event, whose ``path`` is relative to \
+    the root identified by ``src_root_id``, and whose ``to_path`` is relative to \
+    the root identified by ``root_id``,
+    * a created file having the same size, modification time and hash value as \
+    a file of another root (the indexes of every root are looked up) is released \
+    as a `Copied` event, with the same ``src_root_id`` convention.
+
+    :param hashing_function:
+        *Optional*. Custom hashing function of every root, see 
+        :py:meth:`~lazydog.handlers.HighlevelEventHandler.get_instance`.
+    :type hashing_function:
+        function
+    :param hashing_workers:
+        *Optional*. Number of hashing threads per device, shared by all the roots 
+        (either an integer, or a dictionary ``{st_dev: workers}``).
+    :type hashing_workers:
+        int
+    :param io_friendly_hashing:
+        *Optional*. ``False`` by default, see 
+        :py:meth:`~lazydog.handlers.HighlevelEventHandler.get_instance`.
+    :type io_friendly_hashing:
+        boolean
+    :param executor:
+        *Optional*. The :py:class:`concurrent.futures.Executor` running the 
+        post-treatments. By default, the watcher has its own thread pool, shut 
+        down when the watcher stops.
+    :type executor:
+        :py:class:`concurrent.futures.Executor`
+    """
+
+    MOVE_MERGING_DELAY = HighlevelEventHandler.POSTTREATMENT_TIME_LIMIT.total_seconds()
+    """
+    Number of seconds a released half of a move between roots (the `Deleted` 
+    event of the source root, or the `Created` event of the destination one) 
+    waits for the other half, before being released as it is.
+    """
+
+    def __init__(self, hashing_function=None, hashing_workers=1, io_friendly_hashing:bool=False, executor=None):
+        super(MultiRootWatcher, self).__init__()
+        self.name = 'Multi-root event watcher'
+        self.hashing_function = hashing_function
+        self.io_friendly_hashing = io_friendly_hashing
+        self.scheduler = HashingScheduler(None, hashing_workers, io_friendly_hashing)
+        self.scheduler.start()
+        # handlers and absolute paths of the roots, by root identifier
+        self.handlers = {}
+        self._roots_by_path = {}
+        self._lock = threading.Lock()
+        # created by the first root, then shared
+        self._inotify = None
+        self._moves = MovePairing(FusedEventHandler.MOVE_PAIRING_DELAY)
+        # moves between roots: (src root, src path, reading time) by (dest root, dest path)
+        self._moves_between_roots = {}
+        # released halves of these moves, with their release time
+        self._held = []
+        # roots waiting for their background indexing, and the indexing thread
+        self._to_index = collections.deque()
+        self._indexing_thread = None
+        # post-treatments: the executor, the roots being post-treated, and their released events
+        self._own_executor = executor is None
+        self.executor = executor if executor is not None else concurrent.futures.ThreadPoolExecutor(
+            thread_name_prefix='Multi-root post-treatment')
+        self._processing = set()
+        self._posttreated = []
+        # high-level events prepared by the watcher thread
+        self._released = []
+        self._released_lock = threading.Lock()
+        self._stop_watcher = threading.Event()
+        self._wakeup = os.pipe()
+
+    def add_root(self, root_id, watched_dir:str, custom_intializing_values=None, event_masks:dict=None, 
+                 **options) -> FusedEventHandler:
+        """
+        Starts watching the ``watched_dir`` directory, before or after the watcher 
+        is started. Unless ``custom_intializing_values`` are provided, the directory 
+        is indexed in the background (see :py:meth:`is_ready`). Raises ``ValueError`` 
+        if ``root_id`` is already used, or if the directory is inside (or contains)
+        another root.
+
+        :param root_id:
+            Identifier of the root, given to its high-level events.
+        :type root_id:
+            str
+        :param watched_dir:
+            The path you want to watch.
+        :type watched_dir:
+            str
+        :param custom_intializing_values:
+            *Optional*. See :py:meth:`~lazydog.handlers.HighlevelEventHandler.get_instance`.
+        :type custom_intializing_values:
+            dict
+        :param event_masks:
+            *Optional*. See :py:meth:`~lazydog.handlers.HighlevelEventHandler.get_instance`.
+        :type event_masks:
+            dict
+        :param options:
+            *Optional*. Any other parameter of :py:class:`~lazydog.states.LocalState`,
+            for example ``max_resident_hashes``, ``storage`` or ``path_filter``.
+        :returns: 
+            The handler of the root.
+        :rtype: 
+            :py:class:`~lazydog.handlers.FusedEventHandler`
+        """
+        watched_dir = os.path.abspath(watched_dir)
+        with self._lock:
+            if root_id in self.handlers:
+                raise ValueError('Root already watched: %s' % root_id)
+            for path in self._roots_by_path:
+                if (path == watched_dir or path.startswith(os.path.join(watched_dir, '')) or 
+                        watched_dir.startswith(os.path.join(path, ''))):
+                    raise ValueError('%s overlaps the already watched %s' % (watched_dir, path))
+            local_states = LocalState(watched_dir, self.hashing_function, custom_intializing_values, 
+                                      defer_indexing=True, io_friendly_hashing=self.io_friendly_hashing, **options)
+            dated_event_queue = DatedlocaleventQueue(local_states)
+            if self._inotify is None:
+                handler = FusedEventHandler(dated_event_queue, local_states, event_masks=event_masks)
+                self._inotify = handler._inotify
+            else:
+                handler = FusedEventHandler(dated_event_queue, local_states, self._inotify, event_masks)
+            self.handlers[root_id] = handler
+            self._roots_by_path[watched_dir] = root_id
+            if custom_intializing_values is None:
+                local_states.indexer = BackgroundIndexer(local_states, scheduler=self.scheduler)
+                self._to_index.append(local_states.indexer)
+                if self._indexing_thread is None:
+                    self._indexing_thread = threading.Thread(target=self._index_roots, name='Multi-root indexer')
+                    self._indexing_thread.daemon = True
+                    self._indexing_thread.start()
+        # the watcher thread registers the inotify file descriptor, if not done yet
+        self._wake_up()
+        return handler
+
+    def _index_roots(self):
+        # indexes the roots one after another, their files being hashed by the shared scheduler
+        while True:
+            with self._lock:
+                if not self._to_index or self._stop_watcher.is_set():
+                    self._indexing_thread = None
+                    return
+                indexer = self._to_index.popleft()
+            indexer.run()
+
+    def _wake_up(self):
+        wakeup = self._wakeup
+        if wakeup is not None:
+            try:
+                os.write(wakeup[1], b'\0')
+            except OSError:
+                pass
+
+    def stop(self):
+        """
+        Stops the watcher thread, the indexing of the roots, and the hashing threads.
+        """
+        self._stop_watcher.set()
+        self._wake_up()
+
+    def is_ready(self) -> bool:
+        """
+        Returns ``True`` once every root is fully indexed, see 
+        :py:meth:`~lazydog.handlers.HighlevelEventHandler.is_ready`.
+        """
+        with self._lock:
+            return all(x.is_ready() for x in self.handlers.values())
+
+    def is_idle(self) -> bool:
+        """
+        Returns ``True`` if there is neither any pending low-level event, 
+        nor any high-level event waiting to be released, in any root.
+        """
+        with self._lock:
+            handlers = list(self.handlers.values())
+        return (self._moves.is_empty() and not self._held and not self._released and 
+                not self._processing and not self._posttreated and all(x.is_idle() for x in handlers))
+
+    def get_available_events(self) -> list:
+        """
+        Returns the list of the high-level events of every root that have been 
+        released by the watcher thread since the last call. See 
+        :py:meth:`~lazydog.handlers.HighlevelEventHandler.get_available_events`.
+        """
+        with self._released_lock:
+            released, self._released = self._released, []
+        return released
+
+    def _root_of(self, path:str):
+        # identifier of the root containing the absolute path, or None
+        while True:
+            root_id = self._roots_by_path.get(path)
+            if root_id is not None:
+                return root_id
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+    def _route(self, events:list, now:float) -> set:
+        """
+        Private method dispatching the low-level events to the queues of their 
+        roots (overflows to every root). A move between roots is split into a 
+        `Deleted` and a `Created` event, whose high-level events are merged again 
+        when released (see :py:meth:`_merge_moves_between_roots`). Returns the 
+        identifiers of the roots having received some events.
+        """
+        batches = collections.defaultdict(list)
+        with self._lock:
+            for event in events:
+                if event.event_type == EVENT_TYPE_OVERFLOW:
+                    for root_id in self.handlers:
+                        batches[root_id].append(event)
+                    continue
+                root_id = self._root_of(event.src_path)
+                if event.event_type == EVENT_TYPE_MOVED:
+                    dest_root_id = self._root_of(event.dest_path)
+                    if dest_root_id != root_id:
+                        if root_id is not None:
+                            cls = DirDeletedEvent if event.is_directory else FileDeletedEvent
+                            batches[root_id].append(cls(event.src_path))
+                        if dest_root_id is not None:
+                            cls = DirCreatedEvent if event.is_directory else FileCreatedEvent
+                            batches[dest_root_id].append(cls(event.dest_path))
+                        if root_id is not None and dest_root_id is not None:
+                            src_states = self.handlers[root_id].local_states
+                            dest_states = self.handlers[dest_root_id].local_states
+                            src_path = src_states.relative_local_path(event.src_path)
+                            dest_path = dest_states.relative_local_path(event.dest_path)
+                            self._moves_between_roots[(dest_root_id, dest_path)] = (root_id, src_path, now)
+                            if event.is_directory:
+                                # the content of the folder is known, and not hashed again
+                                MultiRootWatcher._copy_values(src_states, src_path, dest_states, dest_path)
+                        elif dest_root_id is not None and event.is_directory:
+                            # the content of the folder is new to the destination root
+                            self._inotify.simulate_moved_in(unicode_paths.encode(event.dest_path))
+                        continue
+                if root_id is not None:
+                    batches[root_id].append(event)
+            handlers = dict((x, self.handlers[x]) for x in batches)
+        for root_id, batch in batches.items():
+            handlers[root_id].lowlevel_event_queue.dispatch_many(batch)
+        return set(batches)
+
+    @staticmethod
+    def _copy_values(src_states:LocalState, src_path:str, dest_states:LocalState, dest_path:str):
+        # saves the known values of the content of a folder moved between roots
+        for key, file_hash, file_size, file_mtime in src_states.get_tree_values(src_path):
+            if key == src_path:
+                continue
+            key = dest_path + key[len(src_path):]
+            if file_hash is None:
+                dest_states.save_sizetime(key, file_size, file_mtime)
+            else:
+                dest_states.save(key, file_hash, file_size, file_mtime)
+
+    def _merge_moves_between_roots(self, released:list, now:float) -> list:
+        """
+        Private method merging the released `Deleted` and `Created` halves of the 
+        moves between roots into `Moved` events. A half waits for the other one
+        at most :py:attr:`MOVE_MERGING_DELAY` seconds. Returns the events to release.
+        """
+        if not self._moves_between_roots:
+            return released
+        candidates = self._held + [(x, now) for x in released]
+        deleted = dict(((x.root_id, x.path), x) for x, _ in candidates if x.is_deleted_event())
+        halves = dict(((x[0], x[1]), key) for key, x in self._moves_between_roots.items())
+        merged = set()
+        self._held = []
+        events = []
+        for event, release_time in candidates:
+            if id(event) in merged:
+                continue
+            key = (event.root_id, event.ref_path)
+            if event.is_created_event() and key in self._moves_between_roots:
+                src_root_id, src_path, _ = self._moves_between_roots[key]
+                deleted_event = deleted.get((src_root_id, src_path))
+                if deleted_event is not None:
+                    self._moves_between_roots.pop(key)
+                    merged.add(id(deleted_event))
+                    event.transforms_into_moved_event(src_path, event.ref_path)
+                    event.src_root_id = src_root_id
+                    events.append(event)
+                    continue
+            elif not (event.is_deleted_event() and key in halves):
+                events.append(event)
+                continue
+            # a half of a move, waiting for the other half
+            if now - release_time < MultiRootWatcher.MOVE_MERGING_DELAY:
+                self._held.append((event, release_time))
+            else:
+                self._moves_between_roots.pop(key if event.is_created_event() else halves[key], None)
+                events.append(event)
+        self._held = [x for x in self._held if id(x[0]) not in merged]
+        # some halves may never be released (merged with other events by their handler)
+        held = set((x.root_id, x.ref_path) for x, _ in self._held)
+        for key, (src_root_id, src_path, _) in list(self._moves_between_roots.items()):
+            if (key not in held and (src_root_id, src_path) not in held and 
+                    self.handlers[key[0]].is_idle() and self.handlers[src_root_id].is_idle()):
+                del self._moves_between_roots[key]
+        return [x for x in events if id(x) not in merged]
+
+    def _find_copy_sources(self, event):
+        """
+        Private method looking for the sources of a created file in the other roots: 
+        files with the same size, modification time and hash value. Returns a 
+        ``(root_id, source_paths)`` couple, or ``None``.
+        """
+        if event.file_size is None or event.file_size <= 0:
+            return None
+        sizetime = (event.file_size, event.file_mtime)
+        with self._lock:
+            handlers = [x for x in self.handlers.items() if x[0] != event.root_id]
+        for root_id, handler in handlers:
+            if handler.local_states.get_files_by_sizetime_key(sizetime) and event.file_hash is not None:
+                source_paths = handler.local_states.get_files_by_hash_key(event.file_hash, sizetime)
+                if source_paths:
+                    return root_id, source_paths
+        return None
+
+    def _next_timeout(self, now:float):
+        # number of seconds until something is due, or None
+        timeouts = [x for x in [self._moves.next_timeout(now)] if x is not None]
+        timeouts.extend(release_time + MultiRootWatcher.MOVE_MERGING_DELAY - now for _, release_time in self._held)
+        with self._lock:
+            # the roots being post-treated wake the watcher up when done
+            handlers = [x for root_id, x in self.handlers.items() if root_id not in self._processing]
+        for handler in handlers:
+            if handler.events_list or handler._rescan_requested or handler._inotify.has_pending_simulations():
+                timeout = handler._next_timeout(now)
+                if timeout is not None:
+                    timeouts.append(timeout)
+        return max(min(timeouts), 0) if timeouts else None
+
+    def _posttreat(self, root_id, handler:FusedEventHandler):
+        # one post-treatment at a time per root: the events routed in the meantime wait for the next one
+        with self._lock:
+            self._processing.add(root_id)
+        try:
+            future = self.executor.submit(self._posttreat_in_executor, root_id, handler)
+        except RuntimeError:
+            # executor shut down
+            with self._lock:
+                self._processing.discard(root_id)
+            return
+        future.add_done_callback(lambda x: self._posttreated_root(root_id, x))
+
+    @staticmethod
+    def _posttreat_in_executor(root_id, handler:FusedEventHandler) -> list:
+        # post-treats the events of the root, and returns its released high-level events
+        handler._posttreat_queued_events()
+        released = HighlevelEventHandler.get_available_events(handler)
+        for event in released:
+            event.root_id = root_id
+        return released
+
+    def _posttreated_root(self, root_id, future):
+        try:
+            released = future.result()
+        except Exception:
+            logging.exception('Post-treatment of the events of the root %s failed', root_id)
+            released = []
+        with self._lock:
+            self._posttreated.extend(released)
+            self._processing.discard(root_id)
+        self._wake_up()
+
+    def run(self):
+        """
+        Threading module method, that is executed when calling :py:meth:`start` method.
+        The thread waits for the low-level events of every root, or for the next 
+        deadline, until you call the :py:meth:`stop` method. The post-treatment of
+        the events of each root runs in the ``executor``.
+        """
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup[0], selectors.EVENT_READ)
+        inotify_fd = None
+        try:
+            while not self._stop_watcher.is_set():
+                
+                if inotify_fd is None and self._inotify is not None:
+                    inotify_fd = self._inotify._inotify_fd
+                    selector.register(inotify_fd, selectors.EVENT_READ)
+                ready = [key.fd for key, _ in selector.select(self._next_timeout(time.monotonic()))]
+                if self._stop_watcher.is_set():
+                    break
+                if self._wakeup[0] in ready:
+                    os.read(self._wakeup[0], 1024)
+                if inotify_fd is not None and (inotify_fd in ready or self._inotify.has_pending_simulations()):
+                    self._moves.add(self._inotify.read_events(), time.monotonic())
+                
+                self._route(self._moves.ready_events(time.monotonic()), time.monotonic())
+                with self._lock:
+                    handlers = [x for x in self.handlers.items() if x[0] not in self._processing]
+                for root_id, handler in handlers:
+                    if (handler.lowlevel_event_queue.is_empty() and not handler.events_list and 
+                            not handler._rescan_requested):
+                        continue
+                    self._posttreat(root_id, handler)
+                with self._lock:
+                    released, self._posttreated = self._posttreated, []
+                
+                released = self._merge_moves_between_roots(released, time.monotonic())
+                for event in released:
+                    if event.is_file_created_event() and event.src_root_id is None:
+                        copy_sources = self._find_copy_sources(event)
+                        if copy_sources is not None:
+                            event.src_root_id = copy_sources[0]
+                            event.add_source_paths_and_transforms_into_copied_event(copy_sources[1])
+                if released:
+                    with self._released_lock:
+                        self._released.extend(released)
+        finally:
+            selector.close()
+            with self._lock:
+                self._to_index.clear()
+                for handler in self.handlers.values():
+                    if handler.local_states.indexer is not None:
+                        handler.local_states.indexer.stop()
+            if self._own_executor:
+                self.executor.shutdown(wait=True)
+            self.scheduler.stop()
+            if self._inotify is not None:
+                self._inotify.close()
+            wakeup, self._wakeup = self._wakeup, None
+            for fd in wakeup:
+                os.close(fd)
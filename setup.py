@@ -56,7 +56,7 @@ setup(
     author='Clément Warneys',
     author_email='clement.warneys@gmail.com',
 
-    python_requires='>=3.5',
+    python_requires='>=3.7',
     tests_require=['pytest'],
     
     #===========================================================================